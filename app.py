@@ -7,6 +7,13 @@ import time
 import logging
 from datetime import datetime
 
+from modules.candidate_set import CandidateSet
+from modules.checker import ProxyChecker
+from modules.fetcher import ProxyFetcher
+from modules.rotator import ProxyRotator
+from modules.scheduler import RevalidationScheduler
+from modules.workers import create_proxy_server
+
 # --- 导入您的核心模块 ---
 # 为了简化，我们假设 hq.py 的功能被集成或调用
 # 实际开发中，您需要将 main.py 中的逻辑（如 ProxyFetcher, ProxyChecker）适配为 Flask 可调用的函数
@@ -20,17 +27,38 @@ app.secret_key = 'your-secret-key-change-this-in-production'
 global_state = {
     'is_running_task': False,
     'cancel_event': threading.Event(),
-    'displayed_proxies': set(),
-    'proxy_to_item_map': {}, # 简化为字典
+    'rotator': None, # 代理池 (ProxyRotator)，加载配置后创建，验证可用的代理加入其中
+    'checker': None, # ProxyChecker，获取任务与重测共用
+    'scheduler': None, # 运行中的 RevalidationScheduler，未开启自动重测时为 None
     'current_proxy': "N/A",
     'is_server_running': False,
+    'proxy_server': None, # 运行中的 ProxyServer / ProxyWorkerGroup 实例，未运行时为 None
     'is_auto_rotating': False,
     'settings': {
         'general': {
             'validation_threads': 100,
             'failure_threshold': 3,
             'auto_retest_enabled': False,
-            'auto_retest_interval': 10
+            'auto_retest_interval': 10,
+            'auto_retest_budget': 5,
+            'precheck_concurrency': 2000,
+            'validation_profile': 'deep',
+            'revalidation_profile': 'quick'
+        },
+        'server': {
+            'strategy': 'round_robin',
+            'failover_attempts': 3,
+            'failover_deadline': 15,
+            'happy_eyeballs_delay': 0.3,
+            'metrics_feedback_interval': 10,
+            'max_connections': 10000,
+            'accept_queue_size': 1000,
+            'accept_queue_timeout': 5,
+            'listen_backlog': 1024,
+            'max_per_upstream': 200,
+            'client_rate_limit': 0,
+            'client_rate_burst': 20,
+            'workers': 0 # 大于 1 时以多进程 (SO_REUSEPORT) 模式运行本地代理服务，上面的连接数与速率上限为整体上限，按进程数平分
         },
         'auto_fetch': {
             'fofa': {'enabled': True, 'key': '', 'query': 'protocol=="socks5" && country=="CN" && banner="Method:No"', 'size': 500},
@@ -52,18 +80,20 @@ def log_to_web(message):
     print(formatted_message)
 
 # --- 初始化设置 ---
+def merge_settings(new_settings):
+    """按段合并设置，新设置中没有的键保留原值"""
+    for key, value in new_settings.items():
+        if isinstance(value, dict) and isinstance(global_state['settings'].get(key), dict):
+            global_state['settings'][key].update(value)
+        else:
+            global_state['settings'][key] = value
+
 def load_settings():
     """从文件加载配置"""
     try:
         if os.path.exists("config.json"):
             with open("config.json", 'r', encoding='utf-8') as f:
-                loaded_settings = json.load(f)
-                # Deep merge dictionaries
-                for key, value in loaded_settings.items():
-                    if isinstance(value, dict) and isinstance(global_state['settings'].get(key), dict):
-                        global_state['settings'][key].update(value)
-                    else:
-                        global_state['settings'][key] = value
+                merge_settings(json.load(f))
             log_to_web("已从 config.json 加载配置。")
     except Exception as e:
         log_to_web(f"[!] 加载配置文件失败: {e}")
@@ -78,52 +108,141 @@ def save_settings():
         log_to_web(f"[!] 保存配置文件失败: {e}")
 
 load_settings()
+global_state['rotator'] = ProxyRotator.from_settings(global_state['settings'])
+global_state['checker'] = ProxyChecker()
+
+def apply_auto_retest():
+    """
+    按 general.auto_retest_enabled 启停代理池的增量重测 (RevalidationScheduler)。
+    设置变化后重建调度器，使新的 auto_retest_interval / auto_retest_budget / revalidation_profile 生效。
+    """
+    scheduler = global_state['scheduler']
+    global_state['scheduler'] = None
+    if scheduler is not None:
+        scheduler.stop()
+    settings = global_state['settings']
+    if settings['general'].get('auto_retest_enabled'):
+        scheduler = RevalidationScheduler.from_settings(settings, global_state['rotator'], global_state['checker'], log_queue)
+        scheduler.start()
+        global_state['scheduler'] = scheduler
+
+apply_auto_retest()
+
+def proxy_score(result):
+    """验证结果的综合得分 (0~100)：延迟越低、匿名度越高、速度越快得分越高。"""
+    score = max(0.0, 60 - result['latency'] * 10)
+    score += {'Elite': 25, 'Anonymous': 15}.get(result.get('anonymity'), 0)
+    score += min(result.get('speed') or 0, 5) * 3
+    return round(score, 1)
+
+def proxy_row(proxy_info):
+    """代理池中的代理信息转换为前端表格的一行。"""
+    return {
+        'proxy': proxy_info['proxy'],
+        'score': proxy_info.get('score', 0),
+        'anonymity': proxy_info.get('anonymity', 'Unknown'),
+        'protocol': proxy_info.get('protocol', 'N/A').lower(),
+        'delay': round(proxy_info.get('latency', 0) * 1000),
+        'speed': round(proxy_info.get('speed') or 0, 2),
+        'region': proxy_info.get('location', 'N/A'),
+        'status': proxy_info.get('status'),
+    }
 
-# --- 模拟后台任务 ---
-def mock_fetch_and_validate_task():
-    """模拟获取和验证代理的任务"""
-    global_state['cancel_event'].clear()
+# --- 后台任务 ---
+def fetch_and_validate_task():
+    """
+    获取并验证代理：每个源获取完成后，新代理立即送入 ProxyChecker.validate_stream 的预检与完整验证流水线，
+    验证可用的代理加入 global_state['rotator']。代理池中已有的代理不会重复验证。
+    """
+    cancel_event = global_state['cancel_event']
+    cancel_event.clear()
     global_state['is_running_task'] = True
-    total_steps = 10
-    for i in range(total_steps):
-        if global_state['cancel_event'].is_set():
-            log_to_web("任务已被用户取消。")
-            break
-        time.sleep(1) # 模拟耗时操作
-        progress = int(((i + 1) / total_steps) * 100)
-        log_to_web(f"正在获取和验证代理... {progress}%")
-        # 模拟添加一些代理
-        if i % 3 == 0:
-            proxy_str = f"192.168.1.{i+1}:1080"
-            global_state['displayed_proxies'].add(proxy_str)
-            global_state['proxy_to_item_map'][proxy_str] = {
-                'score': 80 + i,
-                'anonymity': '高匿' if i % 2 == 0 else '普匿',
-                'protocol': 'socks5',
-                'delay': 150 + i*10,
-                'speed': round(5.0 - i*0.2, 2),
-                'region': '中国'
-            }
-    global_state['is_running_task'] = False
-    log_to_web("代理获取与验证任务完成。")
+    general = global_state['settings']['general']
+    rotator = global_state['rotator']
+    checker = global_state['checker']
+    try:
+        if checker.public_ip is None:
+            checker.initialize_public_ip(log_queue)
+        known = CandidateSet.from_proxy_infos(rotator.all_proxies)
+        batches = ProxyFetcher().iter_batches(log_queue, cancel_event, known=known)
+        result_queue = queue.Queue()
+        validator = threading.Thread(target=checker.validate_stream, args=(batches, result_queue, log_queue), kwargs={
+            'max_workers': general.get('validation_threads', 100),
+            'cancel_event': cancel_event,
+            'precheck_concurrency': general.get('precheck_concurrency', 2000),
+            'profile': general.get('validation_profile', 'deep'),
+        }, daemon=True)
+        validator.start()
+
+        added = 0
+        while True:
+            try:
+                result = result_queue.get(timeout=0.5)
+            except queue.Empty:
+                # 任务取消时验证器不发送结束信号
+                if not validator.is_alive() and result_queue.empty():
+                    break
+                continue
+            if result is None:
+                break
+            if result['status'] == 'Working':
+                rotator.add_proxy(dict(result, score=proxy_score(result), last_checked=time.time()))
+                added += 1
+    except Exception as e:
+        log_to_web(f"[!] 代理获取与验证任务出现异常: {e}")
+    else:
+        if cancel_event.is_set():
+            log_to_web(f"任务已被用户取消，已加入 {added} 个可用代理。")
+        else:
+            log_to_web(f"代理获取与验证任务完成，新增可用代理 {added} 个。")
+    finally:
+        global_state['is_running_task'] = False
 
 def mock_start_proxy_server():
-    """模拟启动代理服务器"""
-    # 这里应该调用您 modules/server.py 中的 ProxyServer 类
+    """
+    启动代理服务：按 server 设置创建 ProxyServer (workers > 1 时为多进程的 ProxyWorkerGroup)，
+    以代理池 global_state['rotator'] 作为上游，实例保存在 global_state['proxy_server'] 中供 /api/server_metrics 读取统计。
+    固定模式转发到轮换器的当前代理：尚未设置时使用界面上的当前代理，没有则取分数最高的可用代理。
+    返回 None 表示启动成功，否则返回错误信息 (如端口被占用)。
+    """
+    settings = global_state['settings']
+    rotator = global_state['rotator']
+    current = (rotator.get_current_proxy() or rotator.set_current_proxy_by_address(global_state['current_proxy'])
+               or rotator.get_next_proxy())
+    global_state['current_proxy'] = current['proxy'] if current else "N/A"
+    if current is None:
+        log_to_web("[!] 代理池中没有可用代理，在获取到可用代理并轮换之前，请求将无法转发。")
+    try:
+        server = create_proxy_server(settings, '127.0.0.1', 1801, '127.0.0.1', 1800, rotator, log_queue)
+        server.start_all()
+    except Exception as e:
+        log_to_web(f"[!] 代理服务启动失败: {e}")
+        return f"代理服务启动失败: {e}"
+    if server.listen_errors:
+        server.stop_all()
+        message = f"代理服务启动失败: {'; '.join(server.listen_errors)}"
+        log_to_web(f"[!] {message}")
+        return message
+    global_state['proxy_server'] = server
     global_state['is_server_running'] = True
-    log_to_web("代理服务 (SOCKS5:1800 / HTTP:1801) 已启动。")
+    log_to_web(f"代理服务 (SOCKS5:1800 / HTTP:1801) 已启动，当前代理: {global_state['current_proxy']}。")
+    return None
 
 def mock_stop_proxy_server():
-    """模拟停止代理服务器"""
+    """停止代理服务并清除 global_state 中的实例"""
+    server = global_state['proxy_server']
+    global_state['proxy_server'] = None
     global_state['is_server_running'] = False
+    if server is not None:
+        server.stop_all()
     log_to_web("代理服务已停止。")
 
 def mock_rotate_proxy():
-    """模拟轮换代理"""
-    if global_state['displayed_proxies']:
-        new_proxy = list(global_state['displayed_proxies'])[0] # 简单取第一个
-        global_state['current_proxy'] = new_proxy
-        log_to_web(f"已轮换到代理: {new_proxy}")
+    """按分数轮换到代理池中的下一个可用代理"""
+    proxy_info = global_state['rotator'].get_next_proxy()
+    if proxy_info is not None:
+        global_state['current_proxy'] = proxy_info['proxy']
+        log_to_web(f"已轮换到代理: {proxy_info['proxy']}")
     else:
         log_to_web("无可用代理进行轮换。")
 
@@ -141,7 +260,7 @@ def get_status():
         'is_server_running': global_state['is_server_running'],
         'is_auto_rotating': global_state['is_auto_rotating'],
         'current_proxy': global_state['current_proxy'],
-        'proxy_count': len(global_state['displayed_proxies'])
+        'proxy_count': global_state['rotator'].get_active_proxies_count()
     })
 
 @app.route('/api/logs')
@@ -159,12 +278,7 @@ def get_logs():
 @app.route('/api/proxies')
 def get_proxies():
     """获取当前代理列表 (支持分页和过滤，这里简化)"""
-    # 在真实应用中，这里应该从您的 ProxyRotator 或类似管理器获取数据
-    proxies = []
-    for proxy_str, details in global_state['proxy_to_item_map'].items():
-        proxy_data = details.copy()
-        proxy_data['proxy'] = proxy_str
-        proxies.append(proxy_data)
+    proxies = [proxy_row(proxy_info) for proxy_info in global_state['rotator'].all_proxies]
     
     # 简单排序 (可根据请求参数改进)
     sort_by = request.args.get('sort_by', 'score')
@@ -179,7 +293,7 @@ def start_fetch():
     if global_state['is_running_task']:
         return jsonify({'status': 'error', 'message': '已有任务正在运行'})
     
-    threading.Thread(target=mock_fetch_and_validate_task, daemon=True).start()
+    threading.Thread(target=fetch_and_validate_task, daemon=True).start()
     return jsonify({'status': 'success', 'message': '代理获取任务已启动'})
 
 @app.route('/api/cancel_task', methods=['POST'])
@@ -194,8 +308,7 @@ def cancel_task():
 @app.route('/api/clear_proxies', methods=['POST'])
 def clear_proxies():
     """清空代理列表"""
-    global_state['displayed_proxies'].clear()
-    global_state['proxy_to_item_map'].clear()
+    global_state['rotator'].clear()
     global_state['current_proxy'] = "N/A"
     log_to_web("代理列表已清空。")
     return jsonify({'status': 'success', 'message': '代理列表已清空'})
@@ -206,8 +319,11 @@ def start_server():
     if global_state['is_server_running']:
         return jsonify({'status': 'error', 'message': '代理服务已在运行'})
     
-    threading.Thread(target=mock_start_proxy_server, daemon=True).start()
-    return jsonify({'status': 'success', 'message': '代理服务启动中...'})
+    # 同步启动，端口被占用等错误直接返回给前端
+    error = mock_start_proxy_server()
+    if error:
+        return jsonify({'status': 'error', 'message': error})
+    return jsonify({'status': 'success', 'message': '代理服务已启动'})
 
 @app.route('/api/stop_server', methods=['POST'])
 def stop_server():
@@ -218,6 +334,18 @@ def stop_server():
     threading.Thread(target=mock_stop_proxy_server, daemon=True).start()
     return jsonify({'status': 'success', 'message': '代理服务停止中...'})
 
+@app.route('/api/server_metrics')
+def get_server_metrics():
+    """
+    获取代理服务的实时统计 (按入口/按上游的连接数、流量、错误数与延迟分位数)，
+    内容为 ProxyServer.metrics.snapshot(top) 的结果；服务未运行时 running 为 False。
+    """
+    server = global_state['proxy_server']
+    if server is None:
+        return jsonify({'status': 'error', 'running': False, 'message': '代理服务未运行'})
+    top = request.args.get('top', 100, type=int)
+    return jsonify({'status': 'success', 'running': True, 'metrics': server.metrics.snapshot(top=top)})
+
 @app.route('/api/rotate_proxy', methods=['POST'])
 def rotate_proxy():
     """手动轮换代理"""
@@ -231,8 +359,9 @@ def handle_settings():
         return jsonify(global_state['settings'])
     elif request.method == 'POST':
         new_settings = request.json
-        global_state['settings'].update(new_settings)
+        merge_settings(new_settings)
         save_settings()
+        apply_auto_retest()
         log_to_web("设置已通过API更新并保存。")
         return jsonify({'status': 'success', 'message': '设置已保存'})
 
@@ -242,8 +371,8 @@ def export_proxies():
     filename = "exported_proxies.txt"
     try:
         with open(filename, 'w', encoding='utf-8') as f:
-            for proxy in global_state['displayed_proxies']:
-                f.write(f"{proxy}\n")
+            for proxy_info in global_state['rotator'].get_proxies_by_status('Working'):
+                f.write(f"{proxy_info['proxy']}\n")
         log_to_web(f"代理列表已导出到 {filename}")
         return send_file(filename, as_attachment=True)
     except Exception as e:
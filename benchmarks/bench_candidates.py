@@ -0,0 +1,94 @@
+# benchmarks/bench_candidates.py
+
+"""
+候选代理集合基准：比较 CandidateSet 与改动前的字符串集合 + 逐代理字典。
+模拟一轮获取：多个源的结果逐批到达，批间有大量重复；去重后排除已知代理池，再分片并生成交给验证器的代理信息。
+CandidateSet 在入口处校验并规范化每个地址，改动前的做法不校验。
+统计各步骤耗时以及结果占用的内存 (tracemalloc，只计最终保留的对象)。
+
+用法: python benchmarks/bench_candidates.py --count 200000 --batches 30
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.candidate_set import CandidateSet
+
+
+def make_batches(count, batches, overlap, seed=1):
+    rng = random.Random(seed)
+    pool = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}:"
+            f"{rng.randint(1, 65535)}" for _ in range(count)]
+    size = int(count * overlap / batches)
+    return pool, [rng.sample(pool, size) for _ in range(batches)]
+
+
+# --- 改动前的做法 ---
+def baseline(batches, known):
+    seen = set()
+    for batch in batches:
+        fresh = [p for p in set(batch) if p not in seen]
+        seen.update(fresh)
+    fresh = seen - known
+    return [{'proxy': p, 'protocol': 'http'} for p in fresh]
+
+
+def packed(batches, known):
+    seen = CandidateSet()
+    for batch in batches:
+        seen.update(CandidateSet.from_addresses('http', batch).difference(seen))
+    return seen.difference(known)
+
+
+def measure(label, func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # tracemalloc 本身会拖慢分配，耗时另外单独测一次
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:7.3f}s  结果占用 {retained / 1024 / 1024:7.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=200000, help='不重复的候选代理数')
+    parser.add_argument('--batches', type=int, default=30, help='源的数量 (批数)')
+    parser.add_argument('--overlap', type=float, default=1.5, help='各批总条目数 / 不重复候选数')
+    parser.add_argument('--known', type=float, default=0.2, help='已在代理池中的候选比例')
+    parser.add_argument('--shards', type=int, default=4)
+    args = parser.parse_args()
+
+    pool, batches = make_batches(args.count, args.batches, args.overlap)
+    known_strings = set(pool[:int(len(pool) * args.known)])
+    known = CandidateSet.from_addresses('http', known_strings)
+    print(f"候选: {args.count}，批数: {args.batches}，条目总数: {sum(map(len, batches))}，"
+          f"已知: {len(known_strings)}")
+
+    print("\n[去重 + 排除已知代理]")
+    infos = measure('改动前 (字符串集合 + 字典)', baseline, batches, known_strings)
+    candidates = measure('CandidateSet', packed, batches, known)
+    assert len(infos) == len(candidates)
+
+    print("\n[分片]")
+    measure('改动前 (列表切片)', lambda: [infos[i::args.shards] for i in range(args.shards)])
+    measure('CandidateSet.shard', candidates.shard, args.shards)
+
+    print("\n[还原为字符串 (出口)]")
+    measure('addresses()', candidates.addresses)
+    measure('iter_infos() 逐个消费', lambda: sum(1 for _ in candidates.iter_infos()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# benchmarks/bench_parser.py
+
+"""
+代理列表解析基准：在大规模合成列表上比较 modules/proxy_parser 与改动前的逐行解析。
+- text:    纯 "ip:端口" 列表，对照为改动前 ProxyFetcher._parse_proxies_from_text (先 json.loads 再逐行 re.match)；
+- schemed: 带协议头和认证信息的 "socks5://user:pass@ip:端口"，对照为改动前 hq.py 的 deduce_protocol + clean_proxy_line；
+- jsonl:   每行一个 JSON 对象 (fate0/proxylist 格式)，对照为改动前 hq.py 的逐行 json.loads；
+- json:    {"data": [{"ip", "port", ...}]} (geonode 格式)，对照为改动前的 json.loads + 列表推导。
+新解析器分别测 parse_proxy_strings (去重的 "ip:端口")、parse_addresses ((地址, 协议)) 与 parse_proxies ((IPv4 整数, 端口, 协议))，
+输入均为响应的原始 bytes。
+
+用法: python benchmarks/bench_parser.py --count 300000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.proxy_parser import parse_addresses, parse_proxies, parse_proxy_strings
+
+SCHEMES = ['socks5', 'socks4', 'http', 'https']
+
+
+# --- 改动前的实现，作为对照 ---
+def baseline_fetcher(text):
+    try:
+        data = json.loads(text)
+        if 'data' in data and isinstance(data['data'], list):
+            return [f"{item['ip']}:{item['port']}" for item in data['data']]
+    except json.JSONDecodeError:
+        pass
+    return [line.strip() for line in text.splitlines() if re.match(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+', line.strip())]
+
+
+def baseline_clean_proxy_line(line):
+    line = line.strip()
+    if "//" in line:
+        line = line.split('//')[-1]
+    if "@" in line:
+        line = line.split('@')[-1]
+    parts = line.split(':')
+    if len(parts) > 2:
+        line = f"{parts[0]}:{parts[1]}"
+    if ':' in line and line.split(':')[0] and line.split(':')[1]:
+        return line.strip()
+    return None
+
+
+def baseline_deduce_protocol(original_line, default_protocol):
+    line_lower = original_line.lower()
+    if 'socks5' in line_lower or 'socks' in line_lower:
+        return 'socks5'
+    if 'socks4' in line_lower:
+        return 'socks4'
+    if 'http' in line_lower:
+        return 'http'
+    return default_protocol
+
+
+def baseline_hq(text, parser, default_protocol='socks5'):
+    result = {'http': set(), 'socks5': set()}
+    for line in text.strip().split('\n'):
+        if not line.strip():
+            continue
+        protocol = baseline_deduce_protocol(line, default_protocol)
+        if protocol not in result:
+            continue
+        cleaned_proxy = None
+        if parser == 'text':
+            cleaned_proxy = baseline_clean_proxy_line(line)
+        else:
+            try:
+                proxy_info = json.loads(line)
+                host = proxy_info.get("host")
+                port = proxy_info.get("port")
+                if host and port:
+                    cleaned_proxy = f"{host}:{port}"
+            except json.JSONDecodeError:
+                continue
+        if cleaned_proxy:
+            result[protocol].add(cleaned_proxy)
+    return result
+
+
+# --- 合成数据 ---
+def random_address(rng):
+    return (f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+            rng.randint(1, 65535))
+
+
+def make_payloads(count, seed=1):
+    rng = random.Random(seed)
+    addresses = [random_address(rng) for _ in range(count)]
+    text = "\n".join(f"{ip}:{port}" for ip, port in addresses)
+    schemed = "\n".join(f"{SCHEMES[i % 4]}://user{i % 7}:pw@{ip}:{port}" for i, (ip, port) in enumerate(addresses))
+    jsonl = "\n".join(json.dumps({'host': ip, 'port': port, 'type': 'http', 'country': 'CN', 'response_time': 1.5})
+                      for ip, port in addresses)
+    doc = json.dumps({'data': [{'ip': ip, 'port': str(port), 'protocols': ['http'], 'country': 'CN'}
+                               for ip, port in addresses]})
+    return {
+        'text': (text, lambda data: baseline_fetcher(data.decode())),
+        'schemed': (schemed, lambda data: baseline_hq(data.decode(), 'text')),
+        'jsonl': (jsonl, lambda data: baseline_hq(data.decode(), 'json')),
+        'json': (doc, lambda data: baseline_fetcher(data.decode())),
+    }
+
+
+def timed(func, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=300000, help='每种格式的条目数')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快一次')
+    parser.add_argument('--formats', default='text,schemed,jsonl,json')
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.count)
+    print(f"条目数: {args.count}，每项取 {args.repeat} 次中最快的一次")
+    for fmt in args.formats.split(','):
+        text, baseline = payloads[fmt]
+        data = text.encode()
+        print(f"\n[{fmt}] {len(data) / 1024 / 1024:.1f} MB")
+        candidates = [
+            ('改动前', baseline),
+            ('parse_proxy_strings', parse_proxy_strings),
+            ('parse_addresses', parse_addresses),
+            ('parse_proxies', parse_proxies),
+        ]
+        base = None
+        for label, func in candidates:
+            elapsed = timed(func, data, args.repeat)
+            base = base or elapsed
+            print(f"  {label:<20} {elapsed:7.3f}s  {args.count / elapsed / 1e6:6.2f} M条/秒  "
+                  f"{len(data) / elapsed / 1024 / 1024:7.1f} MB/s  x{base / elapsed:4.1f}")
+
+
+if __name__ == '__main__':
+    main()
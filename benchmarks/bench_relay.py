@@ -0,0 +1,201 @@
+# benchmarks/bench_relay.py
+
+"""
+隧道转发吞吐量基准：比较 ProxyServer 的几种转发方式
+- splice:    数据经管道在内核中转发 (Linux)；
+- recv_into: 池化大缓冲区 + memoryview；
+- baseline:  改动前的 sock_recv(65536) + sock_sendall，每块数据分配一个新的 bytes。
+
+上游是本机的 SOCKS5 "数据源"，握手后按客户端要求发送指定字节数；客户端在独立进程中
+通过本地服务的 SOCKS5 入口并行下载，统计总吞吐量以及服务端进程的 CPU 时间。
+
+--workers N 时以多进程模式 (ProxyWorkerGroup, SO_REUSEPORT) 运行服务，CPU 时间为各工作进程之和 (含进程启动开销)。
+
+用法: python benchmarks/bench_relay.py --megabytes 512 --streams 4 [--workers 4]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import resource
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_fleet import free_ports
+from modules.rotator import ProxyRotator
+from modules.server import ProxyServer, SPLICE_AVAILABLE
+from modules.workers import ProxyWorkerGroup
+
+BLOCK = b"x" * (1024 * 1024)
+
+
+class BaselineServer(ProxyServer):
+    """改动前的转发实现，作为对照。"""
+    async def _pump(self, src, dst, count):
+        loop = self._loop
+        try:
+            while True:
+                data = await asyncio.wait_for(loop.sock_recv(src, 65536), self.idle_timeout)
+                if not data:
+                    break
+                count(len(data))
+                await loop.sock_sendall(dst, data)
+        finally:
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+
+# --- 数据源上游 ---
+def _recv_exactly(sock, n):
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("连接提前关闭")
+        buf += chunk
+    return buf
+
+
+def _serve_source(conn):
+    """SOCKS5 握手后读取 8 字节长度，发送对应数量的数据后关闭。"""
+    try:
+        head = _recv_exactly(conn, 2)
+        _recv_exactly(conn, head[1])
+        conn.sendall(b"\x05\x00")
+        request = _recv_exactly(conn, 4)
+        if request[3] == 3:
+            _recv_exactly(conn, _recv_exactly(conn, 1)[0])
+        else:
+            _recv_exactly(conn, 4)
+        _recv_exactly(conn, 2)
+        conn.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+        remaining = struct.unpack('!Q', _recv_exactly(conn, 8))[0]
+        view = memoryview(BLOCK)
+        while remaining > 0:
+            size = min(remaining, len(BLOCK))
+            conn.sendall(view[:size])
+            remaining -= size
+    except Exception:
+        pass
+    finally:
+        conn.close()
+
+
+def _run_source(port, ready):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(128)
+    ready.set()
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=_serve_source, args=(conn,), daemon=True).start()
+
+
+# --- 客户端 ---
+def _download(socks5_port, size, results):
+    sock = socket.create_connection(('127.0.0.1', socks5_port))
+    try:
+        sock.sendall(b"\x05\x01\x00")
+        _recv_exactly(sock, 2)
+        host = b"source.local"
+        sock.sendall(b"\x05\x01\x00\x03" + bytes([len(host)]) + host + struct.pack('!H', 9))
+        if _recv_exactly(sock, 10)[1] != 0:
+            raise ConnectionError("SOCKS5 握手失败")
+        sock.sendall(struct.pack('!Q', size))
+        buf = bytearray(1024 * 1024)
+        received = 0
+        while True:
+            n = sock.recv_into(buf)
+            if not n:
+                break
+            received += n
+        results.append(received)
+    finally:
+        sock.close()
+
+
+def _run_clients(socks5_port, streams, size, output):
+    results = []
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_download, args=(socks5_port, size, results)) for _ in range(streams)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    output.put((sum(results), time.perf_counter() - start))
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_mode(mode, source_port, args):
+    rotator = ProxyRotator()
+    rotator.add_proxy({'proxy': f"127.0.0.1:{source_port}", 'protocol': 'SOCKS5', 'status': 'Working',
+                       'location': '本地', 'latency': 0.001, 'score': 100})
+    rotator.set_current_proxy_by_address(f"127.0.0.1:{source_port}")
+    http_port, socks5_port = free_ports(2)
+    if mode == 'baseline':
+        server = BaselineServer('127.0.0.1', http_port, '127.0.0.1', socks5_port, rotator, queue.Queue())
+    elif args.workers > 1:
+        server = ProxyWorkerGroup('127.0.0.1', http_port, '127.0.0.1', socks5_port, rotator, queue.Queue(),
+                                  workers=args.workers, relay_mode=mode)
+    else:
+        server = ProxyServer('127.0.0.1', http_port, '127.0.0.1', socks5_port, rotator, queue.Queue(), relay_mode=mode)
+    server.start_all()
+
+    output = multiprocessing.Queue()
+    size = args.megabytes * 1024 * 1024 // args.streams
+    cpu_start = time.process_time()
+    client = multiprocessing.Process(target=_run_clients, args=(socks5_port, args.streams, size, output))
+    client.start()
+    received, elapsed = output.get()
+    client.join()
+    cpu = time.process_time() - cpu_start
+    children_cpu = _children_cpu()
+    server.stop_all()
+    if isinstance(server, ProxyWorkerGroup):
+        # 工作进程退出后其 CPU 时间才计入 RUSAGE_CHILDREN
+        cpu = _children_cpu() - children_cpu
+
+    mb = received / 1024 / 1024
+    print(f"{mode:<10} {mb:8.0f} MB  {elapsed:7.2f}s  {mb / elapsed:9.1f} MB/s  服务端CPU {cpu:6.2f}s "
+          f"({cpu / mb * 1000:6.2f} ms/MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=512, help='每种方式下载的总数据量')
+    parser.add_argument('--streams', type=int, default=4, help='并行下载的隧道数')
+    parser.add_argument('--modes', default='baseline,recv_into,splice')
+    parser.add_argument('--workers', type=int, default=1, help='服务端工作进程数 (baseline 始终为单进程)')
+    args = parser.parse_args()
+
+    source_port = free_ports(1)[0]
+    ready = multiprocessing.Event()
+    source = multiprocessing.Process(target=_run_source, args=(source_port, ready), daemon=True)
+    source.start()
+    ready.wait()
+
+    print(f"数据量: {args.megabytes} MB，并行隧道: {args.streams}，工作进程: {args.workers}")
+    for mode in args.modes.split(','):
+        if mode == 'splice' and not SPLICE_AVAILABLE:
+            print("splice     当前平台不可用，跳过")
+            continue
+        run_mode(mode, source_port, args)
+    source.terminate()
+
+
+if __name__ == '__main__':
+    main()
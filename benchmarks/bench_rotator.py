@@ -0,0 +1,67 @@
+# benchmarks/bench_rotator.py
+
+"""
+ProxyRotator 微基准：在 N 个代理规模下测量插入、查询、更新、删除的单次耗时。
+
+用法: python benchmarks/bench_rotator.py --count 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.rotator import ProxyRotator
+
+COUNTRIES = ['中国', '美国', '日本', '香港', '新加坡', '德国']
+PROTOCOLS = ['HTTP', 'SOCKS4', 'SOCKS5']
+
+
+def make_proxy(i):
+    return {
+        'proxy': f"{(i >> 24) & 0xff or 1}.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}:{1080 + i % 1000}",
+        'protocol': PROTOCOLS[i % len(PROTOCOLS)],
+        'location': COUNTRIES[i % len(COUNTRIES)],
+        'latency': random.uniform(0.05, 5.0),
+        'score': random.randint(0, 100),
+    }
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} 总计 {elapsed:8.3f}s | 单次 {elapsed / count * 1e6:8.2f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--ops', type=int, default=10000, help='查询/更新/删除的次数')
+    args = parser.parse_args()
+
+    rotator = ProxyRotator()
+    proxies = [make_proxy(i) for i in range(args.count)]
+    sample = random.sample(proxies, min(args.ops, args.count))
+    print(f"代理数量: {args.count}，抽样操作: {len(sample)}")
+
+    timed("add_proxy", args.count, lambda: [rotator.add_proxy(p) for p in proxies])
+    timed("首次构建轮换环", 1, rotator.get_next_proxy)
+    timed("get_next_proxy", len(sample), lambda: [rotator.get_next_proxy() for _ in sample])
+    timed("get_proxy_by_address", len(sample), lambda: [rotator.get_proxy_by_address(p['proxy']) for p in sample])
+    timed("update_proxy(score)", len(sample),
+          lambda: [rotator.update_proxy(p['proxy'], {'score': random.randint(0, 100)}) for p in sample])
+    timed("update_proxy(status)", len(sample),
+          lambda: [rotator.update_proxy(p['proxy'], {'status': 'Unavailable'}) for p in sample])
+    timed("report_failure", len(sample), lambda: [rotator.report_failure(p['proxy']) for p in sample])
+    timed("set_current_proxy_by_address", len(sample),
+          lambda: [rotator.set_current_proxy_by_address(p['proxy']) for p in sample])
+    timed("get_active_proxies_count", 100, lambda: [rotator.get_active_proxies_count() for _ in range(100)])
+    timed("remove_proxy", len(sample), lambda: [rotator.remove_proxy(p['proxy']) for p in sample])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# benchmarks/bench_server_load.py
+
+"""
+ProxyServer 并发压测：在本机启动若干个"回显"上游 SOCKS5 代理（握手后把收到的数据原样返回），
+再由客户端进程同时建立 N 条经过本地服务的隧道 (HTTP CONNECT 与 SOCKS5 各一半)，
+全部建立后保持一段时间，期间统计服务端同时在处理的连接数。
+
+服务端每条隧道占用 2 个文件描述符，1 万条隧道需要 ulimit -n 不低于约 21000。
+
+用法: python benchmarks/bench_server_load.py --tunnels 10000 --upstreams 8
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import resource
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_fleet import free_ports
+from modules.rotator import ProxyRotator
+from modules.server import ProxyServer
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+# --- 回显上游 ---
+async def _echo_upstream(reader, writer):
+    """最小的 SOCKS5 上游：接受无认证 CONNECT，回复成功后回显所有数据。"""
+    try:
+        head = await reader.readexactly(2)
+        await reader.readexactly(head[1])
+        writer.write(b"\x05\x00")
+        request = await reader.readexactly(4)
+        atyp = request[3]
+        if atyp == 1:
+            await reader.readexactly(4)
+        elif atyp == 3:
+            await reader.readexactly((await reader.readexactly(1))[0])
+        else:
+            await reader.readexactly(16)
+        await reader.readexactly(2)
+        writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+def _run_upstreams(ports, ready):
+    raise_fd_limit()
+
+    async def serve():
+        servers = [await asyncio.start_server(_echo_upstream, '127.0.0.1', port, backlog=4096) for port in ports]
+        ready.set()
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+    asyncio.run(serve())
+
+
+# --- 客户端 ---
+async def _open_tunnel(index, http_port, socks5_port):
+    if index % 2:
+        reader, writer = await asyncio.open_connection('127.0.0.1', socks5_port)
+        writer.write(b"\x05\x01\x00")
+        await reader.readexactly(2)
+        host = b"echo.local"
+        writer.write(b"\x05\x01\x00\x03" + bytes([len(host)]) + host + struct.pack('!H', 7))
+        reply = await reader.readexactly(10)
+        if reply[1] != 0:
+            raise ConnectionError(f"SOCKS5 失败: {reply[1]}")
+    else:
+        reader, writer = await asyncio.open_connection('127.0.0.1', http_port)
+        writer.write(b"CONNECT echo.local:7 HTTP/1.1\r\nHost: echo.local:7\r\n\r\n")
+        status = await reader.readuntil(b"\r\n\r\n")
+        if b" 200 " not in status.split(b"\r\n", 1)[0]:
+            raise ConnectionError(status.split(b"\r\n", 1)[0].decode())
+    return reader, writer
+
+
+async def _client(index, args, stats, all_up, ramp):
+    payload = f"ping-{index}\n".encode()
+    writer = None
+    try:
+        async with ramp:
+            reader, writer = await asyncio.wait_for(_open_tunnel(index, args.http_port, args.socks5_port), 30)
+            writer.write(payload)
+            if await asyncio.wait_for(reader.readexactly(len(payload)), 30) != payload:
+                raise ConnectionError("回显内容不一致")
+        stats['up'] += 1
+        if stats['up'] + stats['failed'] == args.tunnels:
+            all_up.set()
+        await all_up.wait()
+        # 全部建立后再走一轮数据，确认隧道在高并发下仍然可用
+        await asyncio.sleep(args.hold)
+        writer.write(payload)
+        if await asyncio.wait_for(reader.readexactly(len(payload)), 30) == payload:
+            stats['verified'] += 1
+    except Exception as e:
+        stats['failed'] += 1
+        stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+        if stats['up'] + stats['failed'] == args.tunnels:
+            all_up.set()
+    finally:
+        if writer:
+            writer.close()
+
+
+def _run_clients(args, results):
+    raise_fd_limit()
+
+    async def run():
+        stats = {'up': 0, 'failed': 0, 'verified': 0, 'errors': {}}
+        all_up = asyncio.Event()
+        ramp = asyncio.Semaphore(args.ramp)
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(_client(i, args, stats, all_up, ramp)) for i in range(args.tunnels)]
+        await all_up.wait()
+        stats['establish_seconds'] = time.perf_counter() - start
+        await asyncio.gather(*tasks)
+        return stats
+    results.put(asyncio.run(run()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tunnels', type=int, default=10000)
+    parser.add_argument('--upstreams', type=int, default=8, help='回显上游的数量')
+    parser.add_argument('--ramp', type=int, default=1000, help='同时进行握手的客户端上限')
+    parser.add_argument('--hold', type=float, default=3.0, help='全部隧道建立后保持的秒数')
+    parser.add_argument('--strategy', default='round_robin')
+    parser.add_argument('--max-connections', type=int, default=0, help='服务端并发连接上限，0 为不限')
+    parser.add_argument('--queue', type=int, default=1000, help='达到上限后等待空位的连接数上限')
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    if limit < args.tunnels * 2 + 1000:
+        print(f"[!] 文件描述符上限为 {limit}，不足以支撑 {args.tunnels} 条隧道 (约需 {args.tunnels * 2 + 1000})。")
+
+    upstream_ports = free_ports(args.upstreams)
+    ready = multiprocessing.Event()
+    upstream_proc = multiprocessing.Process(target=_run_upstreams, args=(upstream_ports, ready), daemon=True)
+    upstream_proc.start()
+    ready.wait()
+
+    rotator = ProxyRotator()
+    for port in upstream_ports:
+        rotator.add_proxy({'proxy': f"127.0.0.1:{port}", 'protocol': 'SOCKS5', 'status': 'Working',
+                           'location': '本地', 'latency': 0.001, 'score': 100})
+    args.http_port, args.socks5_port = free_ports(2)
+    log_queue = queue.Queue()
+    server = ProxyServer('127.0.0.1', args.http_port, '127.0.0.1', args.socks5_port, rotator, log_queue,
+                         strategy=args.strategy, max_connections=args.max_connections, accept_queue_size=args.queue)
+    server.start_all()
+    server.rotate_per_request = True
+
+    results = multiprocessing.Queue()
+    client_proc = multiprocessing.Process(target=_run_clients, args=(args, results), daemon=True)
+    start = time.perf_counter()
+    client_proc.start()
+    peak = 0
+    while client_proc.is_alive() and results.empty():
+        peak = max(peak, server.active_connections)
+        time.sleep(0.05)
+    stats = results.get()
+    elapsed = time.perf_counter() - start
+    client_proc.join()
+
+    snapshot = server.metrics.snapshot(top=0)
+    server.stop_all()
+    upstream_proc.terminate()
+
+    print(f"隧道数: {args.tunnels}，上游: {args.upstreams}，策略: {args.strategy}")
+    print(f"建立成功: {stats['up']}，失败: {stats['failed']}，保持后仍可用: {stats['verified']}")
+    print(f"全部建立耗时: {stats['establish_seconds']:.2f}s，服务端同时处理的连接峰值: {peak}，总耗时: {elapsed:.2f}s")
+    if stats['errors']:
+        print(f"错误分布: {stats['errors']}")
+    for name, frontend in snapshot['frontends'].items():
+        print(f"{name:<7} 接入: {frontend['accepted']}，排队: {frontend['queued']}，拒绝: {frontend['rejected']}，"
+              f"错误: {frontend['errors']}，首字节延迟(ms): {frontend['ttfb_ms']}")
+
+
+if __name__ == '__main__':
+    main()
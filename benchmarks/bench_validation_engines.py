@@ -0,0 +1,70 @@
+# benchmarks/bench_validation_engines.py
+
+"""
+对比线程池引擎与 asyncio 引擎的 ProxyChecker.validate_all 性能。
+
+用法: python benchmarks/bench_validation_engines.py --count 5000 --delay-ms 50
+"""
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.checker import ProxyChecker
+from benchmarks.fake_fleet import VALIDATION_TARGETS, start_fleet, make_candidates
+
+
+def run_engine(engine, candidates, args):
+    checker = ProxyChecker(timeout=5)
+    checker.validation_targets = dict(VALIDATION_TARGETS)
+    checker.geo.lookup_local = lambda ip: '本地'
+
+    result_queue, log_queue = queue.Queue(), queue.Queue()
+    start = time.perf_counter()
+    worker = threading.Thread(target=checker.validate_all, kwargs=dict(
+        proxies_by_protocol={'http': candidates}, result_queue=result_queue, log_queue=log_queue,
+        validation_mode='offline', max_workers=args.workers, cancel_event=threading.Event(),
+        engine=engine, async_concurrency=args.concurrency))
+    worker.start()
+
+    first_result, working = None, 0
+    while True:
+        result = result_queue.get()
+        if result is None:
+            break
+        if first_result is None:
+            first_result = time.perf_counter() - start
+        if result['status'] == 'Working':
+            working += 1
+    elapsed = time.perf_counter() - start
+    worker.join()
+    print(f"{engine:>8}: 总耗时 {elapsed:7.2f}s | 首个结果 {first_result or 0:6.2f}s | "
+          f"可用 {working} / {len(candidates)} | {len(candidates) / elapsed:8.0f} 个/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--dead-ratio', type=float, default=0.5)
+    parser.add_argument('--delay-ms', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=100, help='线程引擎的完整验证线程数')
+    parser.add_argument('--concurrency', type=int, default=5000, help='asyncio 引擎的并发上限')
+    parser.add_argument('--engines', default='thread,asyncio')
+    args = parser.parse_args()
+
+    fleet, ports = start_fleet(delay=args.delay_ms / 1000)
+    try:
+        candidates = make_candidates(args.count, ports, args.dead_ratio)
+        for engine in args.engines.split(','):
+            run_engine(engine, candidates, args)
+    finally:
+        fleet.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/fake_fleet.py
+
+"""
+本地假代理集群，供基准测试使用。
+
+在若干端口上启动一个极简的 HTTP 代理（绝对 URI 转发），按路径返回固定内容，
+并可为每个请求注入延迟来模拟慢速的免费代理。由于 127.0.0.0/8 整段都路由到回环网卡，
+同一组端口可以用不同的 127.x.y.z 地址表示成大量"不同"的代理。
+"""
+
+import asyncio
+import json
+import multiprocessing
+import socket
+
+BENCH_HOST = "bench.local"
+VALIDATION_TARGETS = {
+    'latency_check': f'http://{BENCH_HOST}/',
+    'anonymity_check': f'http://{BENCH_HOST}/get?show_env=1',
+    'speed_check': f'http://{BENCH_HOST}/100kb.test',
+}
+
+_ANON_BODY = json.dumps({'origin': '203.0.113.7', 'headers': {}}).encode()
+_SPEED_BODY = b"x" * 100 * 1024
+
+
+def _response_for(path: str) -> bytes:
+    if path.startswith('/get'):
+        body = _ANON_BODY
+    elif path.startswith('/100kb'):
+        body = _SPEED_BODY
+    else:
+        body = b"ok"
+    return body
+
+
+async def _handle(reader, writer, delay):
+    """按 HTTP/1.1 处理请求，除非客户端要求 Connection: close，否则保持连接复用。"""
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            method, target, _ = head.split(b"\r\n", 1)[0].decode().split()
+            path = '/' + target.split('/', 3)[3] if target.startswith('http://') else target
+            keep_alive = b"connection: close" not in head.lower()
+            if delay:
+                await asyncio.sleep(delay)
+            body = _response_for(path)
+            connection = "keep-alive" if keep_alive else "close"
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Length: {len(body)}\r\nConnection: {connection}\r\n\r\n".encode())
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve(ports, delay, ready):
+    servers = []
+    for port in ports:
+        servers.append(await asyncio.start_server(lambda r, w: _handle(r, w, delay), '0.0.0.0', port, backlog=4096))
+    ready.set()
+    await asyncio.gather(*(s.serve_forever() for s in servers))
+
+
+def _run_fleet(ports, delay, ready):
+    asyncio.run(_serve(ports, delay, ready))
+
+
+def free_ports(n: int):
+    socks = []
+    for _ in range(n):
+        s = socket.socket()
+        s.bind(('0.0.0.0', 0))
+        socks.append(s)
+    ports = [s.getsockname()[1] for s in socks]
+    for s in socks:
+        s.close()
+    return ports
+
+
+def start_fleet(num_ports: int = 20, delay: float = 0.05):
+    """在子进程中启动假代理集群，返回 (process, ports)。"""
+    ports = free_ports(num_ports)
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=_run_fleet, args=(ports, delay, ready), daemon=True)
+    process.start()
+    ready.wait(10)
+    return process, ports
+
+
+def make_candidates(count: int, live_ports, dead_ratio: float = 0.5):
+    """生成候选代理地址：一部分指向假代理端口，其余指向无人监听的端口。"""
+    dead_ports = free_ports(4)
+    candidates = []
+    for i in range(count):
+        ip = f"127.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{(i & 0xff) or 1}"
+        if (i % 100) < dead_ratio * 100:
+            port = dead_ports[i % len(dead_ports)]
+        else:
+            port = live_ports[i % len(live_ports)]
+        candidates.append(f"{ip}:{port}")
+    return candidates
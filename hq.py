@@ -1,75 +1,102 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from modules.proxy_parser import parse_addresses
 
-def clean_proxy_line(line):
-    """
-    清理并格式化单行代理数据，只返回 "ip:端口" 或 "域名:端口" 的形式。
-    """
-    line = line.strip()
-    # 先剥离协议头和认证信息
-    if "//" in line:
-        line = line.split('//')[-1]
-    if "@" in line:
-        line = line.split('@')[-1]
-
-    # 再处理可能存在的国家等额外信息
-    parts = line.split(':')
-    if len(parts) > 2:
-        line = f"{parts[0]}:{parts[1]}"
-
-    if ':' in line and line.split(':')[0] and line.split(':')[1]:
-        return line.strip()
-    return None
 
-
-# --- 核心优化：智能协议推断函数 ---
-def deduce_protocol(original_line, default_protocol):
-    """
-    根据原始行内容推断协议。
-    如果行内有明确标识，则使用标识的协议。
-    否则，使用源定义的默认协议。
-    """
-    line_lower = original_line.lower()
-    if 'socks5' in line_lower or 'socks' in line_lower:  # 包含 "socks" 但不包含 "socks5" 的也归为 SOCKS5
-        return 'socks5'
-    if 'socks4' in line_lower:
-        return 'socks4'  # 也可以单独处理 SOCKS4
-    if 'http' in line_lower:
-        return 'http'
-    # 如果行内没有明确标识，则返回该源的默认协议
-    return default_protocol
-
-
-# --- 代理源定义，'protocol' 在此作为后备默认值 ---
+# --- 代理源定义，'protocol' 在此作为后备默认值；内容格式 (纯文本 / JSON / JSON Lines) 由解析器自动识别 ---
 SOURCES = [
     {"name": "TheSpeedX/PROXY-List", "url": "https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/socks5.txt",
-     "parser": "text", "protocol": "socks5"},
+     "protocol": "socks5"},
     {"name": "hookzof/socks5_list", "url": "https://raw.githubusercontent.com/hookzof/socks5_list/master/proxy.txt",
-     "parser": "text", "protocol": "socks5"},
-    {"name": "ProxyScraper/ProxyScraper",
-     "url": "https://raw.githubusercontent.com/ProxyScraper/ProxyScraper/main/socks5.txt", "parser": "text",
      "protocol": "socks5"},
+    {"name": "ProxyScraper/ProxyScraper",
+     "url": "https://raw.githubusercontent.com/ProxyScraper/ProxyScraper/main/socks5.txt", "protocol": "socks5"},
     {"name": "proxifly/free-proxy-list",
      "url": "https://cdn.jsdelivr.net/gh/proxifly/free-proxy-list@main/proxies/protocols/http/data.txt",
-     "parser": "text", "protocol": "http"},
+     "protocol": "http"},
     {"name": "zloi-user/hideip.me", "url": "https://raw.githubusercontent.com/zloi-user/hideip.me/master/socks5.txt",
-     "parser": "text", "protocol": "socks5"},
-    {"name": "gfpcom/free-proxy-list",
-     "url": "https://raw.githubusercontent.com/gfpcom/free-proxy-list/main/list/socks5.txt", "parser": "text",
      "protocol": "socks5"},
+    {"name": "gfpcom/free-proxy-list",
+     "url": "https://raw.githubusercontent.com/gfpcom/free-proxy-list/main/list/socks5.txt", "protocol": "socks5"},
     {"name": "monosans/proxy-list", "url": "https://raw.githubusercontent.com/monosans/proxy-list/main/proxies.json",
-     "parser": "json-list", "protocol": "socks5"},
+     "protocol": "socks5"},
     {"name": "fate0/proxylist", "url": "https://raw.githubusercontent.com/fate0/proxylist/master/proxy.list",
-     "parser": "json", "protocol": "http"}  # fate0/proxylist 大部分是http
+     "protocol": "http"}  # fate0/proxylist 大部分是http
 ]
 
 
-def save_proxies_to_file(proxies_set, filename, output_dir):
+# 并发下载的线程数与单个源的超时
+MAX_WORKERS = 8
+REQUEST_TIMEOUT = 15
+# 记录各源的 ETag / Last-Modified 以及上次解析结果，未变化的源返回 304 时直接复用
+CACHE_FILE = ".hq_cache.json"
+OUTPUT_FILES = {'http': "http.txt", 'socks5': "git.txt"}
+# 解析规则变化时递增，旧版本解析结果的缓存条目作废 (不再发送条件请求)
+PARSER_VERSION = 3
+
+
+def parse_source(source, data):
     """
-    将代理集合保存到指定文件。
+    解析一个源的内容 (str 或 bytes)，按条目自带的协议 (协议头或 JSON 字段) 分类，未标明的使用源的默认协议。
+    返回 {'http': [地址...], 'socks5': [地址...]}，地址为不带协议前缀的 "ip:端口" 或 "域名:端口"。
+    """
+    result = {protocol: set() for protocol in OUTPUT_FILES}
+    for address, protocol in parse_addresses(data, source['protocol']):
+        if protocol == 'socks4':
+            protocol = 'socks5'  # 与之前的规则一致：SOCKS4 也归为 SOCKS5
+        if protocol in result:
+            result[protocol].add(address)
+    return {protocol: sorted(proxies) for protocol, proxies in result.items()}
+
+
+def load_cache(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    """先写临时文件再替换，中途中断也不会留下损坏的缓存。"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def fetch_source(session, source, cached):
+    """
+    下载并解析一个源。有缓存时发送条件请求 (If-None-Match / If-Modified-Since)，
+    源未变化 (304) 时直接返回缓存的解析结果。返回 (是否来自缓存, 缓存条目)。
+    """
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    response = session.get(source['url'], headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached:
+        return True, cached
+    response.raise_for_status()
+    entry = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'parser_version': PARSER_VERSION,
+        'proxies': parse_source(source, response.content),
+    }
+    return False, entry
+
+
+def save_proxies_to_file(proxies_set, filename, output_dir, prefix):
+    """
+    将代理列表 (不带前缀、无重复的地址) 排序后加上协议前缀保存到指定文件。内容与现有文件相同时不重写。
     """
     if not proxies_set:
         print(f"\n[-] 代理列表 '{filename}' 为空，无需保存。")
@@ -77,12 +104,18 @@ def save_proxies_to_file(proxies_set, filename, output_dir):
 
     file_path = os.path.join(output_dir, filename)
     try:
+        content = "".join(f"{prefix}{proxy}\n" for proxy in sorted(proxies_set))
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                if f.read() == content:
+                    print(f"\n[-] '{filename}' 内容未变化 ({len(proxies_set)} 个代理)，跳过写入。")
+                    return
+        except OSError:
+            pass
         os.makedirs(output_dir, exist_ok=True)
-        sorted_proxies = sorted(list(proxies_set))
         with open(file_path, 'w', encoding='utf-8') as f:
-            for proxy in sorted_proxies:
-                f.write(f"{proxy}\n")
-        print(f"\n[SUCCESS] {len(sorted_proxies)} 个代理已成功保存到: {file_path}")
+            f.write(content)
+        print(f"\n[SUCCESS] {len(proxies_set)} 个代理已成功保存到: {file_path}")
 
     except Exception as e:
         print(f"\n[ERROR] 保存文件 '{filename}' 时出错: {e}")
@@ -90,72 +123,58 @@ def save_proxies_to_file(proxies_set, filename, output_dir):
 
 def fetch_and_save_proxies():
     """
-    获取、清理、并智能分类合并所有来源的代理，然后分别保存到文件。
+    并发获取、清理、并智能分类合并所有来源的代理，然后分别保存到文件。
+    总耗时取决于最慢的一个源；未变化的源通过条件请求跳过下载和解析。
     """
-    http_proxies = set()
-    socks5_proxies = set()
-    # 可以选择性地为SOCKS4创建集合
-    # socks4_proxies = set()
-
-    for source in SOURCES:
-        print(f"[*] 正在从 {source['name']} 获取代理列表...")
-        try:
-            response = requests.get(source['url'], timeout=15)
-            response.raise_for_status()
-
-            initial_http_count = len(http_proxies)
-            initial_socks5_count = len(socks5_proxies)
-
-            content = response.text.strip()
-            lines = content.split('\n')
-
-            # --- 分类逻辑重构 ---
-            for line in lines:
-                if not line.strip():
-                    continue
-
-                # 1. 智能推断协议
-                protocol = deduce_protocol(line, source['protocol'])
-
-                # 2. 清理代理地址
-                cleaned_proxy = None
-                if source['parser'] in ['text', 'json-list']:  # json-list 的原始行就是 ip:port
-                    cleaned_proxy = clean_proxy_line(line)
-                elif source['parser'] == 'json':
-                    try:
-                        proxy_info = json.loads(line)
-                        host = proxy_info.get("host")
-                        port = proxy_info.get("port")
-                        if host and port:
-                            cleaned_proxy = f"{host}:{port}"
-                    except json.JSONDecodeError:
-                        continue  # 跳过无法解析的JSON行
-
-                if not cleaned_proxy:
-                    continue
-
-                # 3. 根据推断出的协议进行分类和添加前缀
-                if protocol == 'http':
-                    http_proxies.add(f"http://{cleaned_proxy}")
-                elif protocol == 'socks5':
-                    socks5_proxies.add(f"socks5://{cleaned_proxy}")
-                # elif protocol == 'socks4':
-                #     socks4_proxies.add(f"socks4://{cleaned_proxy}")
-
-            new_http = len(http_proxies) - initial_http_count
-            new_socks5 = len(socks5_proxies) - initial_socks5_count
-            print(f"[+] 从此来源添加了 {new_http} 个HTTP代理, {new_socks5} 个SOCKS5代理。")
-
-        except requests.exceptions.RequestException as e:
-            print(f"[!] 从 {source['name']} 获取代理时出错: {e}")
-
-        print("-" * 20)
-    
     # [!] 修改：将输出目录设置为当前脚本所在的目录
     output_dir = os.getcwd()
-    save_proxies_to_file(http_proxies, "http.txt", output_dir)
-    save_proxies_to_file(socks5_proxies, "git.txt", output_dir)
-    # save_proxies_to_file(socks4_proxies, "socks4.txt", output_dir)
+    cache_path = os.path.join(output_dir, CACHE_FILE)
+    cache = load_cache(cache_path)
+    # 已从 SOURCES 中移除的源、旧版解析器的结果不再保留
+    kept = {source['url']: cache[source['url']] for source in SOURCES
+            if cache.get(source['url'], {}).get('parser_version') == PARSER_VERSION}
+    cache_changed = len(kept) != len(cache)
+    cache = kept
+    # 各源的结果按协议合并去重
+    merged = {protocol: set() for protocol in OUTPUT_FILES}
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    print(f"[*] 正在并发获取 {len(SOURCES)} 个来源的代理列表...")
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(SOURCES))) as executor:
+        futures = {executor.submit(fetch_source, session, source, cache.get(source['url'])): source
+                   for source in SOURCES}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                from_cache, entry = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"[!] 从 {source['name']} 获取代理时出错: {e}")
+                continue
+
+            if not from_cache:
+                cache[source['url']] = entry
+                cache_changed = True
+            proxies = entry['proxies']
+            for protocol, addresses in proxies.items():
+                merged[protocol].update(addresses)
+            state = "未变化，使用缓存" if from_cache else "已更新"
+            print(f"[+] {source['name']} ({state}): {len(proxies.get('http', ()))} 个HTTP代理, "
+                  f"{len(proxies.get('socks5', ()))} 个SOCKS5代理。")
+    session.close()
+    print("-" * 20)
+
+    if cache_changed:
+        try:
+            save_cache(cache_path, cache)
+        except OSError as e:
+            print(f"[!] 保存缓存文件时出错: {e}")
+
+    save_proxies_to_file(merged['http'], OUTPUT_FILES['http'], output_dir, "http://")
+    save_proxies_to_file(merged['socks5'], OUTPUT_FILES['socks5'], output_dir, "socks5://")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,319 @@
+# modules/aio_proxy.py
+
+import asyncio
+import ipaddress
+import socket
+import ssl
+import struct
+from urllib.parse import urlsplit
+
+
+class ProxyHandshakeError(Exception):
+    """与上游代理握手失败（协议错误、拒绝连接等）。"""
+
+
+class UpstreamClosedError(ProxyHandshakeError):
+    """握手过程中上游代理关闭了连接。"""
+
+
+class TargetUnreachableError(ProxyHandshakeError):
+    """上游代理正常应答，但报告目标地址不可达（拒绝连接、主机/网络不可达、网关错误等）。"""
+
+
+class UnsupportedCommandError(ProxyHandshakeError):
+    """上游代理不支持所请求的命令 (如 UDP ASSOCIATE)，代理本身仍可用于其他请求。"""
+
+
+# SOCKS5 回复码中表示目标一侧问题的: 3 网络不可达, 4 主机不可达, 5 连接被拒绝
+SOCKS5_TARGET_ERRORS = (3, 4, 5)
+SOCKS5_COMMAND_NOT_SUPPORTED = 7
+
+_SSL_CONTEXT = None
+
+
+def _get_ssl_context():
+    global _SSL_CONTEXT
+    if _SSL_CONTEXT is None:
+        _SSL_CONTEXT = ssl.create_default_context()
+    return _SSL_CONTEXT
+
+
+def split_host_port(address: str):
+    """将 "host:port" / "[v6]:port" 拆分为 (host, port)。"""
+    host, _, port_str = address.rpartition(':')
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    return host, int(port_str)
+
+
+def encode_socks5_address(host: str, port: int) -> bytes:
+    """按 SOCKS5 的 ATYP 规则编码目标地址和端口。"""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        encoded = host.encode('idna')
+        return b"\x03" + bytes([len(encoded)]) + encoded + struct.pack('!H', port)
+    if ip.version == 4:
+        return b"\x01" + ip.packed + struct.pack('!H', port)
+    return b"\x04" + ip.packed + struct.pack('!H', port)
+
+
+async def recv_exactly(loop, sock, n: int) -> bytes:
+    """从非阻塞 socket 中精确读取 n 个字节。"""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = await loop.sock_recv(sock, n - len(buf))
+        if not chunk:
+            raise UpstreamClosedError("上游代理提前关闭了连接")
+        buf += chunk
+    return bytes(buf)
+
+
+async def open_socket(host: str, port: int, timeout: float):
+    """建立一个非阻塞 TCP 连接。IP 字面量不经过 DNS 解析。"""
+    loop = asyncio.get_running_loop()
+    try:
+        family = socket.AF_INET6 if ipaddress.ip_address(host).version == 6 else socket.AF_INET
+        sockaddr = (host, port)
+    except ValueError:
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        family, _, _, _, sockaddr = infos[0]
+
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, sockaddr), timeout)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def socks5_greet(loop, sock):
+    """SOCKS5 第一步：协商认证方式（仅支持无认证）。"""
+    await loop.sock_sendall(sock, b"\x05\x01\x00")
+    reply = await recv_exactly(loop, sock, 2)
+    if reply[0] != 5 or reply[1] != 0:
+        raise ProxyHandshakeError(f"SOCKS5 认证协商失败: {reply!r}")
+
+
+async def socks5_connect(loop, sock, host: str, port: int, command: int = 1):
+    """SOCKS5 第二步：发送请求，返回代理回复中的绑定地址 (host, port)。"""
+    await loop.sock_sendall(sock, b"\x05" + bytes([command]) + b"\x00" + encode_socks5_address(host, port))
+    head = await recv_exactly(loop, sock, 4)
+    if head[0] == 5 and head[1] in SOCKS5_TARGET_ERRORS:
+        raise TargetUnreachableError(f"SOCKS5 代理报告目标不可达, 错误码: {head[1]}")
+    if head[0] == 5 and head[1] == SOCKS5_COMMAND_NOT_SUPPORTED:
+        raise UnsupportedCommandError(f"SOCKS5 代理不支持命令 {command}")
+    if head[0] != 5 or head[1] != 0:
+        raise ProxyHandshakeError(f"SOCKS5 请求被拒绝, 错误码: {head[1]}")
+    atyp = head[3]
+    if atyp == 1:
+        bound_host = socket.inet_ntop(socket.AF_INET, await recv_exactly(loop, sock, 4))
+    elif atyp == 4:
+        bound_host = socket.inet_ntop(socket.AF_INET6, await recv_exactly(loop, sock, 16))
+    elif atyp == 3:
+        length = (await recv_exactly(loop, sock, 1))[0]
+        bound_host = (await recv_exactly(loop, sock, length)).decode('idna')
+    else:
+        raise ProxyHandshakeError(f"SOCKS5 回复中的地址类型未知: {atyp}")
+    bound_port = struct.unpack('!H', await recv_exactly(loop, sock, 2))[0]
+    return bound_host, bound_port
+
+
+async def socks4_connect(loop, sock, host: str, port: int):
+    """SOCKS4 握手。SOCKS4 只接受 IPv4 地址，域名在本地解析。"""
+    try:
+        ip = ipaddress.IPv4Address(host)
+    except ValueError:
+        infos = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_STREAM)
+        ip = ipaddress.IPv4Address(infos[0][4][0])
+    await loop.sock_sendall(sock, b"\x04\x01" + struct.pack('!H', port) + ip.packed + b"\x00")
+    reply = await recv_exactly(loop, sock, 8)
+    if reply[1] != 0x5A:
+        raise ProxyHandshakeError(f"SOCKS4 请求被拒绝, 错误码: {reply[1]}")
+
+
+async def http_connect(loop, sock, host: str, port: int):
+    """HTTP 代理的 CONNECT 握手。"""
+    authority = f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+    await loop.sock_sendall(sock, f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n\r\n".encode())
+    buf = b""
+    while b"\r\n\r\n" not in buf:
+        chunk = await loop.sock_recv(sock, 4096)
+        if not chunk:
+            raise UpstreamClosedError("HTTP 代理在 CONNECT 响应前关闭了连接")
+        buf += chunk
+        if len(buf) > 65536:
+            raise ProxyHandshakeError("HTTP 代理的 CONNECT 响应头过大")
+    head, _, rest = buf.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0]
+    fields = status_line.split()
+    if len(fields) >= 2 and fields[1] in (b"502", b"504"):
+        raise TargetUnreachableError(f"HTTP 代理报告目标不可达: {status_line!r}")
+    if len(fields) < 2 or fields[1] != b"200":
+        raise ProxyHandshakeError(f"HTTP 代理拒绝 CONNECT: {status_line!r}")
+    if rest:
+        # 隧道建立前目标端不会主动发送数据，出现多余字节说明代理行为异常
+        raise ProxyHandshakeError("HTTP 代理在 CONNECT 响应后附带了多余数据")
+
+
+async def prewarm_handshake(loop, sock, protocol: str):
+    """完成与目标无关的握手部分：SOCKS5 先协商认证方式，其余协议只需建立 TCP 连接。"""
+    if protocol.upper() == 'SOCKS5':
+        await socks5_greet(loop, sock)
+
+
+async def tunnel_handshake(loop, sock, protocol: str, target_host: str, target_port: int, prewarmed: bool = False):
+    """在已连上上游代理的 socket 上完成到目标地址的握手。prewarmed 表示已执行过 prewarm_handshake。"""
+    protocol = protocol.upper()
+    if protocol == 'SOCKS5':
+        if not prewarmed:
+            await socks5_greet(loop, sock)
+        await socks5_connect(loop, sock, target_host, target_port)
+    elif protocol == 'SOCKS4':
+        await socks4_connect(loop, sock, target_host, target_port)
+    elif protocol in ('HTTP', 'HTTPS'):
+        await http_connect(loop, sock, target_host, target_port)
+    else:
+        raise ProxyHandshakeError(f"不支持的上游代理协议: {protocol}")
+
+
+async def open_tunnel(protocol: str, proxy: str, target_host: str, target_port: int, timeout: float):
+    """通过上游代理建立到目标地址的隧道，返回已就绪的非阻塞 socket。"""
+    loop = asyncio.get_running_loop()
+    proxy_host, proxy_port = split_host_port(proxy)
+    sock = await open_socket(proxy_host, proxy_port, timeout)
+    try:
+        await asyncio.wait_for(tunnel_handshake(loop, sock, protocol, target_host, target_port), timeout)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+class UdpAssociation:
+    """经 SOCKS5 上游建立的 UDP 关联。关联在控制连接关闭时失效。"""
+    def __init__(self, control_sock, relay_address):
+        self.control_sock = control_sock
+        self.relay_address = relay_address  # 上游的 UDP 中继地址 (ip, port)
+
+    def close(self):
+        self.control_sock.close()
+
+
+async def open_udp_association(proxy: str, timeout: float) -> UdpAssociation:
+    """向 SOCKS5 上游发送 UDP ASSOCIATE，返回控制连接与上游的 UDP 中继地址。"""
+    loop = asyncio.get_running_loop()
+    proxy_host, proxy_port = split_host_port(proxy)
+    sock = await open_socket(proxy_host, proxy_port, timeout)
+    try:
+        async def handshake():
+            await socks5_greet(loop, sock)
+            return await socks5_connect(loop, sock, '0.0.0.0', 0, command=3)
+        relay_host, relay_port = await asyncio.wait_for(handshake(), timeout)
+        try:
+            if ipaddress.ip_address(relay_host).is_unspecified:
+                # 中继地址为 0.0.0.0 / :: 时表示与控制连接相同的地址
+                relay_host = sock.getpeername()[0]
+        except ValueError:
+            infos = await loop.getaddrinfo(relay_host, relay_port, type=socket.SOCK_DGRAM)
+            relay_host = infos[0][4][0]
+    except BaseException:
+        sock.close()
+        raise
+    return UdpAssociation(sock, (relay_host, relay_port))
+
+
+async def _read_body(reader, headers: dict, method: str, on_chunk=None):
+    if method == 'HEAD':
+        return b""
+    chunks = []
+
+    def consume(data):
+        if on_chunk:
+            on_chunk(len(data))
+        else:
+            chunks.append(data)
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                break
+            consume(await reader.readexactly(size))
+            await reader.readexactly(2)
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+        while remaining > 0:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                break
+            remaining -= len(data)
+            consume(data)
+    else:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            consume(data)
+    return b"".join(chunks)
+
+
+async def http_fetch(protocol: str, proxy: str, url: str, method: str = 'GET', timeout: float = 5,
+                     on_chunk=None, user_agent: str = None):
+    """
+    通过上游代理发出一个 HTTP 请求，返回 (status, headers, body)。
+    HTTP 代理访问 http:// 地址时使用绝对 URI 转发（与 requests 行为一致），其余情况走隧道。
+    提供 on_chunk 时，响应体以块大小回调的方式消费，不在内存中保留。
+    """
+    parts = urlsplit(url)
+    host = parts.hostname
+    is_https = parts.scheme == 'https'
+    port = parts.port or (443 if is_https else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    proxy_host, proxy_port = split_host_port(proxy)
+    forward_plain_http = protocol.upper() in ('HTTP', 'HTTPS') and not is_https
+
+    async def _do_request():
+        loop = asyncio.get_running_loop()
+        sock = await open_socket(proxy_host, proxy_port, timeout)
+        try:
+            if not forward_plain_http:
+                await tunnel_handshake(loop, sock, protocol, host, port)
+            reader, writer = await asyncio.open_connection(
+                sock=sock,
+                ssl=_get_ssl_context() if is_https else None,
+                server_hostname=host if is_https else None,
+            )
+        except BaseException:
+            sock.close()
+            raise
+
+        try:
+            target = url if forward_plain_http else path
+            lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}", "Connection: close", "Accept: */*"]
+            if user_agent:
+                lines.append(f"User-Agent: {user_agent}")
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+            await writer.drain()
+
+            head = await reader.readuntil(b"\r\n\r\n")
+            header_lines = head.decode('latin-1').split("\r\n")
+            status = int(header_lines[0].split()[1])
+            headers = {}
+            for line in header_lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            body = await _read_body(reader, headers, method, on_chunk)
+            return status, headers, body
+        finally:
+            writer.close()
+
+    return await asyncio.wait_for(_do_request(), timeout)
@@ -0,0 +1,152 @@
+# modules/async_checker.py
+
+import asyncio
+import json
+import time
+
+from .aio_proxy import open_socket, http_fetch, split_host_port
+from .prechecker import fd_limited_concurrency
+from .geo_locator import GeoBatchResolver
+
+
+class AsyncValidationEngine:
+    """
+    基于 asyncio 的验证引擎。所有 TCP 预检与完整验证都在同一个线程的事件循环中完成，
+    可同时有数万个检测在进行，而无需为每个检测分配一个系统线程。
+    复用 ProxyChecker 的验证目标、超时、公网IP和地理位置查询，输出格式与线程引擎一致。
+    """
+    def __init__(self, checker, concurrency: int = 5000, precheck_timeout: float = 1.5):
+        self.checker = checker
+        self.concurrency = fd_limited_concurrency(concurrency)
+        self.precheck_timeout = precheck_timeout
+
+    async def _pre_check(self, proxy: str) -> bool:
+        """非阻塞的 TCP 预检。"""
+        try:
+            host, port = split_host_port(proxy)
+            sock = await open_socket(host, port, self.precheck_timeout)
+            sock.close()
+            return True
+        except Exception:
+            return False
+
+    async def _full_check(self, proxy_info: dict, validation_mode: str = 'online', profile: str = 'deep'):
+        """与 ProxyChecker._full_check_proxy 等价的异步实现，同样按验证档位执行各阶段。"""
+        checker = self.checker
+        profile_name = profile
+        profile = checker.get_profile(profile_name)
+        stages = profile['stages']
+        proxy = proxy_info['proxy']
+        protocol = proxy_info['protocol']
+        user_agent = checker.session.headers.get('User-Agent')
+        result = {
+            'proxy': proxy, 'protocol': protocol.upper(), 'status': 'Failed',
+            'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A',
+            'profile': profile_name,
+        }
+
+        try:
+            start_time = time.time()
+            status, _, _ = await http_fetch(protocol, proxy, checker.validation_targets['latency_check'], method='HEAD',
+                                            timeout=checker._stage_timeout(profile, 'latency'), user_agent=user_agent)
+            if status >= 400:
+                return result
+            result['latency'] = time.time() - start_time
+            checker.latency_tracker.record(result['latency'])
+
+            if 'anonymity' in stages:
+                status, _, body = await http_fetch(protocol, proxy, checker.validation_targets['anonymity_check'],
+                                                   timeout=checker._stage_timeout(profile, 'anonymity'), user_agent=user_agent)
+                if status >= 400:
+                    return result
+                data = json.loads(body)
+                origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
+                origin_ips = [ip.strip() for ip in origin_ips_str.split(',')]
+
+                if checker.public_ip and any(checker.public_ip in ip for ip in origin_ips):
+                    result['anonymity'] = 'Transparent'
+                    return result # 透明代理，直接返回，不再测速
+                elif len(origin_ips) > 1 or 'Via' in data.get('headers', {}):
+                    result['anonymity'] = 'Anonymous'
+                else:
+                    result['anonymity'] = 'Elite'
+
+            # 延迟低于档位阈值(默认7秒)的才进行测速
+            if 'speed' in stages and result['latency'] <= profile['speed_max_latency']:
+                speed_check_url = checker.validation_targets['latency_check'] if validation_mode == 'online' else checker.validation_targets['speed_check']
+                received = [0]
+                try:
+                    start_speed = time.time()
+                    status, _, _ = await http_fetch(protocol, proxy, speed_check_url, timeout=checker._stage_timeout(profile, 'speed'),
+                                                    user_agent=user_agent,
+                                                    on_chunk=lambda n: received.__setitem__(0, received[0] + n))
+                    speed_duration = time.time() - start_speed
+                    if status < 400 and speed_duration > 0 and received[0] > 0:
+                        # 计算速度，单位 Mbps
+                        result['speed'] = (received[0] / speed_duration) * 8 / (1000**2)
+                except Exception:
+                    pass # 测速失败不影响整体结果
+
+            # 查询地理位置：只查本地数据，未命中的由 GeoBatchResolver 批量补全
+            result['location'] = checker.geo.lookup_local(proxy.split(":")[0])
+
+            result['status'] = 'Working'
+            return result
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return result
+
+    async def _worker(self, candidates, counters, result_queue, geo_resolver, log_queue, validation_mode, profile):
+        for proxy_info in candidates:
+            if not await self._pre_check(proxy_info['proxy']):
+                continue
+            counters['survivors'] += 1
+            try:
+                result = await self._full_check(proxy_info, validation_mode, profile)
+                if result and result['location'] is None:
+                    geo_resolver.put(result)
+                elif result:
+                    result_queue.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_queue.put(f"[!] 异步验证任务出现异常: {e}")
+
+    async def _watch_cancel(self, cancel_event, workers):
+        while not cancel_event.is_set():
+            await asyncio.sleep(0.2)
+        for task in workers:
+            task.cancel()
+
+    async def _run(self, all_proxies_flat, result_queue, log_queue, validation_mode, cancel_event, profile):
+        total = len(all_proxies_flat)
+        # 所有 worker 共享同一个迭代器，天然实现"预检通过即进入完整验证"的流水线
+        candidates = iter(all_proxies_flat)
+        counters = {'survivors': 0}
+        geo_resolver = GeoBatchResolver(self.checker.geo, result_queue)
+        workers = [
+            asyncio.ensure_future(self._worker(candidates, counters, result_queue, geo_resolver, log_queue, validation_mode, profile))
+            for _ in range(min(self.concurrency, total))
+        ]
+        watcher = asyncio.ensure_future(self._watch_cancel(cancel_event, workers)) if cancel_event else None
+        try:
+            await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            if watcher:
+                watcher.cancel()
+            # 结束信号必须在所有补全地理位置的结果之后发出
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            await asyncio.get_running_loop().run_in_executor(None, geo_resolver.close, not cancelled)
+        log_queue.put(f"[+] 异步引擎完成，TCP预检幸存者: {counters['survivors']} / {total}。")
+
+    def validate_all(self, all_proxies_flat: list, result_queue, log_queue, validation_mode='online', cancel_event=None, profile='deep'):
+        """与 ProxyChecker.validate_all 相同的队列约定：正常结束放入 None，被取消则不放。"""
+        log_queue.put(f"[*] 异步引擎开始验证，总数: {len(all_proxies_flat)}，并发上限: {self.concurrency}，验证档位: {profile}...")
+        if all_proxies_flat:
+            asyncio.run(self._run(all_proxies_flat, result_queue, log_queue, validation_mode, cancel_event, profile))
+
+        if not (cancel_event and cancel_event.is_set()):
+            result_queue.put(None)
+        else:
+            log_queue.put("[Checker] 异步验证任务被用户取消。")
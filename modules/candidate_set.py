@@ -0,0 +1,150 @@
+# modules/candidate_set.py
+
+"""
+候选代理集合：按协议分组的规范地址字符串集合，地址为 "ip:端口"、"域名:端口" 或 "[IPv6]:端口"。
+地址只在入口处经 proxy_parser 校验并规范化一次；去重、与已知代理池求差集、合并都是 C 实现的 set 运算，
+出口 (交给验证器 / 写文件) 时再排序。
+不把地址打包为整数：打包与每批合并时的排序让去重比 set 慢数倍，而且整数无法表示域名和 IPv6。
+"""
+
+from .proxy_parser import normalize_protocol, parse_addresses, parse_proxy_strings
+
+PROTOCOLS = ('http', 'socks4', 'socks5')
+
+
+def _empty_sets() -> dict:
+    return {protocol: set() for protocol in PROTOCOLS}
+
+
+class CandidateSet:
+    """
+    候选代理集合。除 update 外，集合运算都返回新的 CandidateSet。
+    持久化用的键为 "协议://地址" 字符串 (见 keys / from_keys)。
+    """
+    __slots__ = ('_sets',)
+
+    def __init__(self, sets: dict = None):
+        """sets 为 {协议: 规范地址的 set}，集合归新对象所有；一般通过 parse / from_* 构造。"""
+        self._sets = _empty_sets()
+        if sets:
+            self._sets.update(sets)
+
+    # --- 入口：由字符串构造 ---
+    @classmethod
+    def parse(cls, data, default_protocol=None):
+        """解析代理列表 (str 或 bytes，格式同 proxy_parser)，条目自带的协议优先，没有时使用 default_protocol。"""
+        sets = _empty_sets()
+        for address, protocol in parse_addresses(data, normalize_protocol(default_protocol)):
+            if protocol is not None:
+                # 未标明协议且没有默认协议的条目无法归类，丢弃
+                sets[protocol].add(address)
+        return cls(sets)
+
+    @classmethod
+    def from_addresses(cls, protocol, addresses):
+        """同一协议的地址字符串；不合法的条目丢弃。"""
+        protocol = normalize_protocol(protocol)
+        if protocol is None:
+            raise ValueError("不支持的协议")
+        return cls({protocol: set(parse_proxy_strings("\n".join(addresses)))})
+
+    @classmethod
+    def from_dict(cls, proxies_by_protocol: dict):
+        """{'http': [...], 'socks5': [...]} 形式 (如 ProxyFetcher.fetch_all 的结果)。"""
+        return cls.merge(cls.from_addresses(protocol, proxies)
+                         for protocol, proxies in proxies_by_protocol.items() if proxies)
+
+    @classmethod
+    def from_proxy_infos(cls, infos):
+        """代理信息字典的列表 (如 ProxyRotator.all_proxies())，协议字段不区分大小写。"""
+        grouped = {}
+        for info in infos:
+            protocol = normalize_protocol(info.get('protocol'))
+            if protocol is not None:
+                grouped.setdefault(protocol, []).append(info['proxy'])
+        return cls.from_dict(grouped)
+
+    @classmethod
+    def from_keys(cls, keys):
+        """由 "协议://地址" 键构造 (如从 ProxyHistory 读出的键)，不认识的协议丢弃。"""
+        sets = _empty_sets()
+        for key in keys:
+            protocol, _, address = key.partition('://')
+            if protocol in sets:
+                sets[protocol].add(address)
+        return cls(sets)
+
+    @classmethod
+    def merge(cls, sets):
+        """多个集合的并集。"""
+        merged = _empty_sets()
+        for candidates in sets:
+            for protocol, addresses in candidates._sets.items():
+                merged[protocol] |= addresses
+        return cls(merged)
+
+    # --- 集合运算 ---
+    def __len__(self):
+        return sum(map(len, self._sets.values()))
+
+    def union(self, other):
+        return CandidateSet.merge((self, other))
+
+    def update(self, other):
+        """原地并入 other，适合逐批累积 "已见过" 的候选。"""
+        for protocol, addresses in other._sets.items():
+            self._sets[protocol] |= addresses
+
+    def difference(self, other):
+        """去掉 other (如已知的代理池) 中已有的候选。"""
+        if not len(self) or not len(other):
+            return self
+        return CandidateSet({protocol: addresses - other._sets[protocol] for protocol, addresses in self._sets.items()})
+
+    def intersection(self, other):
+        """同时在 other 中的候选。"""
+        return CandidateSet({protocol: addresses & other._sets[protocol] for protocol, addresses in self._sets.items()})
+
+    def select(self, protocol):
+        """某一协议的子集。"""
+        protocol = normalize_protocol(protocol)
+        return CandidateSet({protocol: set(self._sets[protocol])})
+
+    def shard(self, count: int) -> list:
+        """
+        按步长交错分成 count 份 (按协议、地址排序后第 i 份为第 i, i+count, ... 个候选)，
+        各份的协议与地址段分布与整体相近，适合分给多个验证进程。
+        """
+        shards = [_empty_sets() for _ in range(count)]
+        offset = 0
+        for protocol in PROTOCOLS:
+            ordered = sorted(self._sets[protocol])
+            for i in range(min(count, len(ordered))):
+                shards[(offset + i) % count][protocol].update(ordered[i::count])
+            offset += len(ordered)
+        return [CandidateSet(sets) for sets in shards]
+
+    def counts(self) -> dict:
+        """{协议: 数量}。"""
+        return {protocol: len(addresses) for protocol, addresses in self._sets.items()}
+
+    def keys(self) -> list:
+        """"协议://地址" 键的列表 (有序)，用于持久化。"""
+        return [f"{protocol}://{address}" for protocol in PROTOCOLS for address in sorted(self._sets[protocol])]
+
+    # --- 出口 ---
+    def addresses(self, protocol=None) -> list:
+        """地址列表 (按协议、地址排序)；protocol 为 None 时包含所有协议。"""
+        if protocol is not None:
+            return sorted(self._sets[normalize_protocol(protocol)])
+        return [address for protocol in PROTOCOLS for address in sorted(self._sets[protocol])]
+
+    def to_dict(self) -> dict:
+        """{'http': [...], 'socks4': [...], 'socks5': [...]}。"""
+        return {protocol: sorted(addresses) for protocol, addresses in self._sets.items()}
+
+    def iter_infos(self):
+        """逐个产出 {'proxy': 地址, 'protocol': 协议}，按需生成字典，内存中不会同时存在全部字典。"""
+        for protocol in PROTOCOLS:
+            for address in sorted(self._sets[protocol]):
+                yield {'proxy': address, 'protocol': protocol}
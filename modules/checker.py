@@ -1,18 +1,72 @@
 # modules/checker.py
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import socket
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+import threading
+from collections import deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 
+from .async_checker import AsyncValidationEngine
+from .candidate_set import CandidateSet
+from .prechecker import PENDING, TcpSweeper
+from .geo_locator import GeoLocator, GeoBatchResolver
+
+# 验证档位：stages 为需要执行的阶段；*_timeout 为各阶段超时(秒)，None 表示使用 ProxyChecker.timeout；
+# cutoff_percentile/cutoff_factor 表示样本足够后，延迟与匿名度请求的超时收紧到
+# "实时延迟的第 P 百分位 x 系数"，明显偏慢的代理提前判定失败，不再等满整个超时。
+VALIDATION_PROFILES = {
+    'quick': {
+        'stages': ('latency',),
+        'latency_timeout': 3, 'anonymity_timeout': 3, 'speed_timeout': 0, 'speed_max_latency': 0,
+        'cutoff_percentile': 90, 'cutoff_factor': 1.5,
+    },
+    'standard': {
+        'stages': ('latency', 'anonymity'),
+        'latency_timeout': None, 'anonymity_timeout': None, 'speed_timeout': 0, 'speed_max_latency': 0,
+        'cutoff_percentile': 90, 'cutoff_factor': 2.0,
+    },
+    'deep': {
+        'stages': ('latency', 'anonymity', 'speed'),
+        'latency_timeout': None, 'anonymity_timeout': None, 'speed_timeout': 15, 'speed_max_latency': 7.0,
+        'cutoff_percentile': 95, 'cutoff_factor': 3.0,
+    },
+}
+
+
+class LatencyTracker:
+    """线程安全的滑动窗口，记录最近成功请求的延迟，用于计算实时百分位。"""
+    def __init__(self, window: int = 1000, min_samples: int = 50):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p: float):
+        """样本不足 min_samples 时返回 None。"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
 class ProxyChecker:
     """
     一个经过优化的多阶段代理验证器，结合TCP预检和完整质量验证。
     """
-    def __init__(self, timeout: int = 5):
+    def __init__(self, timeout: int = 5, history=None):
+        """history 为 ProxyHistory 时，验证前跳过近期失败的代理、优先验证曾经可用的代理，并记录本次验证结果。"""
         self.timeout = timeout
+        self.history = history
         self.session = requests.Session()
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36"
@@ -43,9 +97,22 @@ class ProxyChecker:
             'Vietnam': '越南',
             'Thailand': '泰国',
         }
-        self.location_cache = {}
         self.public_ip = None
 
+        # 每个工作线程各自持有一个 Session，避免多线程共享同一个连接池
+        self.pool_connections = 8
+        self.pool_maxsize = 4
+        self._local = threading.local()
+        self._pool_stats_lock = threading.Lock()
+        self._pool_stats = {'sessions': 0, 'requests': 0, 'new_connections': 0}
+
+        # 验证档位与实时延迟统计
+        self.profiles = {name: dict(cfg) for name, cfg in VALIDATION_PROFILES.items()}
+        self.latency_tracker = LatencyTracker()
+
+        # 地理位置：离线CIDR表 + 持久化缓存 + 批量在线查询
+        self.geo = GeoLocator(name_map=self.COUNTRY_NAME_MAP, session_getter=self._get_session)
+
     def initialize_public_ip(self, log_queue=None):
         """通过调用系统 'curl' 命令获取本机公网IP，作为匿名度检测的基准。"""
         try:
@@ -70,63 +137,72 @@ class ProxyChecker:
             if log_queue:
                 log_queue.put(f"[Checker] [!] 调用系统curl获取本机公网IP失败: {e}")
 
+    # --- 连接池 ---
+    def _get_session(self):
+        """获取当前线程专属的 Session，首次调用时创建。"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.session.headers)
+            adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+            with self._pool_stats_lock:
+                self._pool_stats['sessions'] += 1
+        return session
+
+    def _release_proxy_pool(self, session, proxy_url: str):
+        """
+        一个代理的检测序列结束后，回收它在 Session 中的连接池并累计复用统计。
+        requests 会为每个代理地址永久缓存一个 ProxyManager，不回收的话内存会随候选数量增长。
+        """
+        adapter = session.get_adapter('http://')
+        manager = adapter.proxy_manager.pop(proxy_url, None)
+        if manager is None:
+            return
+        requests_count = new_connections = 0
+        for key in manager.pools.keys():
+            pool = manager.pools.get(key)
+            if pool is not None:
+                requests_count += pool.num_requests
+                new_connections += pool.num_connections
+        manager.clear()
+        with self._pool_stats_lock:
+            self._pool_stats['requests'] += requests_count
+            self._pool_stats['new_connections'] += new_connections
+
+    def get_pool_stats(self) -> dict:
+        """返回连接池配置与复用统计：reused 为复用已有连接的请求数。"""
+        with self._pool_stats_lock:
+            stats = dict(self._pool_stats)
+        stats['reused'] = max(0, stats['requests'] - stats['new_connections'])
+        stats['hit_rate'] = stats['reused'] / stats['requests'] if stats['requests'] else 0.0
+        stats['pool_connections'] = self.pool_connections
+        stats['pool_maxsize'] = self.pool_maxsize
+        return stats
+
     # --- IP地理位置查询 (聚合多个API) ---
     def _get_proxy_location(self, ip: str):
         """
-        查询IP的地理位置，聚合多个API源并带缓存，优先国内源，结果翻译为中文。
+        查询单个IP的地理位置：离线表和持久化缓存优先，未命中时在线查询，结果翻译为中文。
+        批量验证时请使用 GeoBatchResolver，避免在验证线程中等待地理位置API。
         """
-        if ip in self.location_cache:
-            return self.location_cache[ip]
+        return self.geo.lookup(ip)
 
-        location = "未知"
-        
-        # API 1: ip-api.com (国际源, 覆盖广)
-        try:
-            url = f"http://ip-api.com/json/{ip}?lang=zh-CN&fields=status,message,country"
-            res = self.session.get(url, timeout=2)
-            res.raise_for_status()
-            data = res.json()
-            if data.get('status') == 'success':
-                country = data.get('country', '')
-                if country:
-                    location = self.COUNTRY_NAME_MAP.get(country, country)
-                    self.location_cache[ip] = location
-                    return location
-        except Exception:
-            pass # 尝试下一个API
-
-        # API 2: ip.taobao.com (国内源, 查国内IP快且准)
-        try:
-            url = f"https://ip.taobao.com/outGetIpInfo?ip={ip}&accessKey=alibaba-inc"
-            res = self.session.get(url, timeout=3)
-            res.raise_for_status()
-            data = res.json()
-            if data.get('code') == 0 and 'data' in data:
-                d = data['data']
-                country = d.get('country', '')
-                if country:
-                    location = self.COUNTRY_NAME_MAP.get(country, country)
-                    self.location_cache[ip] = location
-                    return location
-        except Exception:
-            pass # 尝试下一个API
+    # --- 验证档位 ---
+    def get_profile(self, name: str) -> dict:
+        """按名称取验证档位，未知名称回退到 'deep'。"""
+        return self.profiles.get(name) or self.profiles['deep']
 
-        # API 3: ip.sb (备用源)
-        try:
-            url = f"https://api.ip.sb/geoip/{ip}"
-            res = self.session.get(url, timeout=3)
-            res.raise_for_status()
-            data = res.json()
-            country = data.get('country', '')
-            if country:
-                location = self.COUNTRY_NAME_MAP.get(country, country)
-                self.location_cache[ip] = location
-                return location
-        except Exception:
-            pass
-            
-        self.location_cache[ip] = location
-        return location
+    def _stage_timeout(self, profile: dict, stage: str) -> float:
+        """某一阶段的实际超时：档位配置的超时，再按实时延迟百分位收紧（不低于1秒）。"""
+        timeout = profile.get(f'{stage}_timeout') or self.timeout
+        if stage in ('latency', 'anonymity'):
+            pct = self.latency_tracker.percentile(profile.get('cutoff_percentile', 95))
+            if pct is not None:
+                timeout = min(timeout, max(1.0, pct * profile.get('cutoff_factor', 3.0)))
+        return timeout
 
     def _pre_check_proxy(self, proxy: str):
         """TCP预检，快速判断端口是否开放。"""
@@ -137,51 +213,65 @@ class ProxyChecker:
         except Exception:
             return False
 
-    def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None):
+    def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None, resolve_location=True,
+                          profile: str = 'deep'):
         """
         对单个代理进行完整的质量验证，此过程可随时取消。
         在每个阻塞网络操作前后，都会检查 cancel_event。
+        resolve_location=False 时只查本地地理位置数据，未命中则 location 为 None，由调用方批量补全。
+        profile 决定执行哪些阶段，未执行阶段的字段保持默认值，结果中的 'profile' 记录所用档位。
         """
+        profile_name = profile
+        profile = self.get_profile(profile_name)
+        stages = profile['stages']
         proxy = proxy_info['proxy']
         protocol = proxy_info['protocol']
         proxy_url = f"{protocol.lower()}://{proxy}"
         proxies_dict = {'http': proxy_url, 'https': proxy_url}
+        # 同一代理的延迟、匿名度、测速请求共用本线程 Session 中的连接，可复用到代理（及隧道）的 TCP/TLS 连接
+        session = self._get_session()
         result = {
             'proxy': proxy, 'protocol': protocol.upper(), 'status': 'Failed',
-            'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
+            'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A',
+            'profile': profile_name,
         }
 
         try:
             if cancel_event and cancel_event.is_set(): return None
 
             start_time = time.time()
-            self.session.head(self.validation_targets['latency_check'], proxies=proxies_dict, timeout=self.timeout).raise_for_status()
+            session.head(self.validation_targets['latency_check'], proxies=proxies_dict,
+                         timeout=self._stage_timeout(profile, 'latency')).raise_for_status()
             result['latency'] = time.time() - start_time
+            self.latency_tracker.record(result['latency'])
 
             if cancel_event and cancel_event.is_set(): return None
 
-            res_anon = self.session.get(self.validation_targets['anonymity_check'], proxies=proxies_dict, timeout=self.timeout)
-            res_anon.raise_for_status()
-            data = res_anon.json()
-            origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
-            origin_ips = [ip.strip() for ip in origin_ips_str.split(',')]
-            
-            if self.public_ip and any(self.public_ip in ip for ip in origin_ips):
-                result['anonymity'] = 'Transparent'
-                return result # 透明代理，直接返回，不再测速
-            elif len(origin_ips) > 1 or 'Via' in data.get('headers', {}):
-                result['anonymity'] = 'Anonymous'
-            else:
-                result['anonymity'] = 'Elite'
+            if 'anonymity' in stages:
+                res_anon = session.get(self.validation_targets['anonymity_check'], proxies=proxies_dict,
+                                       timeout=self._stage_timeout(profile, 'anonymity'))
+                res_anon.raise_for_status()
+                data = res_anon.json()
+                origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
+                origin_ips = [ip.strip() for ip in origin_ips_str.split(',')]
+
+                if self.public_ip and any(self.public_ip in ip for ip in origin_ips):
+                    result['anonymity'] = 'Transparent'
+                    return result # 透明代理，直接返回，不再测速
+                elif len(origin_ips) > 1 or 'Via' in data.get('headers', {}):
+                    result['anonymity'] = 'Anonymous'
+                else:
+                    result['anonymity'] = 'Elite'
 
             if cancel_event and cancel_event.is_set(): return None
 
-            # 延迟低于7秒的才进行测速
-            if result['latency'] <= 7.0:
+            # 延迟低于档位阈值(默认7秒)的才进行测速
+            if 'speed' in stages and result['latency'] <= profile['speed_max_latency']:
                 speed_check_url = self.validation_targets['latency_check'] if validation_mode == 'online' else self.validation_targets['speed_check']
                 try:
                     start_speed = time.time()
-                    speed_response = self.session.get(speed_check_url, proxies=proxies_dict, timeout=15, stream=True)
+                    speed_response = session.get(speed_check_url, proxies=proxies_dict,
+                                                 timeout=self._stage_timeout(profile, 'speed'), stream=True)
                     speed_response.raise_for_status()
                     
                     content_size = 0
@@ -200,8 +290,12 @@ class ProxyChecker:
 
             if cancel_event and cancel_event.is_set(): return None
             
-            # 查询地理位置
-            result['location'] = self._get_proxy_location(proxy.split(":")[0])
+            # 查询地理位置：优先离线表和缓存，未命中时按 resolve_location 决定是否在线查询
+            ip = proxy.split(":")[0]
+            location = self.geo.lookup_local(ip)
+            if location is None and resolve_location:
+                location = self._get_proxy_location(ip)
+            result['location'] = location
             
             result['status'] = 'Working'
             return result
@@ -210,58 +304,284 @@ class ProxyChecker:
             return result
         except Exception:
             return result
+        finally:
+            self._release_proxy_pool(session, proxy_url)
 
     # --- 优化了验证任务的取消逻辑 ---
-    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None):
-        all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
-        total_proxies = len(all_proxies_flat)
-        
-        survivors = []
-        # 代理数量太多时，跳过TCP预检，避免开销过大
-        if total_proxies > 10000:
-            log_queue.put(f"[!] 代理总数 ({total_proxies}) 超过10000，跳过TCP预检。")
-            survivors = all_proxies_flat
+    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None,
+                     engine='thread', async_concurrency=5000, precheck_mode='auto', precheck_concurrency=2000, profile='deep'):
+        """
+        验证所有代理。engine='thread' 使用线程池；engine='asyncio' 使用单线程事件循环，
+        适合数万规模的批次。两种引擎的 result_queue/log_queue/cancel_event 约定相同。
+        precheck_mode: 'thread' 线程池预检；'selector' 单线程非阻塞扫描；'off' 不预检；
+        'auto' 在超过10000个代理时改用 'selector'。
+        profile: 验证档位 ('quick' / 'standard' / 'deep')，例行重测建议用 'quick'。
+        proxies_by_protocol 也可以是 CandidateSet (如 ProxyFetcher.fetch_candidates 的结果)，
+        此时代理信息字典在送入预检时才逐个生成，不会一次性为所有候选建立字典。
+        设置了 history 时按历史记录筛选候选；asyncio 引擎只做筛选，不写回验证结果。
+        """
+        if self.history is not None:
+            candidates = proxies_by_protocol
+            if not isinstance(candidates, CandidateSet):
+                candidates = CandidateSet.from_dict(candidates)
+            all_proxies_flat, total_proxies = self._triage(candidates, log_queue)
+        elif isinstance(proxies_by_protocol, CandidateSet):
+            total_proxies = len(proxies_by_protocol)
+            all_proxies_flat = proxies_by_protocol.iter_infos()
         else:
-            log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
-            executor = ThreadPoolExecutor(max_workers=500)
+            all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
+            total_proxies = len(all_proxies_flat)
+
+        if engine == 'asyncio':
+            AsyncValidationEngine(self, concurrency=async_concurrency).validate_all(
+                list(all_proxies_flat), result_queue, log_queue, validation_mode, cancel_event, profile)
+            return
+
+        if precheck_mode == 'auto':
+            # 代理数量很多时，线程池预检开销过大，改用单线程的非阻塞扫描
+            precheck_mode = 'selector' if total_proxies > 10000 else 'thread'
+
+        log_queue.put(f"[*] 流水线验证开始，总数: {total_proxies}，TCP预检模式: {precheck_mode}，验证档位: {profile}，"
+                      f"预检通过的代理会立即进入完整质量验证...")
+        attempted, outcomes = self._outcome_lists()
+        candidates = self._track(iter(all_proxies_flat), attempted)
+        survivors = self._iter_survivors(candidates, log_queue, cancel_event, precheck_mode, precheck_concurrency)
+        survivor_count = self._run_pipeline(survivors, result_queue, log_queue, validation_mode, max_workers, cancel_event, profile,
+                                            outcomes)
+        self._record_history(attempted, outcomes, cancel_event)
+
+        # 只有在任务未被取消的情况下，才发送结束信号(None)
+        if not (cancel_event and cancel_event.is_set()):
+            if precheck_mode != 'off':
+                log_queue.put(f"[+] TCP预检完成，幸存者: {survivor_count} / {total_proxies}。")
+            stats = self.get_pool_stats()
+            log_queue.put(f"[*] 连接池统计: 线程Session {stats['sessions']} 个，请求 {stats['requests']} 次，"
+                          f"新建连接 {stats['new_connections']} 次，复用 {stats['reused']} 次 ({stats['hit_rate']:.0%})。")
+            result_queue.put(None)
+        else:
+            log_queue.put("[Checker] 任务在验证流水线中被用户取消。")
+
+    def validate_stream(self, batches, result_queue, log_queue, validation_mode='online', max_workers=100,
+                        cancel_event=None, precheck_mode='auto', precheck_concurrency=2000, profile='deep'):
+        """
+        流式验证：batches 为 (协议, 代理列表) 的迭代器 (如 ProxyFetcher.iter_batches)，
+        在独立线程中消费，每到一批就送入预检与完整验证流水线，不必等所有源获取完毕。
+        队列约定与 validate_all 相同。总数事先未知，precheck_mode='auto' 时使用 'selector'。
+        """
+        if precheck_mode == 'auto':
+            precheck_mode = 'selector'
+        arrived = queue.Queue()
+        stream_done = object()
+        counts = {'batches': 0, 'candidates': 0, 'skipped': 0}
+        started = time.monotonic()
+
+        def pump():
             try:
-                future_to_proxy = {executor.submit(self._pre_check_proxy, p['proxy']): p for p in all_proxies_flat}
-                for future in as_completed(future_to_proxy):
-                    if cancel_event and cancel_event.is_set(): break
-                    if future.result():
-                        survivors.append(future_to_proxy[future])
+                for protocol, proxies in batches:
+                    if cancel_event and cancel_event.is_set():
+                        break
+                    if counts['batches'] == 0:
+                        log_queue.put(f"[*] 首批 {len(proxies)} 个候选代理在 {time.monotonic() - started:.1f} 秒后到达，开始验证。")
+                    counts['batches'] += 1
+                    if self.history is not None:
+                        infos, total = self._triage(CandidateSet.from_addresses(protocol, proxies))
+                        counts['skipped'] += len(proxies) - total
+                        counts['candidates'] += total
+                        arrived.put(list(infos))
+                        continue
+                    counts['candidates'] += len(proxies)
+                    arrived.put([{'proxy': p, 'protocol': protocol} for p in proxies])
+            except Exception as e:
+                log_queue.put(f"[!] 获取线程出现异常: {e}")
             finally:
-                # 如果任务被取消，不等线程池执行完毕
-                executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
-            log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
+                close = getattr(batches, 'close', None)
+                if close:
+                    close()
+                arrived.put(stream_done)
 
-        if cancel_event and cancel_event.is_set():
-            log_queue.put("[Checker] 任务在TCP预检后被用户取消。")
-            return # 直接返回，不往队列放任何东西
+        def candidates():
+            # 预检器可以处理 PENDING 时不阻塞等待下一批；不预检时直接阻塞
+            block = precheck_mode == 'off'
+            while True:
+                try:
+                    batch = arrived.get(timeout=0.5) if block else arrived.get_nowait()
+                except queue.Empty:
+                    if cancel_event and cancel_event.is_set():
+                        return
+                    if not block:
+                        yield PENDING
+                    continue
+                if batch is stream_done:
+                    return
+                yield from batch
 
-        log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 " + "="*20)
-        
-        if not survivors:
-            result_queue.put(None) # 正常结束
+        threading.Thread(target=pump, daemon=True).start()
+        log_queue.put(f"[*] 流式验证开始，TCP预检模式: {precheck_mode}，验证档位: {profile}，候选代理随获取进度陆续加入...")
+        attempted, outcomes = self._outcome_lists()
+        survivors = self._iter_survivors(self._track(candidates(), attempted), log_queue, cancel_event, precheck_mode,
+                                         precheck_concurrency)
+        survivor_count = self._run_pipeline(survivors, result_queue, log_queue, validation_mode, max_workers, cancel_event, profile,
+                                            outcomes)
+        self._record_history(attempted, outcomes, cancel_event)
+
+        if not (cancel_event and cancel_event.is_set()):
+            if counts['skipped']:
+                log_queue.put(f"[*] 根据历史记录共跳过 {counts['skipped']} 个近期验证失败的代理。")
+            if precheck_mode != 'off':
+                log_queue.put(f"[+] TCP预检完成，幸存者: {survivor_count} / {counts['candidates']} "
+                              f"(共 {counts['batches']} 批)。")
+            result_queue.put(None)
+        else:
+            log_queue.put("[Checker] 任务在验证流水线中被用户取消。")
+
+    # --- 历史记录 ---
+    def _triage(self, candidates, log_queue=None):
+        """按历史记录筛选，返回 (代理信息的迭代器, 数量)：曾经可用的在前，近期失败的跳过。"""
+        good, rest, skipped = self.history.triage(candidates)
+        if log_queue and (skipped or len(good)):
+            log_queue.put(f"[*] 历史记录: 跳过 {skipped} 个近期验证失败的代理，优先验证 {len(good)} 个曾经可用的代理。")
+        return chain(good.iter_infos(), rest.iter_infos()), len(good) + len(rest)
+
+    def _outcome_lists(self):
+        """(已送入验证的代理信息, 完整验证结果)，未启用历史记录时为 (None, None)，不做记录。"""
+        return ([], []) if self.history is not None else (None, None)
+
+    @staticmethod
+    def _track(candidates, attempted):
+        """启用历史记录时，记下送入验证的每个候选 (PENDING 原样传递)。"""
+        if attempted is None:
+            return candidates
+
+        def tracked():
+            for info in candidates:
+                if info is not PENDING:
+                    attempted.append(info)
+                yield info
+        return tracked()
+
+    def _record_history(self, attempted, outcomes, cancel_event):
+        """
+        写入本次验证结果：完整验证得出的结果，加上未通过TCP预检的代理 (记为失败)。
+        任务被取消时，还在预检中的代理结果未知，只写入已得出的结果。
+        """
+        if attempted is None:
             return
+        working = {(r['proxy'], r['protocol'].lower()) for r in outcomes if r['status'] == 'Working'}
+        if cancel_event and cancel_event.is_set():
+            failed = [(r['proxy'], r['protocol']) for r in outcomes if r['status'] != 'Working']
+        else:
+            failed = [(info['proxy'], info['protocol']) for info in attempted
+                      if (info['proxy'], info['protocol'].lower()) not in working]
+        self.history.record_checks(working, failed)
 
+    def _iter_survivors(self, candidates, log_queue, cancel_event, precheck_mode, precheck_concurrency):
+        """按所选模式进行TCP预检，逐个产出端口开放的候选代理。"""
+        if precheck_mode == 'off':
+            return candidates
+        if precheck_mode == 'selector':
+            sweeper = TcpSweeper(concurrency=precheck_concurrency, timeout=1.5, log_queue=log_queue)
+            return sweeper.sweep(candidates, cancel_event)
+        return self._threaded_precheck(candidates, cancel_event)
+
+    def _threaded_precheck(self, candidates, cancel_event, workers=500):
+        """线程池TCP预检，按完成顺序产出幸存者。提交窗口为线程数的两倍。"""
+        completed = queue.Queue()
+        pending = {}
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while not (cancel_event and cancel_event.is_set()):
+                while not exhausted and len(pending) < workers * 2:
+                    proxy_info = next(candidates, None)
+                    if proxy_info is None:
+                        exhausted = True
+                        break
+                    if proxy_info is PENDING:
+                        break
+                    future = executor.submit(self._pre_check_proxy, proxy_info['proxy'])
+                    pending[future] = proxy_info
+                    future.add_done_callback(completed.put)
+
+                if not pending and exhausted:
+                    break
+                try:
+                    future = completed.get(timeout=0.5 if pending else 0.2)
+                except queue.Empty:
+                    continue
+                proxy_info = pending.pop(future)
+                if future.result():
+                    yield proxy_info
+        finally:
+            executor.shutdown(wait=False)
+
+    def _run_pipeline(self, survivors, result_queue, log_queue, validation_mode, max_workers, cancel_event, profile='deep',
+                      outcomes=None):
+        """
+        TCP预检与完整验证组成的有界流水线：每个预检通过的代理立即提交完整验证，
+        不再等待整个预检阶段结束。完整验证积压达到上限时预检暂停，形成背压，
+        因此内存中同时存在的任务数与候选总数无关。返回预检幸存者数量。
+        outcomes 不为 None 时，所有完整验证结果 (包括失败的) 都追加到其中。
+        """
+        def is_cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        # 所有完整验证的 future 完成时都回调到这个队列，主线程按完成顺序逐个处理
+        completed = queue.Queue()
+        feed_done = object()
+        slots = threading.BoundedSemaphore(max_workers * 2)
+        state = {'submitted': 0}
         executor = ThreadPoolExecutor(max_workers=max_workers)
+        geo_resolver = GeoBatchResolver(self.geo, result_queue)
+
+        def feed():
+            """在独立线程中消费预检结果，并在有空闲名额时提交完整验证。"""
+            try:
+                for proxy_info in survivors:
+                    while not slots.acquire(timeout=0.5):
+                        if is_cancelled():
+                            return
+                    if is_cancelled():
+                        return
+                    future = executor.submit(self._full_check_proxy, proxy_info, validation_mode, cancel_event, False, profile)
+                    state['submitted'] += 1
+                    future.add_done_callback(completed.put)
+            except Exception as e:
+                log_queue.put(f"[!] TCP预检线程出现异常: {e}")
+            finally:
+                completed.put(feed_done)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        feeding = True
+        finished = 0
         try:
-            futures = [executor.submit(self._full_check_proxy, p, validation_mode, cancel_event) for p in survivors]
-            for future in as_completed(futures):
-                if cancel_event and cancel_event.is_set():
+            while not is_cancelled():
+                # feed_done 在最后一次提交之后才入队，此时 submitted 已是最终值
+                if not feeding and finished == state['submitted']:
                     break
                 try:
-                    result = future.result()
-                    if result:
+                    item = completed.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is feed_done:
+                    feeding = False
+                    continue
+
+                finished += 1
+                slots.release()
+                try:
+                    result = item.result()
+                    if result and outcomes is not None:
+                        outcomes.append(result)
+                    if result and result['location'] is None:
+                        geo_resolver.put(result)
+                    elif result:
                         result_queue.put(result)
                 except Exception as e:
                     log_queue.put(f"[!] 验证器线程出现异常: {e}")
         finally:
-            executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
-
-        # 只有在任务未被取消的情况下，才发送结束信号(None)
-        if not (cancel_event and cancel_event.is_set()):
-            result_queue.put(None)
-        else:
-            log_queue.put("[Checker] 任务在完整验证阶段被用户取消。")
+            # 如果任务被取消，不等线程池执行完毕
+            executor.shutdown(wait=not is_cancelled())
+            geo_resolver.close(wait=not is_cancelled())
+        return state['submitted']
@@ -3,16 +3,30 @@
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from bs4 import BeautifulSoup
-import json
 import time
 
+from .candidate_set import CandidateSet
+from .proxy_parser import parse_proxy_strings
+from .source_health import SourceHealth
+
+# (连接超时, 读取超时)：失效源通常连不上，连接阶段不必等满 15 秒
+REQUEST_TIMEOUT = (5, 15)
+
 class ProxyFetcher:
     """获取在线代理源."""
-    def __init__(self):
-        """初始化, 定义API和爬虫源."""
+    def __init__(self, health_path: str = "source_health.json", deadline: float = 60, max_workers: int = 50,
+                 history=None):
+        """
+        初始化, 定义API和爬虫源.
+        health_path 为源健康记录的保存位置 (见 SourceHealth)，deadline 为一轮获取的总时长上限(秒)。
+        history 为 ProxyHistory 时，记录每个代理最近出现的时间和来源。
+        """
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.health = SourceHealth(health_path)
+        self.history = history
         # API源 (主要为返回纯文本格式的URL)
         self.online_sources = {
             'http': [
@@ -67,29 +81,24 @@ class ProxyFetcher:
             "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
             "Referer": "https://www.google.com/"
         })
-        retry_strategy = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        # 连接失败只重试一次：失效源再多重试也是白等，由 SourceHealth 的熔断负责跳过
+        retry_strategy = Retry(total=2, connect=1, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
         adapter = HTTPAdapter(max_retries=retry_strategy)
         session.mount("https://", adapter)
         session.mount("http://", adapter)
         return session
         
-    def _parse_proxies_from_text(self, text: str):
-        try:
-            data = json.loads(text)
-            if 'data' in data and isinstance(data['data'], list):
-                return [f"{item['ip']}:{item['port']}" for item in data['data']]
-        except json.JSONDecodeError:
-            pass
-        
-        return [line.strip() for line in text.splitlines() if re.match(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+', line.strip())]
+    def _parse_proxies_from_text(self, text):
+        """text 可以是 str 或响应的原始 bytes (不需要先解码)，格式由 proxy_parser 自动识别。"""
+        return parse_proxy_strings(text)
 
     def _fetch_from_url(self, url: str, log_queue):
         display_url = url.split('/')[2]
         log_queue.put(f"[*] (API) 正在从 {display_url} 获取...")
         try:
-            response = self.session.get(url, timeout=15)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            proxies = self._parse_proxies_from_text(response.text)
+            proxies = self._parse_proxies_from_text(response.content)
             if proxies:
                 log_queue.put(f"[+] (API) 成功从 {display_url} 获取 {len(proxies)} 个代理。")
                 return proxies
@@ -105,7 +114,7 @@ class ProxyFetcher:
         display_url = url.split('/')[2]
         log_queue.put(f"[*] (Scrape) 正在从 {display_url} 获取...")
         try:
-            response = self.session.get(url, timeout=15)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
             soup = BeautifulSoup(response.content, 'lxml')
             proxies = set()
             table = soup.find('table', class_='table-striped')
@@ -126,7 +135,7 @@ class ProxyFetcher:
         display_url = url.split('/')[2]
         log_queue.put(f"[*] (Scrape) 正在从 {display_url} 获取...")
         try:
-            response = self.session.get(url, timeout=15)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
             response.encoding = 'gb2312'
             soup = BeautifulSoup(response.content, 'lxml')
             proxies = set()
@@ -148,9 +157,8 @@ class ProxyFetcher:
         display_url = url.split('/')[2]
         log_queue.put(f"[*] (API) 正在从 {display_url} 获取...")
         try:
-            response = self.session.get(url, timeout=15)
-            response.encoding = response.apparent_encoding
-            proxies = re.findall(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d{2,5}', response.text)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+            proxies = parse_proxy_strings(response.content)
             if proxies:
                 log_queue.put(f"[+] (API) 成功从 {display_url} 获取 {len(proxies)} 个代理。")
                 return proxies
@@ -166,20 +174,14 @@ class ProxyFetcher:
         display_url = url.split('/')[2]
         log_queue.put(f"[*] (Scrape) 正在从 {display_url} 获取...")
         try:
-            response = self.session.get(url, timeout=15)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            proxies = set()
-            for line in response.text.split('\n'):
-                if 'host' in line:
-                    proxy_info = json.loads(line)
-                    if proxy_info.get('type') in ('http', 'https'):
-                         host = proxy_info.get('host')
-                         port = proxy_info.get('port')
-                         proxies.add(f"{host}:{port}")
+            # 每行一个 JSON 对象，type 为 http / https 的归为 HTTP
+            proxies = parse_proxy_strings(response.content, 'http')
 
             if proxies:
                 log_queue.put(f"[+] (Scrape) 成功从 {display_url} 获取 {len(proxies)} 个代理。")
-                return list(proxies)
+                return proxies
             else:
                  log_queue.put(f"[-] (Scrape) 从 {display_url} 获取为空。")
                  return None
@@ -196,7 +198,7 @@ class ProxyFetcher:
         try:
             for page in range(1, 4):  # 爬取前3页
                 url = f"https://www.kuaidaili.com/free/inha/{page}/"
-                response = self.session.get(url, timeout=15)
+                response = self.session.get(url, timeout=REQUEST_TIMEOUT)
                 response.raise_for_status()
                 soup = BeautifulSoup(response.content, 'lxml')
                 table = soup.find('table')
@@ -225,7 +227,7 @@ class ProxyFetcher:
         try:
             for page in range(1, 4): # 爬取前3页
                 url = f"http://www.ip3366.net/free/?stype=1&page={page}"
-                response = self.session.get(url, timeout=15)
+                response = self.session.get(url, timeout=REQUEST_TIMEOUT)
                 response.encoding = 'gb2312'
                 response.raise_for_status()
                 soup = BeautifulSoup(response.content, 'lxml')
@@ -255,7 +257,7 @@ class ProxyFetcher:
         try:
             for page in range(1, 4): # 爬取前3页
                 url = f"https://www.89ip.cn/index_{page}.html"
-                response = self.session.get(url, timeout=15)
+                response = self.session.get(url, timeout=REQUEST_TIMEOUT)
                 response.raise_for_status()
                 soup = BeautifulSoup(response.content, 'lxml')
                 table = soup.find('table', class_='layui-table')
@@ -276,50 +278,120 @@ class ProxyFetcher:
             log_queue.put(f"[!] (Scrape) 从 {display_url} 获取失败: {e}")
             return None
 
-    def fetch_all(self, log_queue, cancel_event=None):
-        all_proxies = {'http': set(), 'https': set(), 'socks4': set(), 'socks5': set()}
-        
-        executor = ThreadPoolExecutor(max_workers=50)
+    def _sources(self):
+        """所有源，(健康记录的键, 协议, 获取函数)。"""
+        sources = []
+        for protocol, urls in self.online_sources.items():
+            for url in urls:
+                sources.append((url, protocol, lambda log_queue, url=url: self._fetch_from_url(url, log_queue)))
+        for source in self.scraping_sources:
+            sources.append((f"scrape:{source['func'].__name__}", source['protocol'], source['func']))
+        return sources
+
+    @staticmethod
+    def _timed(func, log_queue):
+        start = time.monotonic()
         try:
-            future_to_protocol = {}
+            return func(log_queue), time.monotonic() - start
+        except Exception as exc:
+            log_queue.put(f'[!] 获取器线程产生一个错误: {exc}')
+            return None, time.monotonic() - start
 
-            # 提交API源任务
-            for protocol, urls in self.online_sources.items():
-                for url in urls:
-                    if cancel_event and cancel_event.is_set(): break
-                    future = executor.submit(self._fetch_from_url, url, log_queue)
-                    future_to_protocol[future] = protocol
-                if cancel_event and cancel_event.is_set(): break
-            
-            # 提交爬虫源任务
-            if not (cancel_event and cancel_event.is_set()):
-                for source in self.scraping_sources:
-                    if cancel_event and cancel_event.is_set(): break
-                    future = executor.submit(source['func'], log_queue)
-                    future_to_protocol[future] = source['protocol']
+    def _record_failure(self, key, elapsed, log_queue):
+        # 只在由正常转为熔断时记录日志，熔断中的试探失败不重复报告
+        if self.health.record_failure(key, elapsed):
+            log_queue.put(f"[!] 源 {key} 连续 {self.health.failure_threshold} 次获取失败，暂时熔断。")
 
-            # 处理已完成的future
-            for future in as_completed(future_to_protocol):
+    def iter_batches(self, log_queue, cancel_event=None, deadline: float = None, force: bool = False, known=None):
+        """
+        流式获取：每个源完成时立即产出 (协议, 本轮首次出现的代理列表)，https 归入 http，同一轮内不会重复产出。
+        上次失败且刷新间隔未到、或处于熔断中的源本轮跳过 (force=True 时全部获取)；
+        超过 deadline 秒仍未完成的源不再等待，记为失败。源的健康记录在结束时写回磁盘。
+        known 为已知的代理 (CandidateSet，如当前代理池)，其中的代理不再产出。
+        """
+        for protocol, fresh in self._iter_candidate_batches(log_queue, cancel_event, deadline, force, known):
+            yield protocol, fresh.addresses()
+
+    def _iter_candidate_batches(self, log_queue, cancel_event, deadline, force, known):
+        """同 iter_batches，但每批为 CandidateSet，去重与排除已知代理都是集合运算。"""
+        seen = CandidateSet()
+        if known is not None:
+            seen.update(known)
+        deadline = self.deadline if deadline is None else deadline
+
+        scheduled = []
+        skipped = {'fresh': 0, 'open': 0}
+        for key, protocol, func in self._sources():
+            run, reason = self.health.due(key)
+            if run or force:
+                scheduled.append((key, protocol, func))
+            else:
+                skipped[reason] += 1
+        # 收益高的源先提交
+        scheduled.sort(key=lambda item: self.health.rate(item[0]), reverse=True)
+        if not scheduled and (skipped['fresh'] or skipped['open']):
+            log_queue.put(f"[!] 所有源都被跳过 ({skipped['fresh']} 个失败后未到重试时间、{skipped['open']} 个已熔断)，"
+                          f"本轮没有候选代理；可强制获取全部源。")
+        elif skipped['fresh'] or skipped['open']:
+            log_queue.put(f"[*] 本轮获取 {len(scheduled)} 个源，跳过 {skipped['fresh']} 个失败后未到重试时间的源、"
+                          f"{skipped['open']} 个已熔断的源。")
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        started = time.monotonic()
+        future_to_source = {}
+        try:
+            for key, protocol, func in scheduled:
                 if cancel_event and cancel_event.is_set():
                     break
-                protocol = future_to_protocol[future]
-                try:
-                    proxies = future.result()
-                    if proxies:
-                        if protocol == 'https':
-                            all_proxies['http'].update(proxies)
-                        else:
-                            all_proxies[protocol].update(proxies)
-                except Exception as exc:
-                    log_queue.put(f'[!] 获取器线程产生一个错误: {exc}')
+                future_to_source[executor.submit(self._timed, func, log_queue)] = (key, protocol)
+
+            # 处理已完成的future
+            try:
+                for future in as_completed(list(future_to_source), timeout=deadline):
+                    if cancel_event and cancel_event.is_set():
+                        break
+                    key, protocol = future_to_source.pop(future)
+                    proxies, elapsed = future.result()
+                    if not proxies:
+                        self._record_failure(key, elapsed, log_queue)
+                        continue
+                    if protocol == 'https':
+                        protocol = 'http'
+                    batch = CandidateSet.from_addresses(protocol, proxies)
+                    if self.history is not None:
+                        self.history.record_seen(batch, key)
+                    fresh = batch.difference(seen)
+                    seen.update(fresh)
+                    if self.health.record_success(key, proxies, len(fresh), elapsed):
+                        log_queue.put(f"[+] 源 {key} 试探获取成功，解除熔断。")
+                    if len(fresh):
+                        yield protocol, fresh
+            except FuturesTimeoutError:
+                log_queue.put(f"[!] 获取超过 {deadline} 秒期限，放弃 {len(future_to_source)} 个未完成的源。")
+                for key, _ in future_to_source.values():
+                    self._record_failure(key, time.monotonic() - started, log_queue)
         finally:
-            executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
+            # 取消、超过期限或消费者提前结束时不等待剩余线程
+            executor.shutdown(wait=not future_to_source and not (cancel_event and cancel_event.is_set()),
+                              cancel_futures=True)
+            self.health.save()
 
-        if 'https' in all_proxies:
-            del all_proxies['https']
-            
-        return {
-            'http': list(all_proxies.get('http', set())),
-            'socks4': list(all_proxies.get('socks4', set())),
-            'socks5': list(all_proxies.get('socks5', set()))
-        }
+        ranked = self.health.report({key for key, _, _ in scheduled})
+        top = ", ".join(f"{row['source'].split('/')[2] if '://' in row['source'] else row['source']}"
+                        f" ({row['rate']}/s)" for row in ranked[:3] if row['rate'])
+        if top:
+            log_queue.put(f"[*] 本轮收益最高的源: {top}")
+
+    def fetch_candidates(self, log_queue, cancel_event=None, deadline: float = None, force: bool = False,
+                         known=None) -> CandidateSet:
+        """获取所有到期的源并汇总为 CandidateSet (参数同 iter_batches)，可直接交给 ProxyChecker.validate_all。"""
+        return CandidateSet.merge(fresh for _, fresh in
+                                  self._iter_candidate_batches(log_queue, cancel_event, deadline, force, known))
+
+    def fetch_all(self, log_queue, cancel_event=None, deadline: float = None, force: bool = False, known=None):
+        """获取所有到期的源并汇总 (参数同 iter_batches)，返回 {'http': [...], 'socks4': [...], 'socks5': [...]}。"""
+        return self.fetch_candidates(log_queue, cancel_event, deadline, force, known).to_dict()
+
+    def source_report(self) -> list:
+        """当前配置的各源的健康状态，按每秒带来的不重复代理数降序。"""
+        return self.health.report({key for key, _, _ in self._sources()})
@@ -0,0 +1,289 @@
+# modules/geo_locator.py
+
+import bisect
+import ipaddress
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+UNKNOWN_LOCATION = "未知"
+
+
+class GeoLocator:
+    """
+    IP 地理位置查询，按以下顺序：
+    1. 本地离线 CIDR 表 (每行 "1.0.1.0/24,中国"，# 开头为注释，网段之间不应重叠)；
+    2. 持久化到磁盘的 LRU 缓存，带过期时间，重启后仍然有效；
+    3. 在线 API：ip-api.com 的批量接口一次查询最多100个IP，批量结果中缺失的再逐个回退到 taobao / ip.sb。
+    批量请求本身失败时退避重试，仍失败则该批暂不解析 (不缓存，下次再查)，并在 BATCH_COOLDOWN 秒内暂停在线查询，
+    而不是对整批逐个回退，那样会立刻触发 ip-api 的每分钟限额。
+    """
+    BATCH_SIZE = 100
+    BATCH_RETRIES = 2
+    BATCH_BACKOFF = 1.0
+    BATCH_COOLDOWN = 60
+
+    def __init__(self, cache_path: str = "geo_cache.json", cidr_path: str = "geoip_cidr.txt",
+                 max_entries: int = 100000, ttl: float = 7 * 86400, unknown_ttl: float = 3600,
+                 name_map: dict = None, session_getter=None):
+        self.cache_path = cache_path
+        self.cidr_path = cidr_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.unknown_ttl = unknown_ttl
+        self.name_map = name_map or {}
+        self._session_getter = session_getter
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # ip -> (location, timestamp)
+        self._dirty = False
+        self._last_save = time.time()
+        self._batch_paused_until = 0.0
+
+        self._cidr_starts = []
+        self._cidr_ranges = []  # (start, end, location)，按 start 排序
+        self._load_cidr_table()
+        self._load_cache()
+
+    # --- 离线 CIDR 表 ---
+    def _load_cidr_table(self):
+        if not self.cidr_path or not os.path.exists(self.cidr_path):
+            return
+        ranges = []
+        with open(self.cidr_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    cidr, location = line.split(',', 1)
+                    network = ipaddress.IPv4Network(cidr.strip(), strict=False)
+                except ValueError:
+                    continue
+                ranges.append((int(network.network_address), int(network.broadcast_address), location.strip()))
+        ranges.sort()
+        self._cidr_ranges = ranges
+        self._cidr_starts = [r[0] for r in ranges]
+
+    def _lookup_cidr(self, ip: str):
+        if not self._cidr_ranges:
+            return None
+        try:
+            value = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return None
+        idx = bisect.bisect_right(self._cidr_starts, value) - 1
+        if idx >= 0:
+            start, end, location = self._cidr_ranges[idx]
+            if start <= value <= end:
+                return location
+        return None
+
+    # --- 持久化缓存 ---
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        # 文件中按最近使用顺序保存，依次放入即可恢复 LRU 顺序
+        for ip, (location, ts) in entries.items():
+            if not self._is_expired(location, ts, now):
+                self._cache[ip] = (location, ts)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _is_expired(self, location, ts, now):
+        ttl = self.unknown_ttl if location == UNKNOWN_LOCATION else self.ttl
+        return now - ts > ttl
+
+    def save(self):
+        """将缓存写回磁盘（先写临时文件再替换，避免写到一半时损坏）。"""
+        with self._lock:
+            if not self._dirty or not self.cache_path:
+                return
+            snapshot = dict(self._cache)
+            self._dirty = False
+            self._last_save = time.time()
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+
+    def _store(self, ip: str, location: str):
+        with self._lock:
+            self._cache[ip] = (location, time.time())
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            self._dirty = True
+
+    def lookup_local(self, ip: str):
+        """只查离线表和缓存，不发起网络请求。未命中返回 None。"""
+        location = self._lookup_cidr(ip)
+        if location:
+            return location
+        with self._lock:
+            entry = self._cache.get(ip)
+            if entry is None:
+                return None
+            if self._is_expired(entry[0], entry[1], time.time()):
+                del self._cache[ip]
+                return None
+            self._cache.move_to_end(ip)
+            return entry[0]
+
+    # --- 在线查询 ---
+    def _translate(self, country: str) -> str:
+        return self.name_map.get(country, country)
+
+    def _query_batch(self, session, ips: list) -> dict:
+        """ip-api.com 批量接口，一次请求最多查询100个IP。"""
+        url = "http://ip-api.com/batch?lang=zh-CN&fields=status,country,query"
+        res = session.post(url, json=ips, timeout=5)
+        res.raise_for_status()
+        found = {}
+        for item in res.json():
+            if item.get('status') == 'success' and item.get('country'):
+                found[item.get('query')] = self._translate(item['country'])
+        return found
+
+    def _query_batch_with_retry(self, session, ips: list):
+        """批量查询，失败时按 BATCH_BACKOFF 指数退避重试；仍失败返回 None 并暂停在线查询一段时间。"""
+        for attempt in range(self.BATCH_RETRIES + 1):
+            if time.time() < self._batch_paused_until:
+                return None
+            try:
+                return self._query_batch(session, ips)
+            except Exception:
+                if attempt < self.BATCH_RETRIES:
+                    time.sleep(self.BATCH_BACKOFF * 2 ** attempt)
+        self._batch_paused_until = time.time() + self.BATCH_COOLDOWN
+        return None
+
+    def _query_single(self, session, ip: str):
+        """逐个查询的备用源：ip.taobao.com (国内IP快且准) 与 ip.sb。"""
+        try:
+            url = f"https://ip.taobao.com/outGetIpInfo?ip={ip}&accessKey=alibaba-inc"
+            res = session.get(url, timeout=3)
+            res.raise_for_status()
+            data = res.json()
+            if data.get('code') == 0 and 'data' in data:
+                country = data['data'].get('country', '')
+                if country:
+                    return self._translate(country)
+        except Exception:
+            pass # 尝试下一个API
+
+        try:
+            url = f"https://api.ip.sb/geoip/{ip}"
+            res = session.get(url, timeout=3)
+            res.raise_for_status()
+            country = res.json().get('country', '')
+            if country:
+                return self._translate(country)
+        except Exception:
+            pass
+        return None
+
+    def resolve_many(self, ips) -> dict:
+        """批量解析一组IP，返回 {ip: location}。已缓存的直接返回，其余合并成批量请求。"""
+        results = {}
+        missing = []
+        for ip in dict.fromkeys(ips):
+            location = self.lookup_local(ip)
+            if location is None:
+                missing.append(ip)
+            else:
+                results[ip] = location
+        if not missing:
+            return results
+
+        session = self._session_getter()
+        for i in range(0, len(missing), self.BATCH_SIZE):
+            chunk = missing[i:i + self.BATCH_SIZE]
+            found = self._query_batch_with_retry(session, chunk)
+            if found is None:
+                # 批量接口不可用：本批暂记为未知但不写入缓存，下次再查
+                for ip in chunk:
+                    results[ip] = UNKNOWN_LOCATION
+                continue
+            for ip in chunk:
+                location = found.get(ip) or self._query_single(session, ip) or UNKNOWN_LOCATION
+                self._store(ip, location)
+                results[ip] = location
+
+        if time.time() - self._last_save > 30:
+            self.save()
+        return results
+
+    def lookup(self, ip: str) -> str:
+        """查询单个IP。"""
+        return self.resolve_many([ip])[ip]
+
+
+class GeoBatchResolver:
+    """
+    在后台线程中为验证结果批量补全地理位置，再放入输出队列。
+    攒够 max_batch 个或等待超过 max_wait 秒就发起一次批量查询，验证线程不再等待地理位置API。
+    """
+    def __init__(self, locator: GeoLocator, output_queue, max_batch: int = 100, max_wait: float = 1.0):
+        self.locator = locator
+        self.output_queue = output_queue
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._inbox = queue.Queue()
+        self._closed = object()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, result: dict):
+        self._inbox.put(result)
+
+    def close(self, wait: bool = True):
+        """处理完已提交的结果后退出。wait=False 时不等待（用于任务取消）。"""
+        self._inbox.put(self._closed)
+        if wait:
+            self._thread.join()
+
+    def _flush(self, batch):
+        try:
+            locations = self.locator.resolve_many(r['proxy'].split(':')[0] for r in batch)
+        except Exception:
+            locations = {}
+        for result in batch:
+            result['location'] = locations.get(result['proxy'].split(':')[0], UNKNOWN_LOCATION)
+            self.output_queue.put(result)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                item = self._inbox.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._closed:
+                if batch:
+                    self._flush(batch)
+                self.locator.save()
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.time() + self.max_wait
+            if batch and (len(batch) >= self.max_batch or time.time() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
@@ -0,0 +1,268 @@
+# modules/http_parser.py
+
+"""
+增量式 HTTP/1.1 报文解析器 (sans-IO)：只负责从字节流中切分报文，不做任何网络读写。
+调用方把收到的数据 feed 进来，再反复调用 next_event() 取出事件：
+    RequestHead / ResponseHead  报文头
+    bytes                       报文体的原始字节（分块编码时包含分块框架，可原样转发）
+    END_OF_MESSAGE              当前报文结束
+    NEED_DATA                   需要更多数据
+    CONNECTION_CLOSED           对端在报文之间正常关闭了连接
+同一连接上的多个报文（keep-alive 与流水线请求）依次解析，多收到的数据保留在缓冲区中。
+"""
+
+NEED_DATA = object()
+END_OF_MESSAGE = object()
+CONNECTION_CLOSED = object()
+
+# 只对本地代理有意义的头部，转发给目标站点前去掉
+PROXY_HEADERS = {'proxy-connection', 'proxy-authorization'}
+
+
+class HttpParseError(Exception):
+    """报文格式错误或超过大小限制。"""
+
+
+class _Head:
+    def __init__(self, version, headers):
+        self.version = version
+        self.headers = headers  # [(名称, 值)]，保留原始大小写与顺序
+
+    def get(self, name, default=None):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    def tokens(self, name):
+        """逗号分隔的头部值 (如 Connection) 转为小写 token 集合，同名头部合并。"""
+        name = name.lower()
+        return {token.strip().lower() for key, value in self.headers if key.lower() == name
+                for token in value.split(',') if token.strip()}
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.tokens('connection') | self.tokens('proxy-connection')
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+    def _encode_headers(self, drop=()):
+        lines = [f"{key}: {value}\r\n" for key, value in self.headers if key.lower() not in drop]
+        return "".join(lines) + "\r\n"
+
+
+class RequestHead(_Head):
+    def __init__(self, method, target, version, headers):
+        super().__init__(version, headers)
+        self.method = method
+        self.target = target
+
+    def to_bytes(self, target=None, drop=()):
+        """重新序列化请求头，可替换请求目标并去掉指定头部（小写名称）。"""
+        start_line = f"{self.method} {target or self.target} {self.version}\r\n"
+        return (start_line + self._encode_headers(drop)).encode('latin-1')
+
+
+class ResponseHead(_Head):
+    def __init__(self, version, status, reason, headers):
+        super().__init__(version, headers)
+        self.status = status
+        self.reason = reason
+
+    def to_bytes(self, drop=()):
+        start_line = f"{self.version} {self.status} {self.reason}\r\n"
+        return (start_line + self._encode_headers(drop)).encode('latin-1')
+
+
+class HttpParser:
+    """
+    单个连接方向上的报文切分器。is_response=True 时解析响应，
+    此时需要在每个响应前通过 expect_response(请求方法) 告知对应的请求方法 (HEAD 响应没有报文体)。
+    """
+    def __init__(self, is_response: bool = False, max_head_size: int = 65536, max_line_size: int = 8192):
+        self.is_response = is_response
+        self.max_head_size = max_head_size
+        self.max_line_size = max_line_size
+        self._buf = bytearray()
+        self._scan_from = 0
+        self._state = 'head'
+        self._remaining = 0
+        self._request_method = 'GET'
+        self._eof = False
+
+    # --- 输入 ---
+    def feed(self, data: bytes):
+        self._buf += data
+
+    def feed_eof(self):
+        self._eof = True
+
+    def expect_response(self, request_method: str):
+        self._request_method = request_method
+
+    def take_buffer(self) -> bytes:
+        """取出尚未解析的数据（切换为隧道转发时使用）。"""
+        data = bytes(self._buf)
+        self._buf.clear()
+        self._scan_from = 0
+        return data
+
+    @property
+    def in_message(self) -> bool:
+        return self._state != 'head'
+
+    @property
+    def body_until_close(self) -> bool:
+        """当前响应没有长度信息，以连接关闭作为结束。"""
+        return self._state == 'eof'
+
+    # --- 解析 ---
+    def next_event(self):
+        state = self._state
+        if state == 'head':
+            return self._parse_head()
+        if state == 'length':
+            return self._take_body()
+        if state == 'eof':
+            if self._buf:
+                return self._take_body()
+            if self._eof:
+                self._state = 'head'
+                return END_OF_MESSAGE
+            return NEED_DATA
+        if state == 'chunk_size':
+            return self._parse_chunk_size()
+        if state == 'chunk_data':
+            event = self._take_body()
+            if event is END_OF_MESSAGE:
+                # 分块数据(含结尾 CRLF) 已取完，继续下一个分块
+                self._state = 'chunk_size'
+                return self.next_event()
+            return event
+        if state == 'trailers':
+            return self._parse_trailers()
+        raise HttpParseError(f"未知的解析状态: {state}")
+
+    def _parse_head(self):
+        # 允许报文之间出现多余的空行
+        while self._buf[:2] == b"\r\n":
+            del self._buf[:2]
+        end = self._buf.find(b"\r\n\r\n", max(0, self._scan_from - 3))
+        if end < 0:
+            if len(self._buf) > self.max_head_size:
+                raise HttpParseError("报文头过大")
+            self._scan_from = len(self._buf)
+            if self._eof:
+                if self._buf:
+                    raise HttpParseError("连接在报文头结束前关闭")
+                return CONNECTION_CLOSED
+            return NEED_DATA
+        if end > self.max_head_size:
+            raise HttpParseError("报文头过大")
+        raw = bytes(self._buf[:end]).decode('latin-1')
+        del self._buf[:end + 4]
+        self._scan_from = 0
+
+        lines = raw.split("\r\n")
+        headers = []
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep or not name or name != name.strip():
+                raise HttpParseError(f"无效的头部行: {line!r}")
+            headers.append((name, value.strip()))
+        parts = lines[0].split(' ', 2)
+        if self.is_response:
+            if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+                raise HttpParseError(f"无效的状态行: {lines[0]!r}")
+            head = ResponseHead(parts[0], int(parts[1]), parts[2] if len(parts) > 2 else '', headers)
+        else:
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                raise HttpParseError(f"无效的请求行: {lines[0]!r}")
+            head = RequestHead(parts[0], parts[1], parts[2], headers)
+        self._state = self._body_state(head)
+        return head
+
+    def _body_state(self, head):
+        """按 RFC 7230 3.3.3 确定报文体的长度。"""
+        if self.is_response:
+            if (self._request_method == 'HEAD' or 100 <= head.status < 200
+                    or head.status in (204, 304)):
+                return self._finish_without_body()
+            if self._request_method == 'CONNECT' and 200 <= head.status < 300:
+                return self._finish_without_body()
+        if 'chunked' in head.tokens('transfer-encoding'):
+            return 'chunk_size'
+        length = head.get('content-length')
+        if length is not None:
+            try:
+                self._remaining = int(length)
+            except ValueError:
+                raise HttpParseError(f"无效的 Content-Length: {length!r}")
+            if self._remaining < 0:
+                raise HttpParseError(f"无效的 Content-Length: {length!r}")
+            return 'length' if self._remaining else self._finish_without_body()
+        if self.is_response:
+            return 'eof'  # 没有长度信息的响应以连接关闭为结束
+        return self._finish_without_body()
+
+    def _finish_without_body(self):
+        """没有(或已读完)报文体：进入长度为 0 的状态，下一次调用返回 END_OF_MESSAGE。"""
+        self._remaining = 0
+        return 'length'
+
+    def _take_body(self):
+        if self._state != 'eof' and self._remaining == 0:
+            if self._state == 'length':
+                self._state = 'head'
+            return END_OF_MESSAGE
+        if not self._buf:
+            if self._eof:
+                raise HttpParseError("连接在报文体结束前关闭")
+            return NEED_DATA
+        if self._state == 'eof':
+            size = len(self._buf)
+        else:
+            size = min(self._remaining, len(self._buf))
+            self._remaining -= size
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def _read_line(self):
+        end = self._buf.find(b"\r\n")
+        if end < 0:
+            if len(self._buf) > self.max_line_size:
+                raise HttpParseError("分块编码的行过长")
+            if self._eof:
+                raise HttpParseError("连接在分块编码结束前关闭")
+            return None
+        line = bytes(self._buf[:end + 2])
+        del self._buf[:end + 2]
+        return line
+
+    def _parse_chunk_size(self):
+        line = self._read_line()
+        if line is None:
+            return NEED_DATA
+        try:
+            size = int(line.split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            raise HttpParseError(f"无效的分块大小: {line!r}")
+        if size == 0:
+            self._state = 'trailers'
+        else:
+            self._remaining = size + 2  # 分块数据及其结尾的 CRLF
+            self._state = 'chunk_data'
+        return line
+
+    def _parse_trailers(self):
+        line = self._read_line()
+        if line is None:
+            return NEED_DATA
+        if line == b"\r\n":
+            # 结尾空行先作为数据返回，下一次调用再返回 END_OF_MESSAGE
+            self._finish_without_body()
+            self._state = 'length'
+        return line
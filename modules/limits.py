@@ -0,0 +1,100 @@
+# modules/limits.py
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class ConcurrencyGate:
+    """
+    全局并发上限与有界等待队列，运行在 ProxyServer 的事件循环中（不加锁）。
+    未达上限时立即放行；达到上限后新连接排队等待空出的名额，
+    队列已满或等待超过 queue_timeout 时拒绝，由调用方返回"服务繁忙"。
+    limit 为 0 表示不限制。
+    """
+    def __init__(self, limit: int = 0, queue_size: int = 1000, queue_timeout: float = 5):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """取得一个名额返回 True；被拒绝返回 False。"""
+        if not self.limit or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            self.stats['admitted'] += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.stats['rejected'] += 1
+            return False
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._waiters.append(fut)
+        self.stats['queued'] += 1
+        timer = loop.call_later(self.queue_timeout, lambda: fut.done() or fut.set_result(False))
+        try:
+            granted = await fut
+        except asyncio.CancelledError:
+            # 名额已转交但任务在恢复前被取消，归还名额
+            if fut.done() and not fut.cancelled() and fut.result():
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+        if granted:
+            self.stats['admitted'] += 1
+        else:
+            self.stats['timed_out'] += 1
+        return granted
+
+    def release(self):
+        """归还名额：有排队者时直接转交给最早的一个。"""
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self.active -= 1
+
+
+class RateLimiter:
+    """
+    按键 (客户端 IP) 的令牌桶限速：每个键每秒补充 rate 个令牌，最多积累 burst 个。
+    只记录最近活跃的 max_keys 个键，超过时淘汰最久未出现的。rate 为 0 表示不限速。
+    """
+    def __init__(self, rate: float = 0, burst: float = 20, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # 键 -> [令牌数, 上次补充时间]
+        self.rejected = 0
+
+    def allow(self, key) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            self.rejected += 1
+            return False
+        bucket[0] -= 1
+        return True
@@ -0,0 +1,271 @@
+# modules/metrics.py
+
+import time
+from collections import OrderedDict
+
+# 对数直方图：每个 2 的幂区间再均分为 16 个子桶，相对误差不超过 1/16 (约 6%)
+_SUB_BITS = 4
+_SUB_BUCKETS = 1 << _SUB_BITS
+_LINEAR_LIMIT = _SUB_BUCKETS * 2
+_BUCKET_COUNT = 512  # 以微秒计可覆盖到数小时
+
+
+def _bucket_index(value: int) -> int:
+    if value < _LINEAR_LIMIT:
+        return value
+    shift = value.bit_length() - (_SUB_BITS + 1)
+    return (shift + 1) * _SUB_BUCKETS + (value >> shift) - _SUB_BUCKETS
+
+
+def _bucket_upper(index: int) -> int:
+    """桶内最大值。"""
+    if index < _LINEAR_LIMIT:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    mantissa = index % _SUB_BUCKETS + _SUB_BUCKETS
+    return ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR 风格的对数分桶延迟直方图，以微秒为单位记录。
+    记录只是一次数组下标自增，内存固定，可按分位数查询，多个直方图之间可以合并。
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds: float):
+        value = int(seconds * 1e6)
+        if value < 0:
+            value = 0
+        index = _bucket_index(value)
+        if index >= _BUCKET_COUNT:
+            index = _BUCKET_COUNT - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        """第 p 百分位 (0~100) 的延迟，单位秒；没有数据时返回 None。"""
+        if not self.count:
+            return None
+        rank = max(1, int(self.count * p / 100 + 0.5))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_bucket_upper(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def merge(self, other):
+        for index, n in enumerate(other.counts):
+            if n:
+                self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> dict:
+        """常用分位数，单位毫秒。"""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count / 1000, 3),
+            'p50': round(self.percentile(50) * 1000, 3),
+            'p90': round(self.percentile(90) * 1000, 3),
+            'p99': round(self.percentile(99) * 1000, 3),
+            'max': round(self.max / 1000, 3),
+        }
+
+    def to_dict(self) -> dict:
+        """稀疏表示 {桶下标: 次数}，用于跨进程汇总。"""
+        return {'buckets': {i: n for i, n in enumerate(self.counts) if n},
+                'count': self.count, 'total': self.total, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        hist = cls()
+        for index, n in data.get('buckets', {}).items():
+            hist.counts[int(index)] = n
+        hist.count = data.get('count', 0)
+        hist.total = data.get('total', 0)
+        hist.max = data.get('max', 0)
+        return hist
+
+
+class _Counters:
+    """计数类的公共部分：导出为可序列化的字典，以及累加另一个进程导出的数据。"""
+    __slots__ = ()
+    COUNTERS = ()
+    HISTOGRAMS = ()
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.COUNTERS}
+        for name in self.HISTOGRAMS:
+            data[name] = getattr(self, name).to_dict()
+        return data
+
+    def merge_dict(self, data: dict):
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + data.get(name, 0))
+        for name in self.HISTOGRAMS:
+            if name in data:
+                getattr(self, name).merge(LatencyHistogram.from_dict(data[name]))
+
+
+class FrontendMetrics(_Counters):
+    """一个本地入口 (HTTP / SOCKS5) 的计数。"""
+    __slots__ = ('accepted', 'active', 'queued', 'rejected', 'requests', 'errors', 'bytes_up', 'bytes_down', 'ttfb')
+    COUNTERS = ('accepted', 'active', 'queued', 'rejected', 'requests', 'errors', 'bytes_up', 'bytes_down')
+    HISTOGRAMS = ('ttfb',)
+
+    def __init__(self):
+        self.accepted = 0
+        self.active = 0
+        self.queued = 0        # 到达时已满载、进入等待队列的连接数
+        self.rejected = 0      # 因过载或速率限制被拒绝的连接/请求数
+        self.requests = 0
+        self.errors = 0
+        self.bytes_up = 0      # 客户端 -> 上游
+        self.bytes_down = 0    # 上游 -> 客户端
+        self.ttfb = LatencyHistogram()
+
+    def snapshot(self) -> dict:
+        return {'accepted': self.accepted, 'active': self.active, 'queued': self.queued,
+                'rejected': self.rejected, 'requests': self.requests,
+                'errors': self.errors, 'bytes_up': self.bytes_up, 'bytes_down': self.bytes_down,
+                'ttfb_ms': self.ttfb.summary()}
+
+
+class UpstreamMetrics(_Counters):
+    """一个上游代理的计数。"""
+    __slots__ = ('connects', 'failures', 'target_errors', 'active', 'bytes_up', 'bytes_down',
+                 'connect_time', 'ttfb', 'last_used', 'fed_back')
+    COUNTERS = ('connects', 'failures', 'target_errors', 'active', 'bytes_up', 'bytes_down')
+    HISTOGRAMS = ('connect_time', 'ttfb')
+
+    def __init__(self):
+        self.connects = 0
+        self.failures = 0
+        self.target_errors = 0
+        self.active = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.connect_time = LatencyHistogram()
+        self.ttfb = LatencyHistogram()
+        self.last_used = 0.0
+        self.fed_back = (0, 0)  # 上次反馈给轮换器时的 (connects, failures)
+
+    def snapshot(self) -> dict:
+        return {'connects': self.connects, 'failures': self.failures, 'target_errors': self.target_errors,
+                'active': self.active, 'bytes_up': self.bytes_up, 'bytes_down': self.bytes_down,
+                'connect_ms': self.connect_time.summary(), 'ttfb_ms': self.ttfb.summary()}
+
+
+class TunnelMeter:
+    """一条隧道/一个请求的计量，转发路径上每块数据调用一次 upload/download。"""
+    __slots__ = ('frontend', 'upstream', 'started', 'first_byte')
+
+    def __init__(self, frontend: FrontendMetrics, upstream: UpstreamMetrics):
+        self.frontend = frontend
+        self.upstream = upstream
+        self.started = time.perf_counter()
+        self.first_byte = False
+
+    def upload(self, n: int):
+        self.frontend.bytes_up += n
+        self.upstream.bytes_up += n
+
+    def download(self, n: int):
+        if not self.first_byte:
+            self.record_ttfb(time.perf_counter() - self.started)
+        self.frontend.bytes_down += n
+        self.upstream.bytes_down += n
+
+    def record_ttfb(self, seconds: float):
+        self.first_byte = True
+        self.frontend.ttfb.record(seconds)
+        self.upstream.ttfb.record(seconds)
+
+
+class ServerMetrics:
+    """
+    ProxyServer 的实时统计：按入口和按上游的连接数、字节数、错误数与延迟直方图。
+    只由服务的事件循环线程写入，因此计数无需加锁；其他线程 (如 Flask) 通过 snapshot() 读取副本。
+    上游条目超过 max_upstreams 时淘汰最久未使用的。
+    """
+    FRONTENDS = ('http', 'socks5')
+
+    def __init__(self, max_upstreams: int = 5000):
+        self.max_upstreams = max_upstreams
+        self.started = time.time()
+        self.frontends = {name: FrontendMetrics() for name in self.FRONTENDS}
+        self._upstreams = OrderedDict()
+
+    def upstream(self, address: str) -> UpstreamMetrics:
+        metrics = self._upstreams.get(address)
+        if metrics is None:
+            metrics = self._upstreams[address] = UpstreamMetrics()
+            while len(self._upstreams) > self.max_upstreams:
+                self._upstreams.popitem(last=False)
+        else:
+            self._upstreams.move_to_end(address)
+        metrics.last_used = time.time()
+        return metrics
+
+    def meter(self, frontend: str, upstream_address: str) -> TunnelMeter:
+        return TunnelMeter(self.frontends[frontend], self.upstream(upstream_address))
+
+    def live_scores(self, min_samples: int = 3):
+        """
+        根据上次调用以来的连接成败和连接耗时中位数，为有足够样本的上游计算实时分数 (0~100)：
+        成功率 / (1 + 连接耗时秒数)。返回 {上游地址: 分数}。
+        """
+        scores = {}
+        for address, metrics in list(self._upstreams.items()):
+            last_connects, last_failures = metrics.fed_back
+            connects = metrics.connects - last_connects
+            failures = metrics.failures - last_failures
+            if connects + failures < min_samples:
+                continue
+            metrics.fed_back = (metrics.connects, metrics.failures)
+            success_rate = connects / (connects + failures)
+            connect_time = metrics.connect_time.percentile(50) or 0.0
+            scores[address] = round(100 * success_rate / (1 + connect_time), 1)
+        return scores
+
+    def to_dict(self) -> dict:
+        """完整的可序列化统计 (含直方图的全部桶)，多进程模式下由工作进程发给控制进程汇总。"""
+        return {
+            'started': self.started,
+            'frontends': {name: metrics.to_dict() for name, metrics in self.frontends.items()},
+            'upstreams': {address: metrics.to_dict() for address, metrics in list(self._upstreams.items())},
+        }
+
+    def merge_dict(self, data: dict):
+        """累加另一个 ServerMetrics 导出的统计。"""
+        self.started = min(self.started, data.get('started', self.started))
+        for name, frontend in data.get('frontends', {}).items():
+            if name in self.frontends:
+                self.frontends[name].merge_dict(frontend)
+        for address, upstream in data.get('upstreams', {}).items():
+            self.upstream(address).merge_dict(upstream)
+
+    def snapshot(self, top: int = 100) -> dict:
+        """JSON 友好的统计副本。上游按转发字节数降序，只保留前 top 个。"""
+        upstreams = list(self._upstreams.items())
+        upstreams.sort(key=lambda item: item[1].bytes_up + item[1].bytes_down, reverse=True)
+        return {
+            'uptime': round(time.time() - self.started, 1),
+            'frontends': {name: metrics.snapshot() for name, metrics in self.frontends.items()},
+            'upstream_count': len(upstreams),
+            'upstreams': {address: metrics.snapshot() for address, metrics in upstreams[:top]},
+        }
@@ -0,0 +1,155 @@
+# modules/prechecker.py
+
+import errno
+import ipaddress
+import selectors
+import socket
+import time
+from collections import deque
+
+_CONNECT_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, 'WSAEWOULDBLOCK', 10035)}
+
+# 流式候选的迭代器在暂时没有新候选时产出 PENDING (而不是阻塞)，预检器先处理进行中的探测，稍后再拉取
+PENDING = object()
+
+
+def fd_limited_concurrency(concurrency: int, reserve: int = 128) -> int:
+    """根据进程的文件描述符上限收紧并发数，避免 'Too many open files'。"""
+    if selectors.DefaultSelector is selectors.SelectSelector:
+        # Windows 等平台只能用 select()，单次最多监视约 512 个 socket
+        concurrency = min(concurrency, 500)
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return concurrency
+    if soft == resource.RLIM_INFINITY:
+        return concurrency
+    return max(1, min(concurrency, soft - reserve))
+
+
+class TcpSweeper:
+    """
+    基于 selectors (epoll/kqueue/select) 的高并发 TCP 连通性扫描器。
+    单线程内以非阻塞 connect 的方式同时探测最多 concurrency 个 ip:port，
+    内存占用只与并发窗口有关，可以在有限时间内扫完十万级的候选列表。
+    """
+    def __init__(self, concurrency: int = 2000, timeout: float = 1.5, log_queue=None, report_interval: float = 5.0):
+        self.concurrency = fd_limited_concurrency(concurrency)
+        self.timeout = timeout
+        self.log_queue = log_queue
+        self.report_interval = report_interval
+        self.attempted = 0
+        self.succeeded = 0
+        self.elapsed = 0.0
+
+    @property
+    def connects_per_second(self) -> float:
+        return self.attempted / self.elapsed if self.elapsed > 0 else 0.0
+
+    def _log(self, message):
+        if self.log_queue:
+            self.log_queue.put(message)
+
+    def _report(self, prefix):
+        self._log(f"{prefix} 已探测 {self.attempted}，端口开放 {self.succeeded}，"
+                  f"速率 {self.connects_per_second:.0f} 次连接/秒 (并发窗口 {self.concurrency})")
+
+    @staticmethod
+    def _open(proxy: str):
+        """发起非阻塞连接。返回 (socket, 已立即连通)；无法连接时返回 (None, False)。"""
+        host, _, port_str = proxy.rpartition(':')
+        family = socket.AF_INET6 if ipaddress.ip_address(host.strip('[]')).version == 6 else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        err = sock.connect_ex((host.strip('[]'), int(port_str)))
+        if err == 0:
+            return sock, True
+        if err in _CONNECT_IN_PROGRESS:
+            return sock, False
+        sock.close()
+        return None, False
+
+    def sweep(self, candidates, cancel_event=None):
+        """
+        对候选代理 ({'proxy': 'ip:port', ...}) 进行探测，按连通顺序逐个 yield 端口开放的候选。
+        candidates 可以是任意迭代器，扫描过程中按需拉取，暂时没有新候选时可产出 PENDING。
+        非 IP 字面量的地址（域名）直接放行，交给后续完整验证。
+        """
+        selector = selectors.DefaultSelector()
+        deadlines = deque()  # 超时时间固定，按发起顺序即按截止时间排序
+        candidates = iter(candidates)
+        exhausted = False
+        start = last_report = time.monotonic()
+        self.attempted = self.succeeded = 0
+
+        try:
+            while True:
+                if cancel_event and cancel_event.is_set():
+                    return
+
+                immediate = []
+                while not exhausted and len(selector.get_map()) < self.concurrency:
+                    proxy_info = next(candidates, None)
+                    if proxy_info is None:
+                        exhausted = True
+                        break
+                    if proxy_info is PENDING:
+                        break
+                    self.attempted += 1
+                    try:
+                        sock, connected = self._open(proxy_info['proxy'])
+                    except ValueError:
+                        immediate.append(proxy_info)
+                        continue
+                    except OSError:
+                        continue
+                    if connected:
+                        sock.close()
+                        immediate.append(proxy_info)
+                    elif sock is not None:
+                        selector.register(sock, selectors.EVENT_WRITE, proxy_info)
+                        deadlines.append((time.monotonic() + self.timeout, sock))
+
+                for proxy_info in immediate:
+                    self.succeeded += 1
+                    yield proxy_info
+
+                if exhausted and not selector.get_map():
+                    break
+
+                now = time.monotonic()
+                wait = min(0.2, max(0.0, deadlines[0][0] - now)) if deadlines else 0.2
+                if selector.get_map():
+                    events = selector.select(timeout=wait)
+                else:
+                    # 没有进行中的探测，正在等待流式候选；Windows 的 select() 不接受空集合
+                    time.sleep(wait)
+                    events = ()
+                for key, _ in events:
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    if err == 0:
+                        self.succeeded += 1
+                        yield key.data
+
+                # 先处理就绪事件再清理超时，避免消费者处理结果期间已连通的 socket 被误判为超时
+                now = time.monotonic()
+                while deadlines and (deadlines[0][0] <= now or deadlines[0][1].fileno() == -1):
+                    _, sock = deadlines.popleft()
+                    if sock.fileno() != -1:
+                        selector.unregister(sock)
+                        sock.close()
+
+                if now - last_report >= self.report_interval:
+                    last_report = now
+                    self.elapsed = now - start
+                    self._report("[*] TCP预检进度:")
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+            self.elapsed = time.monotonic() - start
+            self._report("[+] TCP预检结束:")
@@ -0,0 +1,148 @@
+# modules/proxy_history.py
+
+import sqlite3
+import threading
+import time
+
+from .candidate_set import PROTOCOLS, CandidateSet
+from .proxy_parser import int_to_address, normalize_protocol
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxies (
+    key TEXT PRIMARY KEY,               -- CandidateSet 的键: "协议://地址"
+    last_seen REAL NOT NULL DEFAULT 0,  -- 最近一次出现在某个源中的时间
+    last_checked REAL NOT NULL DEFAULT 0,
+    last_ok INTEGER,                    -- 最近一次验证结果: 1 可用 / 0 失败 / NULL 从未验证
+    failure_streak INTEGER NOT NULL DEFAULT 0,
+    source TEXT                         -- 最近一次出现的源 (SourceHealth 的键)
+)
+"""
+
+
+def _legacy_key(key: int) -> str:
+    """旧版的打包整数键 (协议序号 << 48 | IPv4 << 16 | 端口) -> "协议://地址"。"""
+    return f"{PROTOCOLS[key >> 48]}://{int_to_address((key >> 16) & 0xFFFFFFFF, key & 0xFFFF)}"
+
+
+def _keys(pairs) -> list:
+    """(地址, 协议) 的可迭代对象 -> "协议://地址" 键的列表，不合法的条目丢弃。"""
+    grouped = {}
+    for address, protocol in pairs:
+        protocol = normalize_protocol(protocol)
+        if protocol is not None:
+            grouped.setdefault(protocol, []).append(address)
+    return CandidateSet.from_dict(grouped).keys()
+
+
+class ProxyHistory:
+    """
+    跨运行的代理历史记录 (SQLite)，每个代理记录最近出现时间、最近验证时间与结果、连续失败次数和来源。
+    验证前用 triage 筛选候选：近期验证失败的代理跳过，跳过时长从 retry_after 开始随连续失败次数翻倍
+    (最多 max_retry_after)；曾经验证可用的代理排在前面优先验证。
+    超过 retention 秒没有再出现的代理在打开时清除。
+    """
+    # triage 读出的失败 / 可用键集合的缓存时长(秒)，流式验证时每批都要筛选
+    CACHE_TTL = 60
+
+    def __init__(self, path: str = "proxy_history.db", retry_after: float = 3600, max_retry_after: float = 7 * 86400,
+                 retention: float = 30 * 86400):
+        self.path = path
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.retention = retention
+
+        self._lock = threading.Lock()
+        self._cache = None  # (读出时间, 近期失败的代理, 曾经可用的代理)
+        # 获取线程与验证线程都会写入，由 _lock 串行化
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            columns = self._conn.execute("PRAGMA table_info(proxies)").fetchall()
+            legacy = []
+            if any(name == 'key' and type_ == 'INTEGER' for _, name, type_, *_ in columns):
+                # 旧版以打包整数为键，转换为 "协议://地址" 后重建表
+                legacy = self._conn.execute("SELECT key, last_seen, last_checked, last_ok, failure_streak, source "
+                                            "FROM proxies").fetchall()
+                self._conn.execute("DROP TABLE proxies")
+            self._conn.execute(_SCHEMA)
+            self._conn.executemany("INSERT INTO proxies VALUES (?, ?, ?, ?, ?, ?)",
+                                   ((_legacy_key(key), *rest) for key, *rest in legacy))
+            self._conn.execute("DELETE FROM proxies WHERE last_seen < ? AND last_checked < ?",
+                               (time.time() - retention,) * 2)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM proxies").fetchone()[0]
+
+    # --- 记录 ---
+    def record_seen(self, candidates: CandidateSet, source: str = None, now: float = None):
+        """候选代理出现在某个源中 (由 ProxyFetcher 在每个源完成时调用)。"""
+        now = time.time() if now is None else now
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO proxies (key, last_seen, source) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET last_seen = excluded.last_seen, source = excluded.source",
+                ((key, now, source) for key in candidates.keys()))
+
+    def record_checks(self, working, failed, now: float = None):
+        """验证结果，working / failed 为 (地址, 协议) 的可迭代对象，协议不区分大小写。"""
+        now = time.time() if now is None else now
+        working, failed = _keys(working), _keys(failed)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO proxies (key, last_checked, last_ok) VALUES (?, ?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET last_checked = excluded.last_checked, last_ok = 1, failure_streak = 0",
+                ((key, now) for key in working))
+            self._conn.executemany(
+                "INSERT INTO proxies (key, last_checked, last_ok, failure_streak) VALUES (?, ?, 0, 1) "
+                "ON CONFLICT(key) DO UPDATE SET last_checked = excluded.last_checked, last_ok = 0, "
+                "failure_streak = failure_streak + 1",
+                ((key, now) for key in failed))
+            self._cache = None
+
+    # --- 查询 ---
+    def _recently_dead(self, now: float) -> CandidateSet:
+        """仍在跳过期内的失败代理。跳过时长按连续失败次数分档查询，每档一条 SQL。"""
+        keys = []
+        streak, wait = 1, self.retry_after
+        with self._lock:
+            while wait < self.max_retry_after:
+                keys += self._conn.execute(
+                    "SELECT key FROM proxies WHERE last_ok = 0 AND failure_streak = ? AND last_checked > ?",
+                    (streak, now - wait)).fetchall()
+                streak, wait = streak + 1, wait * 2
+            keys += self._conn.execute(
+                "SELECT key FROM proxies WHERE last_ok = 0 AND failure_streak >= ? AND last_checked > ?",
+                (streak, now - self.max_retry_after)).fetchall()
+        return CandidateSet.from_keys(key for key, in keys)
+
+    def _known_good(self) -> CandidateSet:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM proxies WHERE last_ok = 1").fetchall()
+        return CandidateSet.from_keys(key for key, in rows)
+
+    def triage(self, candidates: CandidateSet, now: float = None):
+        """
+        验证前筛选，返回 (曾经可用的候选, 其余应验证的候选, 跳过的数量)。
+        失败与可用两类键从数据库读出后缓存 CACHE_TTL 秒，新的验证结果写入时作废。
+        """
+        now = time.time() if now is None else now
+        cache = self._cache
+        if cache is None or not 0 <= now - cache[0] < self.CACHE_TTL:
+            cache = self._cache = (now, self._recently_dead(now), self._known_good())
+        _, dead, known_good = cache
+        remaining = candidates.difference(dead)
+        skipped = len(candidates) - len(remaining)
+        good = remaining.intersection(known_good)
+        return good, remaining.difference(good), skipped
+
+    def stats(self) -> dict:
+        with self._lock:
+            total, working, failing = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(last_ok = 1), 0), COALESCE(SUM(last_ok = 0), 0) FROM proxies").fetchone()
+        return {'total': total, 'working': working, 'failing': failing}
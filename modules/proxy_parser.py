@@ -0,0 +1,320 @@
+# modules/proxy_parser.py
+
+"""
+代理列表解析：fetcher 与 hq.py 共用。
+先根据开头的内容判断格式 (json / jsonl / text)；纯文本列表对整个缓冲区只做一次预编译正则 findall，
+不再逐行 strip / split / re.match。bytes 直接按 latin-1 解码 (C 实现，几乎没有开销)，不做字符集探测。
+正则只接受 0~255 的八位组 (无前导零) 和 1~65535 的端口，匹配到的文本本身就是规范的 "ip:端口"，
+需要时再转换为 (IPv4 整数, 端口)。
+"域名:端口" 与 "[IPv6]:端口" 也保留 (统一转为小写)：只有内容中出现 "字母:数字" 或 "]:数字" 时
+才改用同时接受这两种形式的正则，纯 IPv4 列表仍走原来的快速路径。需要 IPv4 整数的 parse_proxies 会跳过它们。
+"""
+
+import json
+import re
+import socket
+import sys
+from array import array
+from itertools import repeat
+
+_OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]\d|\d)'
+_PORT = r'(?:6553[0-5]|655[0-2]\d|65[0-4]\d\d|6[0-4]\d{3}|[1-5]\d{4}|[1-9]\d{0,3})'
+_IP = rf'{_OCTET}\.{_OCTET}\.{_OCTET}\.{_OCTET}'
+# 前后不能紧挨数字或点，避免从 "1.2.3.4.5:80" 或 "01.2.3.4:80" 中截出一段
+_BEFORE = r'(?<![\d.])'
+_AFTER = r'(?!\d)'
+
+# 域名：以点分隔的标签，顶级域只含字母 (因此不会与 IPv4 混淆)；前面不能紧挨字母、数字、点或连字符
+_LABEL = r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+_HOST = rf'(?:{_LABEL}\.)+[a-z]{{2,63}}'
+_HOST_BEFORE = r'(?<![\w.-])'
+# 方括号中的 IPv6 (不含内嵌 IPv4 的写法)
+_IPV6 = r'\[(?:[0-9a-f]{0,4}:){2,7}[0-9a-f]{0,4}\]'
+_IP_OR_HOST = rf'(?:{_BEFORE}{_IP}|{_HOST_BEFORE}{_HOST}|{_IPV6})'
+
+_IP_RE = re.compile(_IP)
+_ADDRESS_RE = re.compile(rf'{_IP}:{_PORT}')
+_HOST_ADDRESS_RE = re.compile(rf'(?:{_IP}|{_HOST}|{_IPV6}):{_PORT}')
+_LINE_RE = re.compile(rf'^{_IP}:{_PORT}$', re.MULTILINE)
+_BARE_RE = re.compile(rf'{_BEFORE}{_IP}:{_PORT}{_AFTER}')
+_BARE_HOST_RE = re.compile(rf'{_IP_OR_HOST}:{_PORT}{_AFTER}')
+# 带协议头 (可含认证信息) 的形式，只在内容中出现 "://" 时使用
+_SCHEME = r'(?:(socks5h?|socks4a?|https?)://(?:[^\s@/]*@)?)?'
+_SCHEMED_RE = re.compile(rf'{_SCHEME}{_BEFORE}({_IP}):({_PORT}){_AFTER}', re.IGNORECASE)
+_SCHEMED_HOST_RE = re.compile(rf'{_SCHEME}({_IP_OR_HOST}):({_PORT}){_AFTER}')
+# 内容中可能有 "域名:端口" 或 "[IPv6]:端口" 的迹象 (顶级域最后一个字母或右方括号紧跟冒号和端口)
+_HOST_HINT_RE = re.compile(r'[A-Za-z\]]:\d')
+
+_PROTOCOLS = {'http': 'http', 'https': 'http', 'socks4': 'socks4', 'socks4a': 'socks4',
+              'socks5': 'socks5', 'socks5h': 'socks5'}
+# 常见的大写写法直接查表，省去 lower()
+_PROTOCOLS.update({name.upper(): protocol for name, protocol in _PROTOCOLS.items()})
+
+# 4 字节无符号整数的 array 类型码
+_U32 = next(code for code in 'IL' if array(code).itemsize == 4)
+
+
+def normalize_protocol(name):
+    """'HTTPS' -> 'http'，'socks5h' -> 'socks5' 等；不认识的返回 None。"""
+    if not isinstance(name, str):
+        return None
+    return _PROTOCOLS.get(name) or _PROTOCOLS.get(name.lower())
+
+
+def address_to_int(address: str):
+    """规范的 "ip:端口" -> (IPv4 整数, 端口)。"""
+    ip, _, port = address.rpartition(':')
+    return int.from_bytes(socket.inet_aton(ip), 'big'), int(port)
+
+
+def int_to_address(ip: int, port: int) -> str:
+    return f"{socket.inet_ntoa(ip.to_bytes(4, 'big'))}:{port}"
+
+
+def _as_text(data) -> str:
+    if isinstance(data, str):
+        return data
+    return bytes(data).decode('latin-1')
+
+
+def sniff_format(data) -> str:
+    """根据开头的内容判断格式：'json' (整个文档是一个 JSON)、'jsonl' (每行一个 JSON 对象) 或 'text'。"""
+    # 含 UTF-8 BOM (按 latin-1 解码后为 3 个字符)
+    head = _as_text(data[:4096]).lstrip('\ufeff\xef\xbb\xbf \t\r\n')
+    if head.startswith('['):
+        return 'json'
+    if head.startswith('{'):
+        # 格式化输出的 JSON 只有第一行以 "{" 开头；JSON Lines 的每一行都是
+        return 'jsonl' if '\n{' in head else 'json'
+    return 'text'
+
+
+def _ips_to_ints(ips) -> list:
+    """批量把规范的 IPv4 字符串转换为整数：inet_aton 拼接后一次性装入 array，避免逐个调用 int.from_bytes。"""
+    packed = array(_U32)
+    packed.frombytes(b''.join(map(socket.inet_aton, ips)))
+    if sys.byteorder == 'little':
+        packed.byteswap()
+    return packed.tolist()
+
+
+class _Columns:
+    """
+    解析结果按列存放：ip (或域名、[IPv6])、端口 (规范的字符串) 与协议各一个列表。
+    字符串不受循环垃圾回收跟踪，几十万个条目也不会因为大量小元组频繁触发全量 GC。
+    hosts 为 True 表示可能含有域名或 IPv6 条目。
+    """
+    __slots__ = ('ips', 'ports', 'protocols', 'hosts')
+
+    def __init__(self):
+        self.ips = []
+        self.ports = []
+        self.protocols = []
+        self.hosts = False
+
+    def __len__(self):
+        return len(self.ips)
+
+    def addresses(self):
+        return map('{}:{}'.format, self.ips, self.ports)
+
+    def drop_hosts(self):
+        """只保留 IPv4 条目 (供需要转换为整数的调用方使用)。"""
+        if not self.hosts:
+            return
+        kept = [i for i, ip in enumerate(self.ips) if _IP_RE.fullmatch(ip)]
+        self.ips = [self.ips[i] for i in kept]
+        self.ports = [self.ports[i] for i in kept]
+        self.protocols = [self.protocols[i] for i in kept]
+        self.hosts = False
+
+
+def _may_have_hosts(text: str) -> bool:
+    """
+    内容中是否可能有域名或 IPv6 条目。纯数字的列表先用 C 实现的大小写转换快速排除
+    (没有字母时 lower() / upper() 都不改变内容)，比直接用正则扫描整个缓冲区快一倍。
+    """
+    if ']' not in text and text.lower() == text and text.upper() == text:
+        return False
+    return _HOST_HINT_RE.search(text) is not None
+
+
+def _find_bare(text: str):
+    """
+    不含 "://" 的纯文本中的规范地址列表。只有出现 "字母:数字" 或 "]:数字" 时才改用接受域名与 IPv6 的正则
+    (转为小写)，返回 (地址列表, 是否可能含有域名或 IPv6)。
+    """
+    if not _may_have_hosts(text):
+        return _BARE_RE.findall(text), False
+    return _BARE_HOST_RE.findall(text.lower()), True
+
+
+def _scan_text(text: str, default_protocol, columns: _Columns):
+    """纯文本：一次 findall 扫描整个缓冲区。"""
+    if '://' not in text:
+        # "ip:端口" 拼接后把冒号换成换行再切分，奇数位是 ip、偶数位是端口，全程不产生元组
+        addresses, hosts = _find_bare(text)
+        if hosts:
+            # IPv6 地址本身含冒号，按最后一个冒号逐条切分
+            for address in addresses:
+                host, _, port = address.rpartition(':')
+                columns.ips.append(host)
+                columns.ports.append(port)
+            columns.protocols += [default_protocol] * len(addresses)
+            columns.hosts = True
+        elif addresses:
+            flat = '\n'.join(addresses).replace(':', '\n').split('\n')
+            columns.ips += flat[0::2]
+            columns.ports += flat[1::2]
+            columns.protocols += [default_protocol] * len(addresses)
+        return
+    if not _may_have_hosts(text):
+        matches = _SCHEMED_RE.findall(text)
+    else:
+        matches = _SCHEMED_HOST_RE.findall(text.lower())
+        columns.hosts = True
+    for scheme, ip, port in matches:
+        columns.ips.append(ip)
+        columns.ports.append(port)
+        columns.protocols.append(normalize_protocol(scheme) or default_protocol)
+
+
+def _json_items(doc):
+    """找出 JSON 文档中的代理条目列表：顶层数组，或 data / proxies 等字段下的数组。"""
+    if isinstance(doc, list):
+        return doc
+    if isinstance(doc, dict):
+        for key in ('data', 'proxies', 'list', 'result'):
+            value = doc.get(key)
+            if isinstance(value, list):
+                return value
+            if isinstance(value, dict):
+                return _json_items(value)
+        return [doc]
+    return []
+
+
+def _scan_json_items(items, default_protocol, columns: _Columns):
+    """
+    JSON 条目：{"ip"/"host": ..., "port": ..., "protocol"/"type"/"protocols": ...} 或 "ip:端口" 字符串，
+    ip 字段也可以是域名或 IPv6 (可不带方括号)。
+    先不做校验地收集，最后对拼接后的整段文本做一次多行 findall 批量校验：
+    逐条 fullmatch 会产生几十万个受 GC 跟踪的 Match 对象，反复触发对刚解析出的整棵 JSON 的全量回收。
+    """
+    protocols_get = _PROTOCOLS.get
+    ips, ports, protocols = [], [], []
+    add_ip, add_port, add_protocol = ips.append, ports.append, protocols.append
+    for item in items:
+        if type(item) is not dict:
+            if isinstance(item, str):
+                _scan_text(item, default_protocol, columns)
+            continue
+        get = item.get
+        host = get('ip') or get('host') or get('addr') or get('proxy')
+        if type(host) is not str:
+            continue
+        protocol = get('protocol') or get('type')
+        if protocol is None:
+            protocol = get('protocols')
+            protocol = protocol[0] if protocol and type(protocol) is list else None
+        if protocol is not None:
+            protocol = protocols_get(protocol) or normalize_protocol(protocol)
+        port = get('port')
+        if port is None:
+            _scan_text(host, protocol or default_protocol, columns)  # "ip:端口" 写在同一个字段里
+            continue
+        add_ip(host)
+        add_port(port if type(port) is str else str(port))
+        add_protocol(protocol or default_protocol)
+
+    if len(_LINE_RE.findall('\n'.join(map('{}:{}'.format, ips, ports)))) != len(ips):
+        # 有域名、IPv6、不合法或带空白的条目 (少见)，逐条校验
+        address_ok = _HOST_ADDRESS_RE.fullmatch
+        hosts = (f"[{ip}]" if ':' in ip and ip[0] != '[' else ip for ip in (ip.strip().lower() for ip in ips))
+        kept = [(ip, port, protocol) for ip, port, protocol in zip(hosts, map(str.strip, ports), protocols)
+                if address_ok(f"{ip}:{port}")]
+        ips, ports, protocols = [e[0] for e in kept], [e[1] for e in kept], [e[2] for e in kept]
+        columns.hosts = True
+    columns.ips += ips
+    columns.ports += ports
+    columns.protocols += protocols
+
+
+def _scan(data, default_protocol) -> _Columns:
+    """按格式解析，返回按列存放的 ip、端口 (规范的字符串) 与协议。"""
+    fmt = sniff_format(data)
+    columns = _Columns()
+    if fmt == 'text':
+        _scan_text(_as_text(data), default_protocol, columns)
+        return columns
+    if not isinstance(data, (str, bytes)):
+        data = bytes(data)
+    if fmt == 'jsonl':
+        # 各行拼成一个 JSON 数组一次解析，比逐行 json.loads 快得多；有损坏的行时再逐行解析
+        lines = [line for line in data.splitlines() if line.strip()]
+        separator, brackets = (b',', (b'[', b']')) if isinstance(data, bytes) else (',', ('[', ']'))
+        try:
+            items = json.loads(brackets[0] + separator.join(lines) + brackets[1])
+        except ValueError:
+            items = []
+            for line in lines:
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    continue
+        _scan_json_items(items, default_protocol, columns)
+        return columns
+    try:
+        doc = json.loads(data)
+    except ValueError:
+        _scan_text(_as_text(data), default_protocol, columns)
+        return columns
+    _scan_json_items(_json_items(doc), default_protocol, columns)
+    return columns
+
+
+def parse_columns(data, default_protocol=None):
+    """
+    解析代理列表，按列返回 (ip 列表, 端口列表, 协议列表)，均为规范的字符串，不去重。
+    供需要批量转换的调用方使用，不产生逐条的元组。
+    """
+    columns = _scan(data, default_protocol)
+    return columns.ips, columns.ports, columns.protocols
+
+
+def parse_proxies(data, default_protocol=None) -> list:
+    """
+    解析代理列表 (str 或 bytes)，返回 [(IPv4 整数, 端口, 协议)]，不去重。
+    协议取条目自带的 (协议头或 JSON 字段，已规范化)，没有时为 default_protocol。域名与 IPv6 条目无法表示为整数，跳过。
+    """
+    columns = _scan(data, default_protocol)
+    columns.drop_hosts()
+    return list(zip(_ips_to_ints(columns.ips), map(int, columns.ports), columns.protocols))
+
+
+def parse_addresses(data, default_protocol=None) -> list:
+    """同 parse_proxies，但地址保持规范的字符串 ("ip:端口"、"域名:端口" 或 "[IPv6]:端口")：返回 [(地址, 协议)]。"""
+    if sniff_format(data) == 'text':
+        text = _as_text(data)
+        if '://' not in text:
+            return list(zip(_find_bare(text)[0], repeat(default_protocol)))
+    columns = _scan(data, default_protocol)
+    return list(zip(columns.addresses(), columns.protocols))
+
+
+def parse_proxy_strings(data, protocol=None) -> list:
+    """
+    解析代理列表，返回去重后的规范地址列表 (保持首次出现的顺序)，地址形式同 parse_addresses。
+    指定 protocol 时只保留自带协议与之相同或未标明协议的条目。
+    """
+    if sniff_format(data) == 'text':
+        text = _as_text(data)
+        if '://' not in text:
+            # 最常见的纯 "ip:端口" 列表：findall 直接得到规范地址
+            return list(dict.fromkeys(_find_bare(text)[0]))
+    columns = _scan(data, None)
+    addresses = columns.addresses()
+    if protocol is not None:
+        protocol = normalize_protocol(protocol)
+        addresses = (address for address, own in zip(addresses, columns.protocols) if own is None or own == protocol)
+    return list(dict.fromkeys(addresses))
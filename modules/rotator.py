@@ -1,14 +1,152 @@
 # modules/rotator.py
 
+import bisect
+import itertools
 import threading
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+
+# 所有环共用的日志编号来源：编号全局唯一，被淘汰的环即使 id() 被新环复用，也不会与新环的编号相同
+_ring_log_ids = itertools.count(1)
+
+
+class RotationRing:
+    """
+    某个筛选条件 (地区, 延迟阈值) 下的候选代理环，按分数降序排列，同分按加入顺序。
+    代理增删或状态变化时增量插入/删除，取下一个代理只需移动游标，为 O(1)。
+    环记录内容有变化的地址 (变化日志)，选择策略据此增量更新自己的缓存，见 changes_since。
+    """
+    def __init__(self, region="All", quality_latency_ms=None):
+        self.region = region
+        self.quality_latency_ms = quality_latency_ms
+        self._keys = []  # 有序的 (-score, seq, address)
+        self._key_by_address = {}
+        self.cursor = -1
+        self.log_id = next(_ring_log_ids)  # 变化日志的编号，日志重置时更新为新的全局唯一值
+        self._changes = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def address_at(self, pos: int) -> str:
+        return self._keys[pos][2]
+
+    def addresses(self):
+        return [key[2] for key in self._keys]
+
+    def scores(self):
+        return [-key[0] for key in self._keys]
+
+    def score_of(self, address: str):
+        """代理在环中的分数，不在环中时返回 None。"""
+        key = self._key_by_address.get(address)
+        return None if key is None else -key[0]
+
+    def changes_since(self, log_id: int, offset: int):
+        """
+        日志 log_id 中第 offset 条之后有变化 (加入、移除或分数改变) 的地址，可能有重复。
+        日志已重置 (log_id 与当前不同) 时返回 None，调用方需全量重建缓存。
+        """
+        if log_id != self.log_id:
+            return None
+        return self._changes[offset:]
+
+    def log_position(self):
+        """(log_id, 日志长度)，即下次调用 changes_since 的参数。"""
+        return self.log_id, len(self._changes)
+
+    def _log_change(self, address: str):
+        # 日志长度超过环大小的两倍时重置，读取方全量重建一次，均摊开销仍为每次变化 O(1)
+        if len(self._changes) >= max(1024, 2 * len(self._keys)):
+            self._reset_log()
+        else:
+            self._changes.append(address)
+
+    def _reset_log(self):
+        self.log_id = next(_ring_log_ids)
+        self._changes = []
+
+    def matches(self, proxy_info: dict) -> bool:
+        if proxy_info.get('status') != 'Working':
+            return False
+        if self.region != "All" and proxy_info.get('location') != self.region:
+            return False
+        if self.quality_latency_ms is not None:
+            return proxy_info.get('latency', float('inf')) * 1000 <= self.quality_latency_ms
+        return True
+
+    def rebuild(self, items):
+        """由 (proxy_info, seq) 批量构建环，一次排序，避免逐个插入的平方级开销。"""
+        self._keys = sorted((-p.get('score', 0), seq, p.get('proxy')) for p, seq in items)
+        self._key_by_address = {key[2]: key for key in self._keys}
+        self.cursor = -1
+        self._reset_log()
+
+    def add(self, proxy_info: dict, seq: int):
+        address = proxy_info.get('proxy')
+        if address in self._key_by_address:
+            self.discard(address)
+        key = (-proxy_info.get('score', 0), seq, address)
+        pos = bisect.bisect_left(self._keys, key)
+        self._keys.insert(pos, key)
+        self._key_by_address[address] = key
+        self._log_change(address)
+        if pos <= self.cursor:
+            self.cursor += 1
+
+    def discard(self, address: str):
+        key = self._key_by_address.pop(address, None)
+        if key is None:
+            return
+        pos = bisect.bisect_left(self._keys, key)
+        del self._keys[pos]
+        self._log_change(address)
+        # 删除游标处或之前的元素时游标回退一格，保证轮换顺序不跳过后继代理
+        if pos <= self.cursor:
+            self.cursor -= 1
+
+    def position_after(self, key) -> int:
+        """排序键 (-分数, 序号, 地址) 之后的位置，键不必在环中；越过环尾时回到环首。"""
+        return bisect.bisect_right(self._keys, key) % len(self._keys) if self._keys else 0
+
+    def walk(self, start: int):
+        """从位置 start 起绕环一周依次产出地址，不移动游标。"""
+        size = len(self._keys)
+        for i in range(size):
+            yield self._keys[(start + i) % size][2]
+
+    def next(self):
+        """返回下一个代理地址，环为空时返回 None。"""
+        if not self._keys:
+            return None
+        self.cursor = (self.cursor + 1) % len(self._keys)
+        return self._keys[self.cursor][2]
+
 
 class ProxyRotator:
-    """代理轮换器，负责管理、轮换和筛选代理。"""
-    def __init__(self):
-        self.all_proxies = []
-        self.proxies_by_country = defaultdict(list)
-        self.indices = defaultdict(lambda: -1)
+    """
+    代理轮换器，负责管理、轮换和筛选代理。
+    代理按地址存放在字典中，另有按状态、国家、协议的二级索引，增删查改均为 O(1)。
+    每种用过的筛选条件对应一个 RotationRing，随索引一起增量维护。
+    """
+    MAX_RINGS = 32
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        """按 config.json 创建：被动淘汰与重测调度器共用 general 段的 failure_threshold。"""
+        return cls(failure_threshold=settings.get('general', {}).get('failure_threshold', 3))
+
+    def __init__(self, failure_threshold: int = 1):
+        # 实时转发中连续失败多少次后将代理标记为不可用，默认 1 即首次失败立即标记
+        self.failure_threshold = max(1, failure_threshold)
+        self._proxies = {}  # 代理地址 -> 代理信息，保持插入顺序
+        self._index_keys = {}  # 代理地址 -> 建索引时的 (status, country, protocol)
+        self._by_status = defaultdict(dict)
+        self.proxies_by_country = defaultdict(dict)
+        self._by_protocol = defaultdict(dict)
+        self._seq = {}  # 代理地址 -> 加入序号，用于同分代理的稳定排序
+        self._seq_counter = itertools.count()
+        self._rings = OrderedDict()  # (region, latency_ms) -> RotationRing，按最近使用排序
+        self._live = {}  # 代理地址 -> {'in_flight': 进行中连接数, 'ewma_latency': 实时连接耗时}
         self.current_proxy = None
         self.lock = threading.Lock()
         
@@ -16,12 +154,49 @@ class ProxyRotator:
         self.current_filter_region = "All"
         self.current_filter_quality_latency_ms = None
 
+    @property
+    def all_proxies(self):
+        """所有代理的列表（按加入顺序）。"""
+        with self.lock:
+            return list(self._proxies.values())
+
+    # --- 索引维护 (调用方需持有锁) ---
+    def _index(self, proxy_info: dict):
+        address = proxy_info.get('proxy')
+        keys = (proxy_info.get('status'), proxy_info.get('location', 'Unknown'), str(proxy_info.get('protocol', '')).upper())
+        self._index_keys[address] = keys
+        self._by_status[keys[0]][address] = proxy_info
+        self.proxies_by_country[keys[1]][address] = proxy_info
+        self._by_protocol[keys[2]][address] = proxy_info
+        for ring in self._rings.values():
+            if ring.matches(proxy_info):
+                ring.add(proxy_info, self._seq[address])
+
+    def _unindex(self, address: str):
+        # 使用建索引时记录的键，即使代理字典在外部被直接修改过也能正确移除
+        keys = self._index_keys.pop(address, None)
+        if keys is None:
+            return
+        for ring in self._rings.values():
+            ring.discard(address)
+        for index, key in zip((self._by_status, self.proxies_by_country, self._by_protocol), keys):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(address, None)
+                if not bucket:
+                    del index[key]
+
     def clear(self):
         """清空所有代理，并重置内部状态。"""
         with self.lock:
-            self.all_proxies = []
+            self._proxies.clear()
+            self._index_keys.clear()
+            self._by_status.clear()
             self.proxies_by_country.clear()
-            self.indices.clear()
+            self._by_protocol.clear()
+            self._seq.clear()
+            self._rings.clear()
+            self._live.clear()
             self.current_proxy = None
     
     def set_filters(self, region="All", quality_latency_ms=None):
@@ -34,89 +209,159 @@ class ProxyRotator:
         """添加一个新代理，如果代理地址已存在则忽略。"""
         with self.lock:
             proxy_address = proxy_info.get('proxy')
-            if any(p.get('proxy') == proxy_address for p in self.all_proxies):
+            if proxy_address in self._proxies:
                 return 
 
             proxy_info.setdefault('consecutive_failures', 0)
             proxy_info.setdefault('status', 'Working')
-            self.all_proxies.append(proxy_info)
-            country = proxy_info.get('location', 'Unknown')
-            self.proxies_by_country[country].append(proxy_info)
+            self._proxies[proxy_address] = proxy_info
+            self._seq[proxy_address] = next(self._seq_counter)
+            self._index(proxy_info)
 
     def remove_proxy(self, proxy_address: str):
         """根据代理地址移除一个代理。"""
         with self.lock:
-            proxy_to_remove = None
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    proxy_to_remove = p_info
-                    break
-            
-            if proxy_to_remove:
-                self.all_proxies.remove(proxy_to_remove)
-                
-                country = proxy_to_remove.get('location', 'Unknown')
-                if country in self.proxies_by_country:
-                    try:
-                        self.proxies_by_country[country].remove(proxy_to_remove)
-                        if not self.proxies_by_country[country]:
-                            del self.proxies_by_country[country]
-                    except ValueError:
-                        pass
-                
-                if self.current_proxy and self.current_proxy.get('proxy') == proxy_address:
-                    self.current_proxy = None
-                return True
+            return self._discard(proxy_address)
+
+    def _discard(self, proxy_address: str):
+        """移除代理及其索引，调用方需持有锁。"""
+        if self._proxies.pop(proxy_address, None) is None:
             return False
+        self._unindex(proxy_address)
+        del self._seq[proxy_address]
+        self._live.pop(proxy_address, None)
+        if self.current_proxy and self.current_proxy.get('proxy') == proxy_address:
+            self.current_proxy = None
+        return True
+
+    # --- 多进程同步 ---
+    def snapshot(self) -> dict:
+        """代理池状态的可序列化副本，供多进程模式下同步给工作进程。"""
+        with self.lock:
+            return {
+                'proxies': [dict(p_info) for p_info in self._proxies.values()],
+                'current': self.current_proxy.get('proxy') if self.current_proxy else None,
+                'region': self.current_filter_region,
+                'quality_latency_ms': self.current_filter_quality_latency_ms,
+            }
+
+    def load_snapshot(self, snapshot: dict):
+        """
+        以快照替换代理池内容。只对新增、删除和有变化的代理更新索引，
+        未变化的代理保留其在轮换环中的位置和实时负载统计。
+        """
+        with self.lock:
+            incoming = OrderedDict((p_info['proxy'], p_info) for p_info in snapshot.get('proxies', ()))
+            for address in [address for address in self._proxies if address not in incoming]:
+                self._discard(address)
+            for address, p_info in incoming.items():
+                existing = self._proxies.get(address)
+                if existing is None:
+                    p_info = dict(p_info)
+                    self._proxies[address] = p_info
+                    self._seq[address] = next(self._seq_counter)
+                    self._index(p_info)
+                elif existing != p_info:
+                    self._unindex(address)
+                    existing.clear()
+                    existing.update(p_info)
+                    self._index(existing)
+            current = snapshot.get('current')
+            self.current_proxy = self._proxies.get(current) if current else None
+            self.current_filter_region = snapshot.get('region', "All")
+            self.current_filter_quality_latency_ms = snapshot.get('quality_latency_ms')
 
-    def report_failure(self, proxy_address: str):
+    def report_failure(self, proxy_address: str) -> bool:
         """
-        [NEW] 报告一个代理连接失败，立即将其状态设置为不可用。
-        这个方法是线程安全的。
+        [NEW] 报告一个代理连接失败，累计连续失败次数，达到 failure_threshold 时将其状态设置为不可用。
+        返回本次是否将其标记为不可用。这个方法是线程安全的。
         """
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info['status'] = 'Unavailable'
-                    # 可以在这里增加失败计数，但为了即时响应，直接设为不可用更有效
-                    # p_info['consecutive_failures'] = p_info.get('consecutive_failures', 0) + 1
-                    return
+            p_info = self._proxies.get(proxy_address)
+            if p_info is None:
+                return False
+            p_info['consecutive_failures'] = p_info.get('consecutive_failures', 0) + 1
+            p_info['consecutive_successes'] = 0
+            if p_info['consecutive_failures'] < self.failure_threshold or p_info.get('status') != 'Working':
+                return False
+            self._unindex(proxy_address)
+            p_info['status'] = 'Unavailable'
+            self._index(p_info)
+            return True
+
+    def report_success(self, proxy_address: str):
+        """报告一次成功的连接，清零连续失败次数。"""
+        with self.lock:
+            p_info = self._proxies.get(proxy_address)
+            if p_info is not None and p_info.get('consecutive_failures'):
+                p_info['consecutive_failures'] = 0
 
     def get_proxy_by_address(self, proxy_address: str):
         """根据代理地址查询代理的详细信息。"""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    return p_info
-            return None
+            return self._proxies.get(proxy_address)
 
     def update_proxy(self, proxy_address: str, update_data: dict):
-        """更新指定代理的信息，例如状态、延迟等。"""
+        """更新指定代理的信息，例如状态、延迟等。外部设置的 score 同时作为 base_score 保存。"""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info.update(update_data)
-                    return True
-            return False
+            p_info = self._proxies.get(proxy_address)
+            if p_info is None:
+                return False
+            self._unindex(proxy_address)
+            p_info.update(update_data)
+            if 'score' in update_data:
+                p_info['base_score'] = update_data['score']
+            self._index(p_info)
+            return True
+
+    def apply_live_score(self, proxy_address: str, live_score: float, weight: float = 0.5):
+        """
+        把本地服务实测的分数 (0~100) 与验证得分 (base_score) 按权重混合后作为排序用的 score。
+        验证得分在首次混合时从当前 score 取得，之后由 update_proxy 更新。
+        """
+        with self.lock:
+            p_info = self._proxies.get(proxy_address)
+            if p_info is None:
+                return False
+            base_score = p_info.setdefault('base_score', p_info.get('score', 0))
+            p_info['live_score'] = live_score
+            score = round(base_score * (1 - weight) + live_score * weight, 1)
+            if score != p_info.get('score'):
+                self._unindex(proxy_address)
+                p_info['score'] = score
+                self._index(p_info)
+            return True
+
+    def get_proxies_by_status(self, status: str = 'Working'):
+        """按状态查询代理（使用索引）。"""
+        with self.lock:
+            return list(self._by_status.get(status, {}).values())
+
+    def get_proxies_by_country(self, country: str):
+        """按地区查询代理（使用索引）。"""
+        with self.lock:
+            return list(self.proxies_by_country.get(country, {}).values())
+
+    def get_proxies_by_protocol(self, protocol: str):
+        """按协议查询代理（使用索引）。"""
+        with self.lock:
+            return list(self._by_protocol.get(protocol.upper(), {}).values())
 
     def get_all_proxies_for_revalidation(self):
         """获取所有代理的副本，用于重新验证。"""
         with self.lock:
-            return list(self.all_proxies)
+            return list(self._proxies.values())
 
     def get_active_proxies_count(self) -> int:
         """统计当前状态为 'Working' 的代理数量。"""
         with self.lock:
-            return sum(1 for p in self.all_proxies if p.get('status') == 'Working')
+            return len(self._by_status.get('Working', {}))
 
     def get_available_regions_with_counts(self, quality_latency_ms=None) -> dict:
         """按地区统计 'Working' 状态的代理数量，支持按延迟筛选。"""
         with self.lock:
             counts = defaultdict(int)
-            for p_info in self.all_proxies:
-                if p_info.get('status') != 'Working':
-                    continue
-                
+            for p_info in self._by_status.get('Working', {}).values():
                 if quality_latency_ms is not None:
                     latency_ms = p_info.get('latency', float('inf')) * 1000
                     if latency_ms > quality_latency_ms:
@@ -127,51 +372,123 @@ class ProxyRotator:
             return dict(counts)
 
 
+    def _get_ring(self, region, quality_latency_ms):
+        """取得筛选条件对应的轮换环，首次使用时从 'Working' 索引构建。调用方需持有锁。"""
+        key = (region, quality_latency_ms)
+        ring = self._rings.get(key)
+        if ring is not None:
+            self._rings.move_to_end(key)
+            return ring
+        ring = RotationRing(region, quality_latency_ms)
+        ring.rebuild((p_info, self._seq[address]) for address, p_info in self._by_status.get('Working', {}).items()
+                     if ring.matches(p_info))
+        self._rings[key] = ring
+        # 环的数量有上限，避免每次增删代理都要维护大量不再使用的环
+        while len(self._rings) > self.MAX_RINGS:
+            self._rings.popitem(last=False)
+        return ring
+
     def get_next_proxy(self):
         """根据内部存储的筛选条件，轮换获取下一个可用代理，并按分数排序。"""
         with self.lock:
-            candidate_proxies = []
-            
             # 使用内部存储的过滤器
             effective_region = self.current_filter_region
             effective_latency = self.current_filter_quality_latency_ms
 
-            for p in self.all_proxies:
-                if p.get('status') == 'Working':
-                    region_match = (effective_region == "All" or p.get('location') == effective_region)
-                    
-                    quality_match = True
-                    if effective_latency is not None:
-                        latency_ms = p.get('latency', float('inf')) * 1000
-                        quality_match = (latency_ms <= effective_latency)
-
-                    if region_match and quality_match:
-                        candidate_proxies.append(p)
-            
-            if not candidate_proxies:
+            address = self._get_ring(effective_region, effective_latency).next()
+            if address is None and (effective_region != "All" or effective_latency is not None):
                 # 如果当前条件下无代理, 尝试放宽条件(不限区域和延迟)
-                if effective_region != "All" or effective_latency is not None:
-                    original_region = self.current_filter_region
-                    original_latency = self.current_filter_quality_latency_ms
-                    self.set_filters("All", None)
-                    result = self.get_next_proxy()
-                    self.set_filters(original_region, original_latency) # 恢复之前的过滤器
-                    return result
+                address = self._get_ring("All", None).next()
 
+            if address is None:
                 self.current_proxy = None
                 return None
 
-            candidate_proxies.sort(key=lambda p: p.get('score', 0), reverse=True)
-            
-            quality_key = f"lt{effective_latency}" if effective_latency is not None else "any"
-            index_key = f"{effective_region}_{quality_key}"
-            current_idx = self.indices.get(index_key, -1)
-            next_idx = (current_idx + 1) % len(candidate_proxies)
-            self.indices[index_key] = next_idx
-            
-            self.current_proxy = candidate_proxies[next_idx]
+            self.current_proxy = self._proxies[address]
             return self.current_proxy
 
+    def select_proxy(self, strategy, target_host=None, update_current=True):
+        """
+        按给定的选择策略 (modules/strategies.py) 从当前筛选条件的候选中选出一个代理。
+        当前条件下无候选时与 get_next_proxy 一样放宽到不限区域和延迟。
+        update_current=False 时不改变当前代理（用于故障转移时临时借用其他上游）。
+        """
+        with self.lock:
+            effective_region = self.current_filter_region
+            effective_latency = self.current_filter_quality_latency_ms
+
+            address = strategy.select(self, self._get_ring(effective_region, effective_latency), target_host)
+            if address is None and (effective_region != "All" or effective_latency is not None):
+                address = strategy.select(self, self._get_ring("All", None), target_host)
+
+            if address is None:
+                if update_current:
+                    self.current_proxy = None
+                return None
+
+            if update_current:
+                self.current_proxy = self._proxies[address]
+            return self._proxies[address]
+
+    def failover_candidates(self, after_address, exclude=(), limit: int = 16) -> list:
+        """
+        故障转移的候选：在当前筛选条件的环中从 after_address 之后按分数降序绕环查找，最多返回 limit 个不在 exclude 中的代理。
+        不移动轮换游标，也不改变当前代理，故障转移不会打乱主轮换的顺序。
+        after_address 已不在环中 (如刚被标记为不可用) 时从它原来的排序位置之后开始，为 None 时从环首开始。
+        """
+        with self.lock:
+            ring = self._get_ring(self.current_filter_region, self.current_filter_quality_latency_ms)
+            if not len(ring):
+                ring = self._get_ring("All", None)
+            start = 0
+            p_info = self._proxies.get(after_address)
+            if p_info is not None:
+                start = ring.position_after((-p_info.get('score', 0), self._seq[after_address], after_address))
+            candidates = []
+            for address in ring.walk(start):
+                if address in exclude:
+                    continue
+                candidates.append(self._proxies[address])
+                if len(candidates) >= limit:
+                    break
+            return candidates
+
+    # --- 实时负载统计 (供选择策略使用) ---
+    def begin_use(self, proxy_address: str):
+        """本地服务开始通过该代理转发一个连接。"""
+        with self.lock:
+            live = self._live.setdefault(proxy_address, {'in_flight': 0, 'ewma_latency': None})
+            live['in_flight'] += 1
+
+    def end_use(self, proxy_address: str):
+        """通过该代理转发的连接结束。"""
+        with self.lock:
+            live = self._live.get(proxy_address)
+            if live and live['in_flight'] > 0:
+                live['in_flight'] -= 1
+
+    def record_latency(self, proxy_address: str, latency: float, alpha: float = 0.3):
+        """记录一次经由该代理建立连接的耗时(秒)，以 EWMA 平滑。"""
+        with self.lock:
+            if proxy_address not in self._proxies:
+                return
+            live = self._live.setdefault(proxy_address, {'in_flight': 0, 'ewma_latency': None})
+            previous = live['ewma_latency']
+            live['ewma_latency'] = latency if previous is None else previous * (1 - alpha) + latency * alpha
+
+    def in_flight(self, proxy_address: str) -> int:
+        """进行中的连接数。调用方需持有锁（选择策略在 select_proxy 内调用）。"""
+        live = self._live.get(proxy_address)
+        return live['in_flight'] if live else 0
+
+    def live_cost(self, proxy_address: str) -> float:
+        """实时代价 = 延迟 x (1 + 进行中连接数)。调用方需持有锁。"""
+        live = self._live.get(proxy_address)
+        latency = live['ewma_latency'] if live and live['ewma_latency'] is not None else None
+        if latency is None:
+            latency = self._proxies[proxy_address].get('latency', float('inf'))
+        return latency * (1 + (live['in_flight'] if live else 0))
+
     def get_current_proxy(self):
         """获取当前正在使用的代理。"""
         with self.lock:
@@ -182,8 +499,8 @@ class ProxyRotator:
     def set_current_proxy_by_address(self, proxy_address: str):
         """根据地址手动设置当前代理，代理必须可用。"""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address and p_info.get('status') == 'Working':
-                    self.current_proxy = p_info
-                    return p_info
+            p_info = self._proxies.get(proxy_address)
+            if p_info is not None and p_info.get('status') == 'Working':
+                self.current_proxy = p_info
+                return p_info
             return None
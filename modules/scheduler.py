@@ -0,0 +1,198 @@
+# modules/scheduler.py
+
+import heapq
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RevalidationScheduler:
+    """
+    增量重测调度器，取代定时全量重测。
+    每个代理按上次结果的"新旧"和"健康度"各自计算下次重测时间，放入以到期时间为键的小顶堆；
+    稳定可用的代理重测间隔逐步拉长，刚失败或时好时坏的代理很快再测一次。
+    全局按每秒检测预算(令牌桶)出队，出口带宽占用平稳，不会出现周期性的全量扫描尖峰。
+    """
+    def __init__(self, rotator, checker, log_queue, base_interval: float = 300, min_interval: float = 30,
+                 max_interval: float = 3600, checks_per_second: float = 5, profile: str = 'quick',
+                 failure_threshold: int = 3, max_workers: int = 20, sync_interval: float = 5):
+        self.rotator = rotator
+        self.checker = checker
+        self.log_queue = log_queue
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.checks_per_second = checks_per_second
+        self.profile = profile
+        self.failure_threshold = failure_threshold
+        self.max_workers = max_workers
+        self.sync_interval = sync_interval
+
+        self._heap = []  # (due_time, seq, proxy_address)
+        self._scheduled = set()
+        self._seq = 0
+        self._completed = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {'checks': 0, 'working': 0, 'failed': 0, 'removed': 0, 'max_lag': 0.0}
+
+    @classmethod
+    def from_settings(cls, settings: dict, rotator, checker, log_queue):
+        """按 config.json 的 general 段创建调度器。auto_retest_interval 单位为分钟。"""
+        general = settings.get('general', {})
+        return cls(rotator, checker, log_queue,
+                   base_interval=general.get('auto_retest_interval', 5) * 60,
+                   checks_per_second=general.get('auto_retest_budget', 5),
+                   profile=general.get('revalidation_profile', 'quick'),
+                   failure_threshold=general.get('failure_threshold', 3))
+
+    def log(self, message):
+        self.log_queue.put(f"[Scheduler] {message}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.log(f"增量重测已启动，预算 {self.checks_per_second} 次/秒，档位 {self.profile}。")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self.log("增量重测已停止。")
+
+    def queue_size(self) -> int:
+        return len(self._scheduled)
+
+    # --- 调度策略 ---
+    def next_interval(self, proxy_info: dict) -> float:
+        """
+        根据代理当前状态计算下次重测的间隔：
+        - 最近一次失败：按 min_interval 尽快复测，确认是偶发还是真的失效；
+        - 可用：基础间隔 x 2^连续成功次数(最多16倍)，再乘以健康度(0~1)，时好时坏的代理间隔更短。
+        """
+        if proxy_info.get('status') != 'Working':
+            return self.min_interval
+        streak = min(proxy_info.get('consecutive_successes', 0), 4)
+        health = proxy_info.get('health', 1.0)
+        interval = self.base_interval * (2 ** streak) * max(health, 0.1)
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _push(self, proxy_address: str, due: float):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, proxy_address))
+        self._scheduled.add(proxy_address)
+
+    def _sync_with_rotator(self, now: float):
+        """把轮换器中新增的代理加入调度。刚加入的代理刚验证过，首次重测时间在基础间隔内随机打散。"""
+        for proxy_info in self.rotator.get_all_proxies_for_revalidation():
+            address = proxy_info.get('proxy')
+            if address in self._scheduled:
+                continue
+            last_checked = proxy_info.get('last_checked')
+            if last_checked is not None:
+                due = last_checked + self.next_interval(proxy_info)
+            else:
+                due = now + random.uniform(0, self.base_interval)
+            self._push(address, due)
+
+    # --- 结果处理 ---
+    def _apply_result(self, proxy_address: str, result: dict, now: float):
+        proxy_info = self.rotator.get_proxy_by_address(proxy_address)
+        if proxy_info is None:
+            return None
+
+        stages = self.checker.get_profile(self.profile)['stages']
+        health = proxy_info.get('health', 1.0)
+        self.stats['checks'] += 1
+        if result and result.get('status') == 'Working':
+            self.stats['working'] += 1
+            update = {
+                'status': 'Working', 'latency': result['latency'], 'last_checked': now,
+                'consecutive_failures': 0,
+                'consecutive_successes': proxy_info.get('consecutive_successes', 0) + 1,
+                'health': health * 0.7 + 0.3,
+            }
+            # 只覆盖本档位实际测量过的字段
+            if 'anonymity' in stages:
+                update['anonymity'] = result['anonymity']
+            if 'speed' in stages and result.get('speed'):
+                update['speed'] = result['speed']
+            if result.get('location') not in (None, 'N/A'):
+                update['location'] = result['location']
+        else:
+            self.stats['failed'] += 1
+            failures = proxy_info.get('consecutive_failures', 0) + 1
+            if failures >= self.failure_threshold:
+                self.rotator.remove_proxy(proxy_address)
+                self.stats['removed'] += 1
+                self.log(f"代理 {proxy_address} 连续 {failures} 次重测失败，已移除。")
+                return None
+            update = {
+                'status': 'Unavailable', 'last_checked': now,
+                'consecutive_failures': failures, 'consecutive_successes': 0,
+                'health': health * 0.7,
+            }
+        self.rotator.update_proxy(proxy_address, update)
+        return self.rotator.get_proxy_by_address(proxy_address)
+
+    def _check(self, proxy_info: dict):
+        return self.checker._full_check_proxy(
+            {'proxy': proxy_info['proxy'], 'protocol': proxy_info.get('protocol', 'http')},
+            'online', self._stop_event, True, self.profile)
+
+    # --- 主循环 ---
+    def _run(self):
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        in_flight = {}
+        tokens = 0.0
+        last_refill = last_sync = 0.0
+        try:
+            while not self._stop_event.is_set():
+                now = time.time()
+                if now - last_sync >= self.sync_interval:
+                    self._sync_with_rotator(now)
+                    last_sync = now
+
+                # 令牌桶：按预算补充，最多积攒1秒的额度
+                tokens = min(self.checks_per_second, tokens + (now - last_refill) * self.checks_per_second) if last_refill else 1.0
+                last_refill = now
+
+                while (tokens >= 1 and self._heap and self._heap[0][0] <= now
+                       and len(in_flight) < self.max_workers * 2):
+                    due, _, address = heapq.heappop(self._heap)
+                    proxy_info = self.rotator.get_proxy_by_address(address)
+                    if proxy_info is None:
+                        # 已从轮换器移除，惰性丢弃
+                        self._scheduled.discard(address)
+                        continue
+                    tokens -= 1
+                    self.stats['max_lag'] = max(self.stats['max_lag'], now - due)
+                    future = executor.submit(self._check, proxy_info)
+                    in_flight[future] = address
+                    future.add_done_callback(self._completed.put)
+
+                try:
+                    future = self._completed.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                address = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.log(f"[!] 重测 {address} 时出现异常: {e}")
+                    result = None
+                if self._stop_event.is_set():
+                    break
+                now = time.time()
+                proxy_info = self._apply_result(address, result, now)
+                if proxy_info is None:
+                    self._scheduled.discard(address)
+                else:
+                    self._push(address, now + self.next_interval(proxy_info))
+        finally:
+            executor.shutdown(wait=False)
@@ -1,31 +1,163 @@
 # modules/server.py
 
+import asyncio
+import errno
+import os
 import socket
 import threading
-import select
-import struct
-import socks 
-from urllib.parse import urlparse
+import time
+from urllib.parse import urlsplit
+
+from .aio_proxy import (open_tunnel, open_udp_association, split_host_port, tunnel_handshake,
+                        TargetUnreachableError, UnsupportedCommandError, UpstreamClosedError)
+from .metrics import ServerMetrics
+from .http_parser import (HttpParser, HttpParseError, NEED_DATA, END_OF_MESSAGE, CONNECTION_CLOSED,
+                          PROXY_HEADERS)
+from .limits import ConcurrencyGate, RateLimiter
+from .socks5_parser import (Socks5Parser, Socks5ParseError, Greeting, NEED_DATA as SOCKS5_NEED_DATA,
+                            parse_udp_header, socks5_reply, CMD_CONNECT, CMD_UDP_ASSOCIATE, METHOD_NO_AUTH,
+                            METHOD_NO_ACCEPTABLE, SOCKS5_SUCCEEDED, SOCKS5_GENERAL_FAILURE, SOCKS5_NOT_ALLOWED,
+                            SOCKS5_HOST_UNREACHABLE, SOCKS5_COMMAND_NOT_SUPPORTED)
+from .strategies import create_strategy
+from .upstream_pool import UpstreamPool
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+RELAY_MODES = ('auto', 'splice', 'recv_into')
+# splice 仅 Linux 提供 (Python 3.10+)
+SPLICE_AVAILABLE = hasattr(os, 'splice') and hasattr(os, 'pipe2')
+_SPLICE_FLAGS = (getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)) if SPLICE_AVAILABLE else 0
+_SPLICE_UNSUPPORTED_ERRNOS = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP)
+
+
+HTTP_400 = b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+HTTP_502 = b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+HTTP_429 = b'HTTP/1.1 429 Too Many Requests\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+HTTP_503 = b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+# 拒绝过载连接前读取其请求的最长时间，读完再答复，避免客户端只看到连接被重置
+SHED_READ_TIMEOUT = 2
+
+# 只有这些上游协议能连接 IPv6 目标 (SOCKS4 仅支持 IPv4)，UDP 转发只能经由 SOCKS5 上游
+IPV6_UPSTREAM_PROTOCOLS = ('SOCKS5', 'HTTP', 'HTTPS')
+UDP_UPSTREAM_PROTOCOLS = ('SOCKS5',)
+
+
+def _socket_family(host: str):
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+class _SpliceUnsupported(Exception):
+    """splice 无法用于当前 socket，需要回退到 recv_into 转发。"""
+
+
+class _UpstreamsSaturated(Exception):
+    """可用的上游都已达到并发上限，本次请求按过载拒绝。"""
+
+
+class _UpstreamConnection:
+    """HTTP 入口上与某个目标站点之间、经由上游代理建立的连接。"""
+    __slots__ = ('sock', 'address', 'target', 'parser')
+
+    def __init__(self, sock, address, target):
+        self.sock = sock
+        self.address = address  # 上游代理地址
+        self.target = target    # (目标主机, 端口)
+        self.parser = HttpParser(is_response=True)
+
 
 class ProxyServer:
-    """本地代理服务，将进入的请求通过代理池转发。支持HTTP和SOCKS5。"""
-    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+    """
+    本地代理服务，将进入的请求通过代理池转发。支持HTTP和SOCKS5。
+    两个入口共用后台线程中的同一个 asyncio 事件循环，每个客户端连接只是一个协程，
+    直接在非阻塞 socket 上收发 (loop.sock_*)，并发连接数不再受线程数和线程栈内存限制。
+    """
+    MAX_POOLED_RELAY_BUFFERS = 256
+    # 跳过已达并发上限或协议不适用的上游时，最多额外查看的候选数
+    SATURATED_SCAN_LIMIT = 16
+    # 可由 config.json 的 server 段设置的参数
+    SETTINGS = ('strategy', 'upstream_timeout', 'handshake_timeout', 'idle_timeout', 'relay_mode',
+                'prewarm_per_upstream', 'failover_attempts', 'failover_deadline', 'happy_eyeballs_delay',
+                'keepalive_timeout', 'metrics_feedback_interval', 'max_connections', 'accept_queue_size',
+                'accept_queue_timeout', 'listen_backlog', 'max_per_upstream', 'client_rate_limit',
+                'client_rate_burst')
+
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue, strategy='round_robin',
+                 upstream_timeout: float = 10, handshake_timeout: float = 30, idle_timeout: float = 300,
+                 relay_mode: str = 'auto', relay_buffer_size: int = 256 * 1024, prewarm_per_upstream: int = 2,
+                 failover_attempts: int = 3, failover_deadline: float = 15, happy_eyeballs_delay: float = 0.3,
+                 keepalive_timeout: float = 60, max_http_head_size: int = 65536, metrics_feedback_interval: float = 10,
+                 max_connections: int = 10000, accept_queue_size: int = 1000, accept_queue_timeout: float = 5,
+                 listen_backlog: int = 1024, max_per_upstream: int = 0, client_rate_limit: float = 0,
+                 client_rate_burst: float = 20, reuse_port: bool = False):
         self._rotator = rotator
         self._log_queue = log_queue
         self._running = False
+        self.listen_errors = []  # 最近一次 start_all 中未能启动的监听 ("HTTP 127.0.0.1:1801: 错误信息")
 
         self._http_host = http_host
         self._http_port = http_port
-        self._http_server_socket = None
-        self._http_thread = None
-
         self._socks5_host = socks5_host
         self._socks5_port = socks5_port
-        self._socks5_server_socket = None
-        self._socks5_thread = None
-        
+
+        self.upstream_timeout = upstream_timeout    # 连接上游并完成隧道握手的超时
+        self.handshake_timeout = handshake_timeout  # 等待客户端发出请求头/握手的超时
+        self.idle_timeout = idle_timeout            # 隧道两个方向都没有数据的最长时间
+        self.keepalive_timeout = keepalive_timeout  # HTTP 客户端连接在两个请求之间的最长空闲时间
+        self.max_http_head_size = max_http_head_size
+
+        # 故障转移：单个请求最多尝试的上游数、总时限，以及并行发起下一个尝试前的等待时间 (0 为逐个串行)
+        self.failover_attempts = max(1, failover_attempts)
+        self.failover_deadline = failover_deadline
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+
+        # 隧道转发方式：splice 在内核中直接转发；recv_into 使用池化缓冲区。auto 时优先 splice
+        if relay_mode not in RELAY_MODES:
+            raise ValueError(f"未知的转发方式: {relay_mode}，可选: {', '.join(RELAY_MODES)}")
+        if relay_mode == 'auto':
+            relay_mode = 'splice' if SPLICE_AVAILABLE else 'recv_into'
+        elif relay_mode == 'splice' and not SPLICE_AVAILABLE:
+            raise ValueError("当前平台不支持 splice 转发")
+        self.relay_mode = relay_mode
+        self.relay_buffer_size = relay_buffer_size
+        self._buffers = []
+        self._pipes = []
+
+        # 上游预热连接池，prewarm_per_upstream 为 0 时不预热
+        self.upstream_pool = UpstreamPool(prewarm_per_upstream, connect_timeout=upstream_timeout) if prewarm_per_upstream > 0 else None
+
+        # 实时统计；每隔 metrics_feedback_interval 秒把各上游的实测成功率与连接耗时反馈为轮换分数 (0 为不反馈)
+        self.metrics = ServerMetrics()
+        self.metrics_feedback_interval = metrics_feedback_interval
+
+        # 过载保护：同时处理的客户端连接上限 (超出的在有界队列中等待空位)、监听队列长度、
+        # 每个上游同时进行的隧道上限，以及按客户端 IP 的请求速率限制 (每秒请求数，0 为不限)
+        self.gate = ConcurrencyGate(max_connections, accept_queue_size, accept_queue_timeout)
+        self.listen_backlog = listen_backlog
+        self.reuse_port = reuse_port  # 多进程模式下各工作进程通过 SO_REUSEPORT 绑定同一端口
+        self.max_per_upstream = max_per_upstream
+        self.rate_limiter = RateLimiter(client_rate_limit, client_rate_burst)
+        self._upstream_slots = {}  # 上游地址 -> 连接中与已建立的隧道数
+
+        self._loop = None
+        self._loop_thread = None
+        self._stop_future = None
+        self._clients = set()
+
         # 新增: 轮换模式状态
         self.rotate_per_request = False
+        # 逐请求轮换时使用的上游选择策略，每个服务实例独立
+        self._strategy = create_strategy(strategy)
+
+    @classmethod
+    def from_settings(cls, settings: dict, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+        """按 config.json 的 server 段创建服务，未设置的参数使用默认值。"""
+        server = settings.get('server', {})
+        return cls(http_host, http_port, socks5_host, socks5_port, rotator, log_queue,
+                   **{key: server[key] for key in cls.SETTINGS if key in server})
 
     def log(self, message):
         self._log_queue.put(f"[Server] {message}")
@@ -36,213 +168,894 @@ class ProxyServer:
         mode = "逐请求轮换" if per_request else "固定当前"
         self.log(f"服务轮换模式已切换为: {mode}")
 
+    def set_strategy(self, name: str):
+        """切换逐请求轮换时的上游选择策略 (见 modules/strategies.py)。"""
+        self._strategy = create_strategy(name)
+        self.log(f"上游选择策略已切换为: {name}")
+
+    @property
+    def active_connections(self) -> int:
+        """当前正在处理的客户端连接数。"""
+        return len(self._clients)
+
     def start_all(self):
         """启动所有代理服务（HTTP & SOCKS5）。"""
         if self._running:
             return
         self._running = True
+        self.listen_errors = []
 
-        self._http_thread = threading.Thread(target=self._run_http_server, daemon=True)
-        self._http_thread.start()
-
-        self._socks5_thread = threading.Thread(target=self._run_socks5_server, daemon=True)
-        self._socks5_thread.start()
+        ready = threading.Event()
+        self._loop_thread = threading.Thread(target=self._run_loop, args=(ready,), daemon=True)
+        self._loop_thread.start()
+        ready.wait()
 
     def stop_all(self):
         """平滑地停止所有正在运行的代理服务。"""
         if not self._running:
             return
         self._running = False
-        
-        if self._http_server_socket:
-            self._http_server_socket.close()
-        if self._socks5_server_socket:
-            self._socks5_server_socket.close()
-
-        if self._http_thread and self._http_thread.is_alive():
-            self._http_thread.join()
-        if self._socks5_thread and self._socks5_thread.is_alive():
-            self._socks5_thread.join()
-            
+
+        if self._loop_thread and self._loop_thread.is_alive():
+            self._loop.call_soon_threadsafe(lambda: self._stop_future.done() or self._stop_future.set_result(None))
+            self._loop_thread.join()
+
         self.log("所有代理服务已停止。")
 
-    def _run_http_server(self):
-        """HTTP服务监听循环。"""
+    # --- 事件循环 ---
+    def _run_loop(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
         try:
-            self._http_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._http_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._http_server_socket.bind((self._http_host, self._http_port))
-            self._http_server_socket.listen(20)
-            self.log(f"HTTP 代理服务接口已启动于 {self._http_host}:{self._http_port}")
+            self._loop.run_until_complete(self._serve(ready))
+        finally:
+            self._loop.close()
+            ready.set()
+
+    def _open_listener(self, host, port, name):
+        try:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server_socket.bind((host, port))
+            server_socket.listen(min(self.listen_backlog, socket.SOMAXCONN) if self.listen_backlog else socket.SOMAXCONN)
+            server_socket.setblocking(False)
         except Exception as e:
-            self.log(f"[!] 启动 HTTP 服务失败: {e}")
+            self.log(f"[!] 启动 {name} 服务失败: {e}")
+            self.listen_errors.append(f"{name} {host}:{port}: {e}")
+            return None
+        self.log(f"{name} 代理服务接口已启动于 {host}:{port}")
+        return server_socket
+
+    async def _serve(self, ready):
+        self._stop_future = self._loop.create_future()
+        listeners = []
+        for host, port, handler, reject, name in (
+                (self._http_host, self._http_port, self._handle_http_client, self._reject_http_client, "HTTP"),
+                (self._socks5_host, self._socks5_port, self._handle_socks5_client, self._reject_socks5_client, "SOCKS5")):
+            server_socket = self._open_listener(host, port, name)
+            if server_socket:
+                accept_task = self._loop.create_task(self._accept_loop(server_socket, handler, name, reject))
+                listeners.append((server_socket, accept_task))
+        ready.set()
+        if not listeners:
+            self._running = False
             return
+        self.log(f"隧道转发方式: {self.relay_mode}")
+        background = []
+        if self.upstream_pool:
+            background.append(self._loop.create_task(self.upstream_pool.run()))
+        if self.metrics_feedback_interval:
+            background.append(self._loop.create_task(self._feedback_loop()))
 
-        while self._running:
+        await self._stop_future
+
+        for server_socket, task in listeners:
+            task.cancel()
+            server_socket.close()
+        for task in background:
+            task.cancel()
+        for task in list(self._clients):
+            task.cancel()
+        await asyncio.gather(*(task for _, task in listeners), *background, *self._clients, return_exceptions=True)
+        while self._pipes:
+            self._release_pipe(self._pipes.pop(), empty=False)
+        self._buffers.clear()
+
+    async def _accept_loop(self, server_socket, handler, name, reject):
+        """监听循环：每个新连接创建一个协程任务处理，超出并发上限时由 reject 答复过载。"""
+        loop = self._loop
+        frontend = self.metrics.frontends[name.lower()]
+        while True:
             try:
-                client_socket, _ = self._http_server_socket.accept()
-                handler = threading.Thread(target=self._handle_http_client, args=(client_socket,), daemon=True)
-                handler.start()
-            except OSError:
-                break 
-        self.log("HTTP 代理服务循环已退出。")
+                client_socket, _ = await loop.sock_accept(server_socket)
+            except asyncio.CancelledError:
+                break
+            except OSError as e:
+                # 文件描述符耗尽等情况下稍作等待，不退出监听
+                self.log(f"[!] {name} 接受连接失败: {e}")
+                await asyncio.sleep(0.1)
+                continue
+            client_socket.setblocking(False)
+            task = loop.create_task(self._serve_client(handler, reject, client_socket, frontend))
+            self._clients.add(task)
+            task.add_done_callback(self._clients.discard)
+        self.log(f"{name} 代理服务循环已退出。")
 
-    def _run_socks5_server(self):
-        """SOCKS5服务监听循环。"""
-        try:
-            self._socks5_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socks5_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._socks5_server_socket.bind((self._socks5_host, self._socks5_port))
-            self._socks5_server_socket.listen(20)
-            self.log(f"SOCKS5 代理服务接口已启动于 {self._socks5_host}:{self._socks5_port}")
-        except Exception as e:
-            self.log(f"[!] 启动 SOCKS5 服务失败: {e}")
+    async def _serve_client(self, handler, reject, client_socket, frontend):
+        frontend.accepted += 1
+        gate = self.gate
+        if gate.limit and gate.active >= gate.limit:
+            frontend.queued += 1
+        if not await gate.acquire():
+            frontend.rejected += 1
+            await reject(client_socket, 'busy')
             return
+        frontend.active += 1
+        try:
+            await handler(client_socket)
+        finally:
+            frontend.active -= 1
+            gate.release()
 
-        while self._running:
+    async def _reject_http_client(self, client_socket, reason):
+        """先读完请求头再答复 503 (过载) 或 429 (超过速率限制) 并关闭连接。"""
+        try:
+            parser = HttpParser(max_head_size=self.max_http_head_size)
             try:
-                client_socket, _ = self._socks5_server_socket.accept()
-                handler = threading.Thread(target=self._handle_socks5_client, args=(client_socket,), daemon=True)
-                handler.start()
-            except OSError:
-                break
-        self.log("SOCKS5 代理服务循环已退出。")
-        
-    def _get_upstream_connection(self, target_host, target_port):
-        """从轮换器获取一个上游代理，并用它来连接目标地址。"""
-        if self.rotate_per_request:
-            # 逐请求轮换模式：每次都获取下一个代理
-            upstream_proxy_info = self._rotator.get_next_proxy()
-        else:
-            # 普通模式：使用当前固定的代理
-            upstream_proxy_info = self._rotator.get_current_proxy()
+                await self._next_http_event(client_socket, parser, SHED_READ_TIMEOUT)
+            except (asyncio.TimeoutError, HttpParseError):
+                pass
+            await self._loop.sock_sendall(client_socket, HTTP_429 if reason == 'rate' else HTTP_503)
+        except (asyncio.CancelledError, OSError):
+            pass
+        finally:
+            client_socket.close()
 
-        if not upstream_proxy_info:
-            self.log("[!] 代理池为空或无符合条件的代理，无法转发请求。")
+    async def _reject_socks5_client(self, client_socket, reason):
+        """完成协商、读取请求后以失败应答拒绝：过载为 general failure，超过速率限制为 not allowed。"""
+        try:
+            handshake = await asyncio.wait_for(self._read_socks5_request(client_socket), SHED_READ_TIMEOUT)
+            if handshake is not None:
+                code = SOCKS5_NOT_ALLOWED if reason == 'rate' else SOCKS5_GENERAL_FAILURE
+                await self._loop.sock_sendall(client_socket, socks5_reply(code))
+        except (asyncio.CancelledError, asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            client_socket.close()
+
+    @staticmethod
+    def _client_ip(client_socket):
+        try:
+            return client_socket.getpeername()[0]
+        except OSError:
             return None
 
+    async def _feedback_loop(self):
+        """定期把本地服务实测的上游表现反馈给轮换器的分数。"""
+        while True:
+            await asyncio.sleep(self.metrics_feedback_interval)
+            for address, live_score in self.metrics.live_scores().items():
+                self._rotator.apply_live_score(address, live_score)
+
+    # --- 上游连接 ---
+    def _upstream_full(self, address) -> bool:
+        return bool(self.max_per_upstream) and self._upstream_slots.get(address, 0) >= self.max_per_upstream
+
+    def _claim_upstream(self, address):
+        self._upstream_slots[address] = self._upstream_slots.get(address, 0) + 1
+
+    def _free_upstream(self, address):
+        remaining = self._upstream_slots.get(address, 0) - 1
+        if remaining > 0:
+            self._upstream_slots[address] = remaining
+        else:
+            self._upstream_slots.pop(address, None)
+
+    def _pick_upstream(self, tried, target_host, saturated, protocols=None):
+        """
+        选出下一个要尝试的上游。首次按轮换模式选择（固定模式为当前代理，逐请求模式按选择策略）；
+        故障转移时从上一个尝试的上游之后按分数顺序选择，跳过本次请求已尝试过的上游，不移动主轮换的游标。
+        已达到 max_per_upstream 的上游同样跳过并记入 saturated；给出 protocols 时只选用这些协议的上游。
+        """
+        after = tried[-1] if tried else None
+        if not tried:
+            if self.rotate_per_request:
+                # 逐请求轮换模式：按选择策略获取下一个代理
+                info = self._rotator.select_proxy(self._strategy, target_host)
+            else:
+                # 普通模式：使用当前固定的代理
+                info = self._rotator.get_current_proxy()
+            if info is None:
+                return None
+            after = info.get('proxy')
+            if self._upstream_full(after):
+                saturated.add(after)
+            elif protocols is None or str(info.get('protocol', '')).upper() in protocols:
+                return info
+        for info in self._rotator.failover_candidates(after, set(tried) | saturated, self.SATURATED_SCAN_LIMIT):
+            addr = info.get('proxy')
+            if protocols is not None and str(info.get('protocol', '')).upper() not in protocols:
+                continue
+            if self._upstream_full(addr):
+                saturated.add(addr)
+                continue
+            return info
+        return None
+
+    async def _try_upstream(self, upstream_proxy_info, target_host, target_port, timeout, udp=False):
+        """
+        尝试通过一个上游建立隧道 (udp=True 时建立 UDP 关联)，结果反馈给轮换器。
+        返回 (socket 或 UdpAssociation, None) 表示成功；(None, 'upstream') 表示上游失败，可换下一个上游重试；
+        (None, 'target') 表示上游报告目标不可达，换上游也无济于事。
+        """
         addr = upstream_proxy_info.get('proxy')
         proto = upstream_proxy_info.get('protocol')
 
         if not addr or not proto:
             self.log(f"[!] 代理信息格式不正确: {upstream_proxy_info}")
-            return None
-
-        upstream_addr, upstream_port_str = addr.split(':')
-        
-        proxy_type_map = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}
-        upstream_protocol = proxy_type_map.get(proto.upper())
+            return None, 'upstream'
 
-        if not upstream_protocol:
+        if proto.upper() not in ('HTTP', 'SOCKS4', 'SOCKS5'):
             self.log(f"[!] 不支持的上游代理协议: {proto}")
-            return None
-        
-        remote_socket = socks.socksocket()
+            return None, 'upstream'
+
+        upstream_metrics = self.metrics.upstream(addr)
         try:
-            remote_socket.set_proxy(proxy_type=upstream_protocol, addr=upstream_addr, port=int(upstream_port_str))
-            remote_socket.connect((target_host, target_port))
-            # --- MODIFIED: Log rotation for per-request mode ---
-            if self.rotate_per_request:
-                self.log(f"轮换: {addr} -> {target_host}:{target_port}")
-            # 固定模式的日志在UI点击轮换时已记录，此处不再重复
-            return remote_socket
+            connect_start = time.time()
+            if udp:
+                remote_socket = await open_udp_association(addr, timeout)
+            else:
+                remote_socket = await self._open_upstream_tunnel(proto, addr, target_host, target_port, timeout)
+        except asyncio.CancelledError:
+            raise
+        except UnsupportedCommandError:
+            # 很多上游只支持 CONNECT，不影响其可用状态
+            self.log(f"[!] 上游代理 {addr} 不支持 UDP 转发")
+            return None, 'upstream'
+        except TargetUnreachableError as e:
+            upstream_metrics.target_errors += 1
+            self._rotator.report_success(addr)
+            self.log(f"[!] 目标 {target_host}:{target_port} 不可达 (经 {addr}): {e}")
+            return None, 'target'
         except Exception as e:
-            self.log(f"[!] 上游代理 {addr} 错误: {e}")
-            # 可以在此处增加代理失败计数的逻辑
-            remote_socket.close()
-            return None
+            upstream_metrics.failures += 1
+            self.log(f"[!] 上游代理 {addr} 错误: {str(e) or type(e).__name__}")
+            if self._rotator.report_failure(addr):
+                self.log(f"[!] 上游代理 {addr} 连续失败，已标记为不可用。")
+            return None, 'upstream'
+
+        # 连接耗时反馈给轮换器，供基于实时延迟的选择策略使用
+        connect_time = time.time() - connect_start
+        upstream_metrics.connects += 1
+        upstream_metrics.connect_time.record(connect_time)
+        self._rotator.record_latency(addr, connect_time)
+        self._rotator.report_success(addr)
+        return remote_socket, None
+
+    async def _get_upstream_connection(self, target_host, target_port, udp=False):
+        """
+        从轮换器获取一个上游代理，并用它来连接目标地址 (udp=True 时改为建立 UDP 关联)。上游失败时在 failover_deadline 内
+        换用其他上游重试，最多 failover_attempts 个；设置了 happy_eyeballs_delay 时，
+        上一个尝试超过该时间仍未完成就并行发起下一个，先成功者胜出，其余取消。
+        返回 (remote_socket, 上游地址)；失败时返回 (None, None)。
+        成功时已计入该上游的进行中连接数，调用方在连接结束后需调用 _end_upstream_use。
+        没有未达并发上限的上游可用时抛出 _UpstreamsSaturated。
+        """
+        loop = self._loop
+        deadline = loop.time() + self.failover_deadline
+        stagger = self.happy_eyeballs_delay or None
+        tried = []
+        saturated = set()
+        if udp:
+            protocols = UDP_UPSTREAM_PROTOCOLS
+        elif ':' in target_host:
+            protocols = IPV6_UPSTREAM_PROTOCOLS
+        else:
+            protocols = None
+        attempts = {}  # task -> 上游地址
+        winner = None
+        target_failed = False
+
+        def launch():
+            info = self._pick_upstream(tried, target_host, saturated, protocols)
+            if not info:
+                return False
+            addr = info.get('proxy')
+            tried.append(addr)
+            self._claim_upstream(addr)
+            timeout = max(0.0, min(self.upstream_timeout, deadline - loop.time()))
+            attempts[loop.create_task(self._try_upstream(info, target_host, target_port, timeout, udp))] = addr
+            return True
 
-    def _handle_http_client(self, client_socket):
-        """处理单个HTTP客户端连接。"""
-        remote_socket = None
         try:
-            request_data = client_socket.recv(8192)
-            if not request_data:
-                return
+            if not launch():
+                if saturated:
+                    raise _UpstreamsSaturated()
+                self.log("[!] 代理池为空或无符合条件的代理，无法转发请求。")
+                return None, None
+            while attempts:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                can_launch = len(tried) < self.failover_attempts
+                wait_time = min(stagger, remaining) if (stagger and can_launch) else remaining
+                done, _ = await asyncio.wait(attempts, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    addr = attempts.pop(task)
+                    sock, failure = task.result()
+                    if sock is not None and winner is None:
+                        winner = (sock, addr)
+                        continue
+                    self._free_upstream(addr)
+                    if sock is not None:
+                        sock.close()
+                    elif failure == 'target':
+                        target_failed = True
+                if winner or target_failed:
+                    break
+                # 有尝试失败（或并行间隔已到）时发起下一个
+                if can_launch:
+                    launch()
+        finally:
+            for task, addr in attempts.items():
+                task.cancel()
+                self._free_upstream(addr)
+            if attempts:
+                for result in await asyncio.gather(*attempts, return_exceptions=True):
+                    if isinstance(result, tuple) and result[0] is not None:
+                        result[0].close()
 
-            first_line = request_data.split(b'\r\n')[0].decode('utf-8', 'ignore')
-            method, url, _ = first_line.split()
+        if winner is None:
+            if not target_failed:
+                self.log(f"[!] 已尝试 {len(tried)} 个上游代理，均未能连接 {target_host}:{target_port}。")
+            return None, None
 
-            if method == 'CONNECT':
-                target_host, target_port_str = url.split(':')
-                target_port = int(target_port_str)
-            else:
-                parsed_url = urlparse(url)
-                target_host = parsed_url.hostname
-                target_port = parsed_url.port or 80
+        remote_socket, addr = winner
+        self._rotator.begin_use(addr)
+        self.metrics.upstream(addr).active += 1
+        # --- MODIFIED: Log rotation for per-request mode ---
+        if self.rotate_per_request:
+            self.log(f"轮换: {addr} -> {target_host}:{target_port}")
+        elif addr != tried[0]:
+            self.log(f"故障转移: {tried[0]} 不可用，本次改用 {addr} -> {target_host}:{target_port}")
+        # 固定模式的日志在UI点击轮换时已记录，此处不再重复
+        return remote_socket, addr
 
-            remote_socket = self._get_upstream_connection(target_host, target_port)
-            if not remote_socket:
-                # 可以给客户端一个更友好的错误响应
-                client_socket.sendall(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
-                return
+    async def _open_upstream_tunnel(self, proto, addr, target_host, target_port, timeout):
+        """优先使用预热连接只发送 CONNECT；预热连接已被上游关闭时改为新建连接。"""
+        if self.upstream_pool:
+            self.upstream_pool.touch(addr, proto)
+            sock = self.upstream_pool.take(addr)
+            if sock is not None:
+                try:
+                    await asyncio.wait_for(
+                        tunnel_handshake(self._loop, sock, proto, target_host, target_port, prewarmed=True),
+                        timeout)
+                    return sock
+                except (UpstreamClosedError, ConnectionError):
+                    sock.close()
+                except BaseException:
+                    sock.close()
+                    raise
+        return await open_tunnel(proto, addr, target_host, target_port, timeout)
 
-            if method == 'CONNECT':
-                client_socket.sendall(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+    # --- 客户端处理 ---
+    async def _next_http_event(self, sock, parser, timeout):
+        """从解析器取下一个事件，数据不足时从 sock 读取。"""
+        loop = self._loop
+        while True:
+            event = parser.next_event()
+            if event is not NEED_DATA:
+                return event
+            data = await asyncio.wait_for(loop.sock_recv(sock, 65536), timeout)
+            if data:
+                parser.feed(data)
             else:
-                remote_socket.sendall(request_data)
+                parser.feed_eof()
+
+    @staticmethod
+    def _http_target(head):
+        """解析普通(非 CONNECT)请求的目标，返回 (主机, 端口, origin-form 请求路径)。"""
+        parsed = urlsplit(head.target)
+        if not parsed.scheme:
+            # origin-form 请求 (如透明代理)，目标取自 Host 头
+            host_header = head.get('host')
+            if not host_header:
+                raise HttpParseError("请求缺少 Host 头")
+            parsed = urlsplit(f"//{host_header}{head.target}")
+        if not parsed.hostname:
+            raise HttpParseError(f"无法解析请求目标: {head.target!r}")
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        return parsed.hostname, parsed.port or 80, path
+
+    @staticmethod
+    def _connect_target(head):
+        """解析 CONNECT 请求的目标 (authority-form 的 "主机:端口")，返回 (主机, 端口)。"""
+        try:
+            host, port = split_host_port(head.target)
+        except ValueError:
+            raise HttpParseError(f"无法解析 CONNECT 目标: {head.target!r}")
+        if not host or not 0 < port < 65536:
+            raise HttpParseError(f"无效的 CONNECT 目标: {head.target!r}")
+        return host, port
+
+    def _end_upstream_use(self, address):
+        self._free_upstream(address)
+        self._rotator.end_use(address)
+        self.metrics.upstream(address).active -= 1
+
+    def _release_upstream(self, upstream):
+        if upstream is not None:
+            self._end_upstream_use(upstream.address)
+            upstream.sock.close()
+
+    async def _relay_http_exchange(self, client_socket, parser, head, path, upstream):
+        """
+        转发一个请求及其响应。返回 (客户端连接可继续复用, 上游连接可继续复用)。
+        协议升级 (101) 时转为隧道转发，结束后两者都不可复用。
+        """
+        loop = self._loop
+        remote_socket = upstream.sock
+        drop = PROXY_HEADERS
+        if '100-continue' in head.tokens('expect'):
+            # 由本地服务直接答复 100 Continue，客户端无需等待上游
+            await loop.sock_sendall(client_socket, b'HTTP/1.1 100 Continue\r\n\r\n')
+            drop = drop | {'expect'}
+        meter = self.metrics.meter('http', upstream.address)
+        data = head.to_bytes(target=path, drop=drop)
+        await loop.sock_sendall(remote_socket, data)
+        meter.upload(len(data))
+        while True:
+            event = await self._next_http_event(client_socket, parser, self.idle_timeout)
+            if event is END_OF_MESSAGE:
+                break
+            await loop.sock_sendall(remote_socket, event)
+            meter.upload(len(event))
+
+        response_parser = upstream.parser
+        response_parser.expect_response(head.method)
+        while True:
+            response = await self._next_http_event(remote_socket, response_parser, self.idle_timeout)
+            if response is CONNECTION_CLOSED:
+                meter.frontend.errors += 1
+                await loop.sock_sendall(client_socket, HTTP_502)
+                return False, False
+            if not meter.first_byte:
+                meter.record_ttfb(time.perf_counter() - meter.started)
+            data = response.to_bytes()
+            await loop.sock_sendall(client_socket, data)
+            meter.download(len(data))
+            if response.status == 101:
+                # 协议升级 (如 WebSocket)：把已缓冲的数据交给对端后按隧道转发
+                pending = parser.take_buffer()
+                if pending:
+                    await loop.sock_sendall(remote_socket, pending)
+                pending = response_parser.take_buffer()
+                if pending:
+                    await loop.sock_sendall(client_socket, pending)
+                await self._forward_data(client_socket, remote_socket, meter)
+                return False, False
+            until_close = response_parser.body_until_close
+            while True:
+                event = await self._next_http_event(remote_socket, response_parser, self.idle_timeout)
+                if event is END_OF_MESSAGE:
+                    break
+                await loop.sock_sendall(client_socket, event)
+                meter.download(len(event))
+            if response.status >= 200:
+                break
+            # 1xx 中间响应，继续读取最终响应
+
+        reusable = response.keep_alive and not until_close
+        return head.keep_alive and reusable, reusable
 
-            self._forward_data(client_socket, remote_socket)
+    async def _handle_http_client(self, client_socket):
+        """
+        处理单个HTTP客户端连接。请求由增量解析器切分，支持 keep-alive 与流水线请求：
+        同一客户端连接上的请求依次转发，逐请求轮换时每个请求各自选择上游；
+        固定模式下同一目标站点的连续请求复用已建立的上游连接。
+        """
+        loop = self._loop
+        frontend = self.metrics.frontends['http']
+        parser = HttpParser(max_head_size=self.max_http_head_size)
+        client_ip = self._client_ip(client_socket)
+        upstream = None
+        responding = False
+        timeout = self.handshake_timeout
+        try:
+            while True:
+                head = await self._next_http_event(client_socket, parser, timeout)
+                if head is CONNECTION_CLOSED:
+                    return
+                frontend.requests += 1
+                if not self.rate_limiter.allow(client_ip):
+                    frontend.rejected += 1
+                    await loop.sock_sendall(client_socket, HTTP_429)
+                    return
+
+                if head.method == 'CONNECT':
+                    target_host, target_port = self._connect_target(head)
+                    self._release_upstream(upstream)
+                    upstream = None
+                    remote_socket, upstream_addr = await self._get_upstream_connection(target_host, target_port)
+                    if not remote_socket:
+                        frontend.errors += 1
+                        await loop.sock_sendall(client_socket, HTTP_502)
+                        return
+                    upstream = _UpstreamConnection(remote_socket, upstream_addr, (target_host, target_port))
+                    await loop.sock_sendall(client_socket, b'HTTP/1.1 200 Connection Established\r\n\r\n')
+                    pending = parser.take_buffer()
+                    if pending:
+                        await loop.sock_sendall(remote_socket, pending)
+                    await self._forward_data(client_socket, remote_socket, self.metrics.meter('http', upstream_addr))
+                    return
+
+                target_host, target_port, path = self._http_target(head)
+                if upstream is not None and (self.rotate_per_request or upstream.target != (target_host, target_port)):
+                    self._release_upstream(upstream)
+                    upstream = None
+                if upstream is None:
+                    remote_socket, upstream_addr = await self._get_upstream_connection(target_host, target_port)
+                    if not remote_socket:
+                        frontend.errors += 1
+                        await loop.sock_sendall(client_socket, HTTP_502)
+                        return
+                    upstream = _UpstreamConnection(remote_socket, upstream_addr, (target_host, target_port))
+
+                responding = True
+                client_keep_alive, upstream_reusable = await self._relay_http_exchange(
+                    client_socket, parser, head, path, upstream)
+                responding = False
+                if not upstream_reusable:
+                    self._release_upstream(upstream)
+                    upstream = None
+                if not client_keep_alive:
+                    return
+                timeout = self.keepalive_timeout
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            pass
+        except _UpstreamsSaturated:
+            frontend.rejected += 1
+            try:
+                await loop.sock_sendall(client_socket, HTTP_503)
+            except OSError:
+                pass
+        except HttpParseError as e:
+            frontend.errors += 1
+            if not responding:
+                try:
+                    await loop.sock_sendall(client_socket, HTTP_400)
+                except OSError:
+                    pass
+            self.log(f"[!] 无效的 HTTP 请求: {e}")
         except Exception as e:
             if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
                  self.log(f"处理 HTTP 请求时出错: {e}")
         finally:
-            if remote_socket: remote_socket.close()
+            self._release_upstream(upstream)
             if client_socket: client_socket.close()
 
-    def _handle_socks5_client(self, client_socket):
-        """处理单个SOCKS5客户端连接。"""
-        remote_socket = None
-        try:
-            data = client_socket.recv(2)
-            if not data or data[0] != 5: return 
-            nmethods = data[1]
-            client_socket.recv(nmethods)
-            client_socket.sendall(b"\x05\x00")
-
-            data = client_socket.recv(4)
-            if not data or data[0] != 5 or data[1] != 1: return
-            
-            atyp = data[3]
-            if atyp == 1:
-                addr = socket.inet_ntoa(client_socket.recv(4))
-            elif atyp == 3:
-                domain_len = client_socket.recv(1)[0]
-                addr = client_socket.recv(domain_len).decode('utf-8')
-            else:
-                # 暂不支持IPv6
-                client_socket.sendall(b"\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00")
+    async def _handle_socks5_client(self, client_socket):
+        """处理单个SOCKS5客户端连接：CONNECT 建立隧道，UDP ASSOCIATE 转发 UDP 报文。"""
+        loop = self._loop
+        frontend = self.metrics.frontends['socks5']
+        remote_socket = upstream_addr = None
+        try:
+            handshake = await asyncio.wait_for(self._read_socks5_request(client_socket), self.handshake_timeout)
+            if handshake is None:
+                frontend.errors += 1
+                return
+            request, parser = handshake
+            frontend.requests += 1
+            if not self.rate_limiter.allow(self._client_ip(client_socket)):
+                frontend.rejected += 1
+                await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_NOT_ALLOWED))
+                return
+            if request.command == CMD_UDP_ASSOCIATE:
+                await self._serve_udp_associate(client_socket, request, frontend)
+                return
+            if request.command != CMD_CONNECT:
+                frontend.errors += 1
+                await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_COMMAND_NOT_SUPPORTED))
                 return
-            
-            port = struct.unpack('!H', client_socket.recv(2))[0]
 
-            remote_socket = self._get_upstream_connection(addr, port)
+            try:
+                remote_socket, upstream_addr = await self._get_upstream_connection(request.host, request.port)
+            except _UpstreamsSaturated:
+                frontend.rejected += 1
+                await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_GENERAL_FAILURE))
+                return
             if not remote_socket:
-                client_socket.sendall(b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00") # Host unreachable
+                frontend.errors += 1
+                await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_HOST_UNREACHABLE))
                 return
 
-            client_socket.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_SUCCEEDED))
+            # 客户端可能不等应答就发送了隧道数据
+            pending = parser.take_buffer()
+            if pending:
+                await loop.sock_sendall(remote_socket, pending)
 
-            self._forward_data(client_socket, remote_socket)
+            await self._forward_data(client_socket, remote_socket, self.metrics.meter('socks5', upstream_addr))
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            pass
         except Exception as e:
             if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
                 self.log(f"处理 SOCKS5 请求时出错: {e}")
         finally:
+            if upstream_addr: self._end_upstream_use(upstream_addr)
             if remote_socket: remote_socket.close()
             if client_socket: client_socket.close()
 
-    def _forward_data(self, sock1, sock2):
-        """在两个socket之间双向转发数据，直到任意一方关闭。"""
-        while self._running:
+    async def _read_socks5_request(self, client_socket):
+        """
+        完成 SOCKS5 协商并读取请求。收到的数据都交给 Socks5Parser 缓冲解析，报文任意切分到达均可。
+        返回 (Request, 解析器)，解析器中可能留有客户端提前发送的数据；
+        协商失败或报文无效时返回 None（需要答复的已经答复）。
+        """
+        loop = self._loop
+        parser = Socks5Parser()
+        while True:
             try:
-                readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
-                if exceptional or not readable:
+                event = parser.next_event()
+            except Socks5ParseError as e:
+                if e.reply is not None:
+                    await loop.sock_sendall(client_socket, socks5_reply(e.reply))
+                return None
+            if event is SOCKS5_NEED_DATA:
+                data = await loop.sock_recv(client_socket, 4096)
+                if not data:
+                    return None
+                parser.feed(data)
+            elif isinstance(event, Greeting):
+                if METHOD_NO_AUTH not in event.methods:
+                    await loop.sock_sendall(client_socket, bytes((5, METHOD_NO_ACCEPTABLE)))
+                    return None
+                await loop.sock_sendall(client_socket, bytes((5, METHOD_NO_AUTH)))
+            else:
+                return event, parser
+
+    async def _wait_closed(self, sock):
+        """读取并丢弃数据，直到对端关闭连接。"""
+        try:
+            while await self._loop.sock_recv(sock, 4096):
+                pass
+        except OSError:
+            pass
+
+    async def _serve_udp_associate(self, client_socket, request, frontend):
+        """
+        UDP ASSOCIATE：经一个 SOCKS5 上游建立 UDP 关联，并在本地为客户端打开一个 UDP 端口。
+        两侧的报文格式相同 (带 SOCKS5 UDP 报文头)，由事件循环的读回调原样双向转发。
+        只接受来自客户端 TCP 连接同一 IP 的报文，不支持分片 (FRAG 非 0 的报文丢弃)。
+        关联持续到任一方关闭 TCP 控制连接，或超过 idle_timeout 没有报文。
+        """
+        loop = self._loop
+        try:
+            association, upstream_addr = await self._get_upstream_connection(request.host, request.port, udp=True)
+        except _UpstreamsSaturated:
+            frontend.rejected += 1
+            await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_GENERAL_FAILURE))
+            return
+        if association is None:
+            frontend.errors += 1
+            await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_GENERAL_FAILURE))
+            return
+
+        client_ip = self._client_ip(client_socket)
+        meter = self.metrics.meter('socks5', upstream_addr)
+        state = {'peer': None, 'last': loop.time()}
+        sockets = []
+        watchers = []
+
+        def from_client():
+            while True:
+                try:
+                    data, address = client_udp.recvfrom(65535)
+                except OSError:
+                    return
+                if address[0] != client_ip or (request.port and address[1] != request.port):
+                    continue
+                header = parse_udp_header(data)
+                if header is None or header[0] != 0:
+                    continue
+                state['peer'] = address
+                state['last'] = loop.time()
+                try:
+                    upstream_udp.send(data)
+                except OSError:
+                    continue  # 发送缓冲区满等情况按 UDP 丢包处理
+                meter.upload(len(data))
+
+        def from_upstream():
+            while True:
+                try:
+                    data = upstream_udp.recv(65535)
+                except OSError:
+                    return
+                if state['peer'] is None or parse_udp_header(data) is None:
+                    continue
+                state['last'] = loop.time()
+                try:
+                    client_udp.sendto(data, state['peer'])
+                except OSError:
+                    continue
+                meter.download(len(data))
+
+        try:
+            local_ip = client_socket.getsockname()[0]
+            client_udp = socket.socket(_socket_family(local_ip), socket.SOCK_DGRAM)
+            sockets.append(client_udp)
+            client_udp.setblocking(False)
+            client_udp.bind((local_ip, 0))
+            relay_address = association.relay_address
+            upstream_udp = socket.socket(_socket_family(relay_address[0]), socket.SOCK_DGRAM)
+            sockets.append(upstream_udp)
+            upstream_udp.setblocking(False)
+            upstream_udp.connect(relay_address)
+            loop.add_reader(client_udp.fileno(), from_client)
+            loop.add_reader(upstream_udp.fileno(), from_upstream)
+
+            bound_host, bound_port = client_udp.getsockname()[:2]
+            await loop.sock_sendall(client_socket, socks5_reply(SOCKS5_SUCCEEDED, bound_host, bound_port))
+            watchers = [loop.create_task(self._wait_closed(client_socket)),
+                        loop.create_task(self._wait_closed(association.control_sock))]
+            while True:
+                done, _ = await asyncio.wait(watchers, timeout=self.idle_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if done or loop.time() - state['last'] >= self.idle_timeout:
                     break
-                for sock in readable:
-                    other_sock = sock2 if sock is sock1 else sock1
-                    data = sock.recv(8192)
-                    if not data:
-                        return
-                    other_sock.sendall(data)
-            except (ConnectionResetError, BrokenPipeError, OSError, select.error):
-                break
+        finally:
+            for task in watchers:
+                task.cancel()
+            await asyncio.gather(*watchers, return_exceptions=True)
+            for sock in sockets:
+                loop.remove_reader(sock.fileno())
+                sock.close()
+            association.close()
+            self._end_upstream_use(upstream_addr)
+
+    # --- 数据转发 ---
+    def _acquire_pipe(self):
+        """取一个空闲的非阻塞管道 (读端, 写端)，供 splice 在两个 socket 之间中转。"""
+        if self._pipes:
+            return self._pipes.pop()
+        read_fd, write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fcntl is not None and hasattr(fcntl, 'F_SETPIPE_SZ'):
+            try:
+                fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, self.relay_buffer_size)
+            except OSError:
+                pass # 超过 /proc/sys/fs/pipe-max-size 时保留默认大小
+        return read_fd, write_fd
+
+    def _release_pipe(self, pipe, empty=True):
+        """管道排空后放回池中；仍有残留数据的管道直接关闭。"""
+        if empty and len(self._pipes) < self.MAX_POOLED_RELAY_BUFFERS:
+            self._pipes.append(pipe)
+        else:
+            os.close(pipe[0])
+            os.close(pipe[1])
+
+    async def _wait_fd(self, add, remove, fd):
+        """等待 fd 可读/可写 (add/remove 为 loop.add_reader/remove_reader 等)。空闲超时由 _forward_data 对整条隧道统一判断。"""
+        fut = self._loop.create_future()
+        add(fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            remove(fd)
+
+    async def _splice_pump(self, src, dst, count):
+        """
+        splice 转发：数据经由管道在内核中从 src 移到 dst，不进入 Python 进程。
+        管道只在有数据中转时占用，空闲隧道不额外消耗文件描述符。
+        """
+        loop = self._loop
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        pipe = None
+        pending = 0
+        moved = False
+        try:
+            while True:
+                if pending == 0:
+                    if pipe is None:
+                        pipe = self._acquire_pipe()
+                    try:
+                        pending = os.splice(src_fd, pipe[1], self.relay_buffer_size, flags=_SPLICE_FLAGS)
+                    except BlockingIOError:
+                        self._release_pipe(pipe)
+                        pipe = None
+                        await self._wait_fd(loop.add_reader, loop.remove_reader, src_fd)
+                        continue
+                    except OSError as e:
+                        if not moved and e.errno in _SPLICE_UNSUPPORTED_ERRNOS:
+                            raise _SpliceUnsupported() from e
+                        raise
+                    if pending == 0:
+                        break
+                    moved = True
+                    count(pending)
+                try:
+                    pending -= os.splice(pipe[0], dst_fd, pending, flags=_SPLICE_FLAGS)
+                except BlockingIOError:
+                    await self._wait_fd(loop.add_writer, loop.remove_writer, dst_fd)
+        finally:
+            if pipe is not None:
+                self._release_pipe(pipe, empty=pending == 0)
+
+    async def _recv_into_pump(self, src, dst, count):
+        """
+        recv_into 转发：读入池化的大缓冲区，经 memoryview 切片发送，不为每块数据新建 bytes。
+        缓冲区只在数据中转期间占用，空闲隧道不持有缓冲区。
+        """
+        loop = self._loop
+        src_fd = src.fileno()
+        while True:
+            buf = self._buffers.pop() if self._buffers else bytearray(self.relay_buffer_size)
+            try:
+                try:
+                    received = src.recv_into(buf)
+                except BlockingIOError:
+                    received = None
+                if received == 0:
+                    return
+                if received:
+                    count(received)
+                    await loop.sock_sendall(dst, memoryview(buf)[:received])
+            finally:
+                if len(self._buffers) < self.MAX_POOLED_RELAY_BUFFERS:
+                    self._buffers.append(buf)
+            if received is None:
+                await self._wait_fd(loop.add_reader, loop.remove_reader, src_fd)
+
+    async def _pump(self, src, dst, count):
+        """单方向转发：读到 EOF 后半关闭对端写方向，让另一方向继续把剩余数据传完。count(n) 用于计量字节数。"""
+        try:
+            if self.relay_mode == 'splice':
+                try:
+                    await self._splice_pump(src, dst, count)
+                    return
+                except _SpliceUnsupported:
+                    self.relay_mode = 'recv_into'
+                    self.log("[!] 当前系统不支持对 socket 使用 splice，转发方式回退为 recv_into。")
+            await self._recv_into_pump(src, dst, count)
+        finally:
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    async def _forward_data(self, sock1, sock2, meter):
+        """
+        在两个socket之间双向转发数据，直到两个方向都结束；任一方向出错则整条隧道结束。
+        两个方向共用一个最近活动时间，只有整条隧道超过 idle_timeout 没有数据时才关闭，
+        单向的长时间下载 (客户端一直不发送) 不会被中断。
+        sock1 为客户端一侧，sock2 为上游一侧，字节数记入 meter (TunnelMeter)。
+        """
+        loop = self._loop
+        last_activity = [loop.time()]
+
+        def counter(count):
+            def counted(n):
+                last_activity[0] = loop.time()
+                count(n)
+            return counted
+
+        tasks = [loop.create_task(self._pump(sock1, sock2, counter(meter.upload))),
+                 loop.create_task(self._pump(sock2, sock1, counter(meter.download)))]
+        try:
+            pending = tasks
+            while pending:
+                remaining = last_activity[0] + self.idle_timeout - loop.time()
+                if remaining <= 0:
+                    break  # 整条隧道空闲超时
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_EXCEPTION)
+                if any(not task.cancelled() and task.exception() for task in done):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
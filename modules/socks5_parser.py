@@ -0,0 +1,160 @@
+# modules/socks5_parser.py
+
+"""
+SOCKS5 (RFC 1928) 服务端握手解析器 (sans-IO)：只负责从字节流中切分协商与请求报文，不做任何网络读写。
+调用方把收到的数据 feed 进来，再反复调用 next_event() 取出事件：
+    Greeting        客户端支持的认证方式
+    Request         CONNECT / BIND / UDP ASSOCIATE 请求
+    NEED_DATA       需要更多数据
+数据可以任意切分到达；请求之后多收到的数据 (客户端提前发送的隧道数据) 保留在缓冲区中，由 take_buffer() 取出。
+另外提供 UDP 中继报文头的解析与应答的编码。
+"""
+
+import ipaddress
+import socket
+import struct
+
+NEED_DATA = object()
+
+# 认证方式
+METHOD_NO_AUTH = 0x00
+METHOD_NO_ACCEPTABLE = 0xFF
+
+# 请求命令
+CMD_CONNECT = 0x01
+CMD_BIND = 0x02
+CMD_UDP_ASSOCIATE = 0x03
+
+# 地址类型
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+
+# 应答码
+SOCKS5_SUCCEEDED = 0x00
+SOCKS5_GENERAL_FAILURE = 0x01
+SOCKS5_NOT_ALLOWED = 0x02
+SOCKS5_HOST_UNREACHABLE = 0x04
+SOCKS5_COMMAND_NOT_SUPPORTED = 0x07
+SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED = 0x08
+
+
+class Socks5ParseError(Exception):
+    """报文格式错误。reply 不为 None 时应先以该应答码答复客户端再关闭连接。"""
+    def __init__(self, message, reply=None):
+        super().__init__(message)
+        self.reply = reply
+
+
+class Greeting:
+    def __init__(self, methods):
+        self.methods = methods  # bytes，每个字节一种认证方式
+
+
+class Request:
+    def __init__(self, command, host, port, atyp):
+        self.command = command
+        self.host = host
+        self.port = port
+        self.atyp = atyp
+
+
+def _parse_address(buf, offset):
+    """从 buf[offset:] 解析 ATYP + 地址 + 端口。数据不足返回 None，否则返回 (host, port, atyp, 结束位置)。"""
+    if len(buf) <= offset:
+        return None
+    atyp = buf[offset]
+    if atyp == ATYP_IPV4:
+        end = offset + 1 + 4
+        if len(buf) < end + 2:
+            return None
+        host = socket.inet_ntop(socket.AF_INET, bytes(buf[offset + 1:end]))
+    elif atyp == ATYP_IPV6:
+        end = offset + 1 + 16
+        if len(buf) < end + 2:
+            return None
+        host = socket.inet_ntop(socket.AF_INET6, bytes(buf[offset + 1:end]))
+    elif atyp == ATYP_DOMAIN:
+        if len(buf) < offset + 2:
+            return None
+        end = offset + 2 + buf[offset + 1]
+        if len(buf) < end + 2:
+            return None
+        try:
+            host = bytes(buf[offset + 2:end]).decode('idna')
+        except UnicodeError:
+            raise Socks5ParseError("无效的域名", SOCKS5_GENERAL_FAILURE)
+        if not host:
+            raise Socks5ParseError("域名为空", SOCKS5_GENERAL_FAILURE)
+    else:
+        raise Socks5ParseError(f"不支持的地址类型: {atyp}", SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED)
+    port = struct.unpack_from('!H', buf, end)[0]
+    return host, port, atyp, end + 2
+
+
+class Socks5Parser:
+    """单个客户端连接的握手解析：先是认证协商，然后是一个请求。"""
+    def __init__(self):
+        self._buf = bytearray()
+        self._state = 'greeting'
+
+    def feed(self, data: bytes):
+        self._buf += data
+
+    def take_buffer(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+    def next_event(self):
+        buf = self._buf
+        if self._state == 'greeting':
+            if len(buf) < 2:
+                return NEED_DATA
+            if buf[0] != 5:
+                raise Socks5ParseError(f"不支持的 SOCKS 版本: {buf[0]}")
+            end = 2 + buf[1]
+            if len(buf) < end:
+                return NEED_DATA
+            event = Greeting(bytes(buf[2:end]))
+            del buf[:end]
+            self._state = 'request'
+            return event
+        if self._state == 'request':
+            if len(buf) < 4:
+                return NEED_DATA
+            if buf[0] != 5:
+                raise Socks5ParseError(f"不支持的 SOCKS 版本: {buf[0]}")
+            address = _parse_address(buf, 3)
+            if address is None:
+                return NEED_DATA
+            host, port, atyp, end = address
+            event = Request(buf[1], host, port, atyp)
+            del buf[:end]
+            self._state = 'done'
+            return event
+        raise Socks5ParseError("握手已完成")
+
+
+def socks5_reply(code: int, host: str = '0.0.0.0', port: int = 0) -> bytes:
+    """编码应答，host/port 为 BND.ADDR/BND.PORT。"""
+    ip = ipaddress.ip_address(host)
+    atyp = ATYP_IPV4 if ip.version == 4 else ATYP_IPV6
+    return bytes((5, code, 0, atyp)) + ip.packed + struct.pack('!H', port)
+
+
+def parse_udp_header(datagram: bytes):
+    """
+    解析 UDP 中继报文头 (RSV RSV FRAG ATYP DST.ADDR DST.PORT)。
+    返回 (frag, host, port, 报文头长度)；报文不完整或格式错误时返回 None。
+    """
+    if len(datagram) < 4 or datagram[0] or datagram[1]:
+        return None
+    try:
+        address = _parse_address(datagram, 3)
+    except Socks5ParseError:
+        return None
+    if address is None:
+        return None
+    host, port, _, end = address
+    return datagram[2], host, port, end
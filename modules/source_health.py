@@ -0,0 +1,177 @@
+# modules/source_health.py
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+# 指数移动平均的权重：新样本占 30%
+_EWMA_ALPHA = 0.3
+
+
+def _ewma(old, value):
+    return value if old is None else old + _EWMA_ALPHA * (value - old)
+
+
+class SourceHealth:
+    """
+    代理源的健康记录，持久化到磁盘，跨运行保留。每个源 (API 为 URL，爬虫为 "scrape:函数名") 记录：
+    产出数、本轮新增的不重复代理数、耗时、出错率、内容是否变化。据此：
+    1. 刷新间隔：内容没变化时翻倍 (最多 max_interval)，有变化时减半 (最少 min_interval)。
+       间隔只约束上次失败 (含超过本轮期限) 的源，未到期的本轮跳过；上次成功的源每轮都获取，
+       避免短时间内再次获取时所有源都被跳过、一个候选也拿不到；
+    2. 熔断：连续失败 failure_threshold 次后熔断，冷却时间从 cooldown 开始每次失败翻倍 (最多 max_cooldown)，
+       冷却结束后放行一次试探，成功则恢复，失败则继续熔断；
+    3. 排名：按 "每秒获取耗时带来的不重复代理数" 排序，先提交收益高的源，并在日志中给出报告。
+    获取失败和结果为空都算作失败。
+    """
+    def __init__(self, path: str = "source_health.json", min_interval: float = 300, max_interval: float = 6 * 3600,
+                 failure_threshold: int = 3, cooldown: float = 600, max_cooldown: float = 24 * 3600):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._lock = threading.Lock()
+        self._records = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(records, dict):
+            self._records = records
+
+    def save(self):
+        """写回磁盘（先写临时文件再替换，避免写到一半时损坏）。"""
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            snapshot = {key: dict(record) for key, record in self._records.items()}
+            self._dirty = False
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+
+    def _record(self, key):
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = {
+                'runs': 0, 'errors': 0, 'consecutive_failures': 0,
+                'last_attempt': 0.0, 'last_success': 0.0, 'last_changed': 0.0,
+                'latency': None, 'yield': None, 'unique': None, 'error_rate': None,
+                'content_hash': None, 'interval': self.min_interval, 'open_until': 0.0,
+            }
+        return record
+
+    # --- 调度 ---
+    def due(self, key, now: float = None):
+        """
+        本轮是否应获取该源，返回 (是否获取, 原因)。
+        原因为 'new' / 'due' / 'half_open' / 'open' (熔断中) / 'fresh' (上次失败，刷新间隔未到)。
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                return True, 'new'
+            if record['consecutive_failures'] >= self.failure_threshold:
+                if now < record['open_until']:
+                    return False, 'open'
+                return True, 'half_open'
+            if record['consecutive_failures'] and now - record['last_attempt'] < record['interval']:
+                return False, 'fresh'
+            return True, 'due'
+
+    def rate(self, key) -> float:
+        """每秒获取耗时带来的不重复代理数；没有记录的源返回无穷大，优先尝试。"""
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or record['unique'] is None:
+                return math.inf
+            return record['unique'] / max(record['latency'] or 0.0, 0.1)
+
+    # --- 记录结果 ---
+    def record_success(self, key, proxies, unique: int, elapsed: float, now: float = None):
+        """proxies 为该源本轮的全部结果，unique 为其中本轮首次出现的代理数。返回 True 表示该源由此从熔断中恢复。"""
+        now = time.time() if now is None else now
+        content_hash = hashlib.sha1("\n".join(sorted(proxies)).encode()).hexdigest()
+        with self._lock:
+            record = self._record(key)
+            recovered = record['consecutive_failures'] >= self.failure_threshold
+            record['runs'] += 1
+            record['consecutive_failures'] = 0
+            record['open_until'] = 0.0
+            record['last_attempt'] = record['last_success'] = now
+            record['latency'] = _ewma(record['latency'], elapsed)
+            record['yield'] = _ewma(record['yield'], len(proxies))
+            record['unique'] = _ewma(record['unique'], unique)
+            record['error_rate'] = _ewma(record['error_rate'], 0.0)
+            if content_hash == record['content_hash']:
+                record['interval'] = min(self.max_interval, record['interval'] * 2)
+            else:
+                record['content_hash'] = content_hash
+                record['last_changed'] = now
+                record['interval'] = max(self.min_interval, record['interval'] / 2)
+            self._dirty = True
+            return recovered
+
+    def record_failure(self, key, elapsed: float, now: float = None):
+        """
+        获取失败、结果为空或超过本轮期限。返回 True 表示该源因此由正常转为熔断；
+        已熔断的源试探失败时只延长冷却时间，返回 False，避免每次失败都重复报告。
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            record = self._record(key)
+            record['runs'] += 1
+            record['errors'] += 1
+            record['consecutive_failures'] += 1
+            record['last_attempt'] = now
+            record['latency'] = _ewma(record['latency'], elapsed)
+            record['unique'] = _ewma(record['unique'], 0)
+            record['error_rate'] = _ewma(record['error_rate'], 1.0)
+            self._dirty = True
+            excess = record['consecutive_failures'] - self.failure_threshold
+            if excess < 0:
+                return False
+            record['open_until'] = now + min(self.max_cooldown, self.cooldown * 2 ** min(excess, 20))
+            return excess == 0
+
+    # --- 报告 ---
+    def report(self, keys=None) -> list:
+        """按收益降序排列的各源状态，keys 为 None 时包含所有有记录的源。"""
+        now = time.time()
+        with self._lock:
+            items = [(key, dict(record)) for key, record in self._records.items() if keys is None or key in keys]
+        rows = []
+        for key, record in items:
+            rows.append({
+                'source': key,
+                'rate': round(self.rate(key), 2) if record['unique'] is not None else None,
+                'yield': round(record['yield'] or 0, 1),
+                'unique': round(record['unique'] or 0, 1),
+                'latency': round(record['latency'] or 0, 2),
+                'error_rate': round(record['error_rate'] or 0, 2),
+                'runs': record['runs'],
+                'interval': int(record['interval']),
+                'open': record['consecutive_failures'] >= self.failure_threshold and now < record['open_until'],
+                'last_changed': record['last_changed'],
+            })
+        rows.sort(key=lambda row: row['rate'] or 0, reverse=True)
+        return rows
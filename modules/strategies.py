@@ -0,0 +1,250 @@
+# modules/strategies.py
+
+import bisect
+import random
+import zlib
+
+
+class SelectionStrategy:
+    """
+    上游代理选择策略的基类。select 在 ProxyRotator 持有锁时调用，
+    ring 为当前筛选条件下的 RotationRing，返回选中的代理地址，无候选时返回 None。
+    """
+    name = 'base'
+
+    def select(self, rotator, ring, target_host=None):
+        raise NotImplementedError
+
+
+class RoundRobinStrategy(SelectionStrategy):
+    """按分数排序的严格轮换（原有行为）。"""
+    name = 'round_robin'
+
+    def select(self, rotator, ring, target_host=None):
+        return ring.next()
+
+
+class _IncrementalStrategy(SelectionStrategy):
+    """
+    维护由环派生的缓存 (权重、哈希环) 的策略基类：按环的变化日志只更新有变化的地址，
+    首次使用、换了环或日志重置时才全量重建。子类实现 _rebuild(ring) 与幂等的 _apply(ring, address)。
+    """
+    def __init__(self):
+        self._log_id = None
+        self._offset = 0
+
+    def _sync(self, ring):
+        changes = ring.changes_since(self._log_id, self._offset)
+        if changes is None:
+            self._rebuild(ring)
+        else:
+            for address in dict.fromkeys(changes):
+                self._apply(ring, address)
+        self._log_id, self._offset = ring.log_position()
+
+    def _rebuild(self, ring):
+        raise NotImplementedError
+
+    def _apply(self, ring, address):
+        raise NotImplementedError
+
+
+class WeightedRandomStrategy(_IncrementalStrategy):
+    """
+    按分数加权随机：分数越高，被选中的概率越大。
+    权重 (分数+1，精确到0.1) 以整数存放在树状数组中，分数变化或代理增删时 O(log N) 更新，抽样也是 O(log N)。
+    """
+    name = 'weighted_random'
+    SCALE = 10
+
+    def __init__(self):
+        super().__init__()
+        self._slots = {}  # 地址 -> 槽位 (从1开始)
+        self._owners = [None]  # 槽位 -> 地址，空闲槽位为 None
+        self._weights = [0]
+        self._tree = [0]
+        self._free = []
+        self._total = 0
+
+    def _weight(self, score) -> int:
+        return round((max(score, 0) + 1) * self.SCALE)
+
+    def _rebuild(self, ring):
+        addresses = ring.addresses()
+        count = len(addresses)
+        size = max(16, 2 * count)  # 预留空槽，新代理直接占用
+        self._owners = [None] + addresses + [None] * (size - count)
+        self._weights = [0] + [self._weight(score) for score in ring.scores()] + [0] * (size - count)
+        self._slots = {address: slot for slot, address in enumerate(addresses, 1)}
+        self._free = list(range(size, count, -1))
+        tree = list(self._weights)
+        for slot in range(1, size + 1):
+            parent = slot + (slot & -slot)
+            if parent <= size:
+                tree[parent] += tree[slot]
+        self._tree = tree
+        self._total = sum(self._weights)
+
+    def _add_weight(self, slot: int, delta: int):
+        self._total += delta
+        tree = self._tree
+        while slot < len(tree):
+            tree[slot] += delta
+            slot += slot & -slot
+
+    def _apply(self, ring, address):
+        score = ring.score_of(address)
+        slot = self._slots.get(address)
+        if score is None:
+            if slot is not None:
+                del self._slots[address]
+                self._owners[slot] = None
+                self._free.append(slot)
+                self._add_weight(slot, -self._weights[slot])
+                self._weights[slot] = 0
+            return
+        if slot is None:
+            if not self._free:
+                # 空槽用尽：按环的当前内容重建 (容量翻倍)，之后的 _apply 都不会再改变状态
+                self._rebuild(ring)
+                return
+            slot = self._free.pop()
+            self._slots[address] = slot
+            self._owners[slot] = address
+        weight = self._weight(score)
+        self._add_weight(slot, weight - self._weights[slot])
+        self._weights[slot] = weight
+
+    def select(self, rotator, ring, target_host=None):
+        if not len(ring):
+            return None
+        self._sync(ring)
+        # 在树状数组上自顶向下查找前缀和首次超过 point 的槽位
+        point = random.randrange(self._total)
+        tree = self._tree
+        size = len(tree) - 1
+        pos, step = 0, 1 << (size.bit_length() - 1)
+        while step:
+            probe = pos + step
+            if probe <= size and tree[probe] <= point:
+                pos = probe
+                point -= tree[probe]
+            step >>= 1
+        return self._owners[pos + 1]
+
+
+class PowerOfTwoChoicesStrategy(SelectionStrategy):
+    """
+    随机挑两个候选，选择"实时延迟 x (1 + 进行中连接数)"较小的一个。
+    实时延迟为服务端上报的连接耗时 EWMA，尚无数据时使用验证时测得的延迟。
+    """
+    name = 'p2c'
+
+    def select(self, rotator, ring, target_host=None):
+        size = len(ring)
+        if size == 0:
+            return None
+        if size == 1:
+            return ring.address_at(0)
+        first, second = random.sample(range(size), 2)
+        a, b = ring.address_at(first), ring.address_at(second)
+        return a if rotator.live_cost(a) <= rotator.live_cost(b) else b
+
+
+class LeastInFlightStrategy(SelectionStrategy):
+    """
+    选择进行中连接数最少的候选，同数量时取分数较高者。
+    候选较多时只比较 sample_size 个随机样本，保持选择开销与池大小无关。
+    """
+    name = 'least_in_flight'
+
+    def __init__(self, sample_size: int = 16):
+        self.sample_size = sample_size
+
+    def select(self, rotator, ring, target_host=None):
+        size = len(ring)
+        if size == 0:
+            return None
+        positions = range(size) if size <= self.sample_size else sorted(random.sample(range(size), self.sample_size))
+        # 环按分数降序排列，min 在并列时保留位置靠前（分数较高）的候选
+        best = min(positions, key=lambda pos: rotator.in_flight(ring.address_at(pos)))
+        return ring.address_at(best)
+
+
+class ConsistentHashStrategy(_IncrementalStrategy):
+    """
+    按目标主机做一致性哈希，同一目标站点固定走同一个上游，实现会话粘滞；
+    上游增减时只有少量目标主机会被重新映射。没有目标主机时退化为轮换。
+    哈希环只随候选的增删变化：分数变化不影响哈希环，增删一个代理只插入/删除它的虚拟节点。
+    """
+    name = 'consistent_hash'
+
+    def __init__(self, virtual_nodes: int = 40):
+        super().__init__()
+        self.virtual_nodes = virtual_nodes
+        self._members = set()
+        self._points = []
+        self._owners = []
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return zlib.crc32(value.encode('utf-8'))
+
+    def _rebuild(self, ring):
+        nodes = sorted(
+            (self._hash(f"{address}#{i}"), address)
+            for address in ring.addresses() for i in range(self.virtual_nodes)
+        )
+        self._points = [point for point, _ in nodes]
+        self._owners = [address for _, address in nodes]
+        self._members = set(self._owners)
+
+    def _node_position(self, point: int, address: str) -> int:
+        """虚拟节点 (point, address) 在有序哈希环中的位置，与全量重建时的排序一致。"""
+        pos = bisect.bisect_left(self._points, point)
+        while pos < len(self._points) and self._points[pos] == point and self._owners[pos] < address:
+            pos += 1
+        return pos
+
+    def _apply(self, ring, address):
+        present = ring.score_of(address) is not None
+        if present == (address in self._members):
+            return
+        for i in range(self.virtual_nodes):
+            point = self._hash(f"{address}#{i}")
+            pos = self._node_position(point, address)
+            if present:
+                self._points.insert(pos, point)
+                self._owners.insert(pos, address)
+            else:
+                del self._points[pos]
+                del self._owners[pos]
+        if present:
+            self._members.add(address)
+        else:
+            self._members.discard(address)
+
+    def select(self, rotator, ring, target_host=None):
+        if not len(ring):
+            return None
+        if not target_host:
+            return ring.next()
+        self._sync(ring)
+        idx = bisect.bisect_left(self._points, self._hash(target_host)) % len(self._points)
+        return self._owners[idx]
+
+
+STRATEGIES = {
+    cls.name: cls for cls in (
+        RoundRobinStrategy, WeightedRandomStrategy, PowerOfTwoChoicesStrategy,
+        LeastInFlightStrategy, ConsistentHashStrategy,
+    )
+}
+
+
+def create_strategy(name: str = 'round_robin') -> SelectionStrategy:
+    """按名称创建策略实例，未知名称时抛出 ValueError。"""
+    try:
+        return STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"未知的代理选择策略: {name}，可选: {', '.join(STRATEGIES)}")
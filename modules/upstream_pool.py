@@ -0,0 +1,161 @@
+# modules/upstream_pool.py
+
+import asyncio
+import socket
+import time
+from collections import OrderedDict, deque
+
+from .aio_proxy import open_socket, prewarm_handshake, split_host_port
+
+
+def _is_alive(sock) -> bool:
+    """空闲连接健康检查：MSG_PEEK 读不到数据说明连接仍然打开；读到 EOF 或多余数据都视为失效。"""
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+class UpstreamPool:
+    """
+    上游代理的预热连接池，运行在 ProxyServer 的事件循环中。
+    为最近使用过的上游各保持 size_per_upstream 个已连接的空闲 socket（SOCKS5 已完成认证协商），
+    请求到来时只需发送 CONNECT，免去 TCP 握手和 SOCKS5 协商的往返。
+    后台任务定期淘汰过期/已断开的连接并补足数量；补充失败的上游按指数退避后再重试。
+    """
+    def __init__(self, size_per_upstream: int = 2, max_upstreams: int = 32, max_idle: float = 20,
+                 hot_window: float = 60, connect_timeout: float = 10, refill_interval: float = 1.0):
+        self.size_per_upstream = size_per_upstream
+        self.max_upstreams = max_upstreams
+        self.max_idle = max_idle            # 空闲连接的最长保留时间，免费代理通常会很快断开空闲连接
+        self.hot_window = hot_window        # 超过该时间未被使用的上游不再预热
+        self.connect_timeout = connect_timeout
+        self.refill_interval = refill_interval
+
+        self._idle = {}             # 上游地址 -> deque[(socket, 建立时间)]
+        self._hot = OrderedDict()   # 上游地址 -> (协议, 最近使用时间)，按最近使用排序
+        self._pending = {}          # 上游地址 -> 正在建立的连接数
+        self._retry_at = {}         # 上游地址 -> (连续失败次数, 下次允许补充的时间)
+        self._tasks = set()
+        self._wakeup = None
+        self.stats = {'hits': 0, 'misses': 0, 'opened': 0, 'failed': 0, 'expired': 0, 'broken': 0}
+
+    def touch(self, address: str, protocol: str):
+        """记录一次对该上游的使用，使其进入(或留在)预热集合。"""
+        self._hot[address] = (protocol, time.time())
+        self._hot.move_to_end(address)
+        while len(self._hot) > self.max_upstreams:
+            evicted, _ = self._hot.popitem(last=False)
+            self._drop(evicted)
+
+    def _kick(self):
+        """连接被取走后立即唤醒维护循环补充，不必等到下一个周期。"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def take(self, address: str):
+        """取出一个可用的预热连接，没有时返回 None。优先取最新建立的连接。"""
+        idle = self._idle.get(address)
+        self._kick()
+        while idle:
+            sock, created = idle.pop()
+            if time.time() - created <= self.max_idle and _is_alive(sock):
+                self.stats['hits'] += 1
+                return sock
+            sock.close()
+            self.stats['broken'] += 1
+        self.stats['misses'] += 1
+        return None
+
+    def idle_count(self, address: str = None) -> int:
+        if address is not None:
+            return len(self._idle.get(address, ()))
+        return sum(len(idle) for idle in self._idle.values())
+
+    def _drop(self, address: str):
+        for sock, _ in self._idle.pop(address, ()):
+            sock.close()
+        self._retry_at.pop(address, None)
+
+    async def _fill(self, address: str, protocol: str):
+        loop = asyncio.get_running_loop()
+        self._pending[address] = self._pending.get(address, 0) + 1
+        sock = None
+        try:
+            host, port = split_host_port(address)
+            sock = await open_socket(host, port, self.connect_timeout)
+            await asyncio.wait_for(prewarm_handshake(loop, sock, protocol), self.connect_timeout)
+        except asyncio.CancelledError:
+            if sock:
+                sock.close()
+            raise
+        except Exception:
+            if sock:
+                sock.close()
+            self.stats['failed'] += 1
+            failures = self._retry_at.get(address, (0, 0))[0] + 1
+            self._retry_at[address] = (failures, time.time() + min(60, 2 ** failures))
+            return
+        finally:
+            self._pending[address] -= 1
+
+        if address not in self._hot:
+            sock.close()
+            return
+        self._retry_at.pop(address, None)
+        self._idle.setdefault(address, deque()).append((sock, time.time()))
+        self.stats['opened'] += 1
+
+    def _maintain(self):
+        now = time.time()
+        for address, (_, last_used) in list(self._hot.items()):
+            if now - last_used > self.hot_window:
+                del self._hot[address]
+                self._drop(address)
+
+        for address, idle in list(self._idle.items()):
+            kept = deque()
+            for sock, created in idle:
+                if now - created > self.max_idle:
+                    sock.close()
+                    self.stats['expired'] += 1
+                elif not _is_alive(sock):
+                    sock.close()
+                    self.stats['broken'] += 1
+                else:
+                    kept.append((sock, created))
+            self._idle[address] = kept
+
+        for address, (protocol, _) in self._hot.items():
+            if self._retry_at.get(address, (0, 0))[1] > now:
+                continue
+            deficit = self.size_per_upstream - len(self._idle.get(address, ())) - self._pending.get(address, 0)
+            for _ in range(deficit):
+                task = asyncio.ensure_future(self._fill(address, protocol))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        """后台维护循环，随 ProxyServer 启动，停止时被取消。"""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self._maintain()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.refill_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            self._wakeup = None
+            self.close()
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        for address in list(self._idle):
+            self._drop(address)
+        self._hot.clear()
@@ -0,0 +1,283 @@
+# modules/workers.py
+
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+from .metrics import ServerMetrics
+from .rotator import ProxyRotator
+from .server import ProxyServer
+
+# Linux 的 SO_REUSEPORT 会在绑定同一端口的多个 socket 之间分配新连接；
+# 其他系统虽然有该选项，但不做负载均衡，新连接只会交给其中一个 socket
+REUSEPORT_AVAILABLE = hasattr(socket, 'SO_REUSEPORT') and sys.platform.startswith('linux')
+
+# 设置中的这些上限针对整个服务；多进程模式下平分给各工作进程 (0 表示不限制，保持不变)。
+# 连接数向上取整且至少为 1；速率与突发量按小数平分，否则每个进程都向上取整，总速率会放大为进程数倍
+_SHARED_COUNT_LIMITS = ('max_connections', 'accept_queue_size', 'max_per_upstream')
+_SHARED_RATE_LIMITS = ('client_rate_limit', 'client_rate_burst')
+
+
+def _split_limits(options: dict, workers: int) -> dict:
+    """把整个服务的上限平分给 workers 个进程 (连接数向上取整且至少为 1，速率与突发量保持小数)。"""
+    options = dict(options)
+    for key in _SHARED_COUNT_LIMITS:
+        value = options.get(key)
+        if value:
+            options[key] = max(1, -(-value // workers))
+    for key in _SHARED_RATE_LIMITS:
+        value = options.get(key)
+        if value:
+            options[key] = value / workers
+    return options
+
+
+class _WorkerLog:
+    """工作进程中 ProxyServer 使用的日志队列，日志经事件队列交给控制进程。"""
+    def __init__(self, events, index):
+        self._events = events
+        self._index = index
+
+    def put(self, message):
+        self._events.put(('log', self._index, message))
+
+
+def _worker_main(index, addresses, options, snapshot, rotate_per_request, report_interval, feedback_interval,
+                 commands, events):
+    """
+    工作进程入口：按控制进程发来的快照维护本地轮换器，运行一个绑定共享端口的 ProxyServer，
+    定期回报统计、实测分数以及本进程判定为不可用的上游。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由控制进程统一停止
+    rotator = ProxyRotator(options.pop('failure_threshold', 1))
+    rotator.load_snapshot(snapshot)
+    http_host, http_port, socks5_host, socks5_port = addresses
+    server = ProxyServer(http_host, http_port, socks5_host, socks5_port, rotator, _WorkerLog(events, index),
+                         reuse_port=True, metrics_feedback_interval=0, **options)
+    server.rotate_per_request = rotate_per_request
+    # 最近一次快照中可用的上游；本进程把其中的上游判定为不可用时回报控制进程
+    synced_working = {p_info['proxy'] for p_info in snapshot['proxies'] if p_info.get('status') == 'Working'}
+
+    def report(final=False):
+        failed = [p_info['proxy'] for p_info in rotator.get_proxies_by_status('Unavailable')
+                  if p_info['proxy'] in synced_working]
+        synced_working.difference_update(failed)
+        data = {'metrics': server.metrics.to_dict(), 'active': server.active_connections,
+                'failed': failed, 'live_scores': {}}
+        if feedback_interval and (final or time.monotonic() >= report.next_feedback):
+            data['live_scores'] = server.metrics.live_scores()
+            report.next_feedback = time.monotonic() + feedback_interval
+        events.put(('report', index, data))
+    report.next_feedback = time.monotonic() + (feedback_interval or 0)
+
+    server.start_all()
+    events.put(('ready', index, server.listen_errors))
+    next_report = time.monotonic() + report_interval
+    try:
+        while True:
+            try:
+                command, payload = commands.get(timeout=max(0.0, next_report - time.monotonic()))
+            except queue.Empty:
+                command = None
+            if command == 'stop':
+                break
+            elif command == 'snapshot':
+                rotator.load_snapshot(payload)
+                synced_working = {p_info['proxy'] for p_info in payload['proxies'] if p_info.get('status') == 'Working'}
+            elif command == 'rotation':
+                server.rotate_per_request = payload
+            elif command == 'strategy':
+                server.set_strategy(payload)
+            if time.monotonic() >= next_report:
+                report()
+                next_report = time.monotonic() + report_interval
+    finally:
+        server.stop_all()
+        report(final=True)
+        events.put(('exited', index, None))
+
+
+class ProxyWorkerGroup:
+    """
+    多进程模式的本地代理服务：workers 个工作进程各运行一个 ProxyServer，
+    通过 SO_REUSEPORT 共享同一组 HTTP/SOCKS5 端口，由内核把新连接分配给各进程，转发不再受单个 GIL 限制。
+    控制进程持有真正的轮换器：每隔 sync_interval 秒把代理池快照 (有变化时) 发给各工作进程；
+    工作进程回报的统计在此汇总，回报的失效上游与实测分数写回轮换器，再随下一次快照同步给所有进程。
+    对外接口与 ProxyServer 一致 (start_all / stop_all / set_rotation_mode / set_strategy / metrics)。
+    max_connections / accept_queue_size / max_per_upstream / client_rate_limit / client_rate_burst 为整个服务的上限，
+    平分给各工作进程；内核按连接哈希分配，各进程负载不完全均匀，个别进程可能先于整体上限开始拒绝连接。
+    """
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue, workers: int = None,
+                 sync_interval: float = 1.0, **server_options):
+        if not REUSEPORT_AVAILABLE:
+            raise ValueError("当前平台不支持 SO_REUSEPORT 负载均衡，无法使用多进程模式")
+        self._rotator = rotator
+        self._log_queue = log_queue
+        self._addresses = (http_host, http_port, socks5_host, socks5_port)
+        self.workers = workers or os.cpu_count() or 1
+        self.sync_interval = sync_interval
+        self.feedback_interval = server_options.pop('metrics_feedback_interval', 10)
+        server_options['failure_threshold'] = rotator.failure_threshold
+        self._server_options = _split_limits(server_options, self.workers)
+
+        self._ctx = multiprocessing.get_context('spawn')  # 控制进程中有其他线程在运行，不使用 fork
+        self._processes = []
+        self._commands = []
+        self._events = None
+        self._reports = {}  # 工作进程序号 -> 最近一次回报
+        self._last_snapshot = None
+        self._control_thread = None
+        self._stop_event = threading.Event()
+        self._running = False
+        self.rotate_per_request = False
+        self.listen_errors = []  # 同 ProxyServer.listen_errors，另含未按时启动的工作进程
+
+    @classmethod
+    def from_settings(cls, settings: dict, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+        """按 config.json 的 server 段创建，workers 为工作进程数。"""
+        server = settings.get('server', {})
+        options = {key: server[key] for key in ProxyServer.SETTINGS if key in server}
+        return cls(http_host, http_port, socks5_host, socks5_port, rotator, log_queue,
+                   workers=server.get('workers'), **options)
+
+    def log(self, message):
+        self._log_queue.put(f"[Server] {message}")
+
+    def _broadcast(self, command, payload=None):
+        for commands in self._commands:
+            commands.put((command, payload))
+
+    def set_rotation_mode(self, per_request: bool):
+        self.rotate_per_request = per_request
+        self._broadcast('rotation', per_request)
+        mode = "逐请求轮换" if per_request else "固定当前"
+        self.log(f"服务轮换模式已切换为: {mode}")
+
+    def set_strategy(self, name: str):
+        self._broadcast('strategy', name)
+
+    @property
+    def active_connections(self) -> int:
+        return sum(report['active'] for report in list(self._reports.values()))
+
+    @property
+    def metrics(self) -> ServerMetrics:
+        """各工作进程最近一次回报的统计之和。"""
+        merged = ServerMetrics()
+        for report in list(self._reports.values()):
+            merged.merge_dict(report['metrics'])
+        return merged
+
+    def start_all(self, timeout: float = 30):
+        if self._running:
+            return
+        self._running = True
+        self.listen_errors = []
+        self._stop_event.clear()
+        self._events = self._ctx.Queue()
+        self._last_snapshot = self._rotator.snapshot()
+        for index in range(self.workers):
+            commands = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_worker_main, daemon=True,
+                args=(index, self._addresses, dict(self._server_options), self._last_snapshot,
+                      self.rotate_per_request, self.sync_interval, self.feedback_interval, commands, self._events))
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+
+        # 等待各工作进程完成监听后再返回，与 ProxyServer.start_all 的行为一致
+        ready = 0
+        deadline = time.monotonic() + timeout
+        while ready < self.workers and time.monotonic() < deadline:
+            try:
+                event = self._events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if event[0] == 'ready':
+                ready += 1
+                self.listen_errors.extend(f"{error} (#{event[1]})" for error in event[2])
+            self._handle_event(event)
+        self.log(f"多进程模式: {ready}/{self.workers} 个工作进程已启动。")
+        if ready < self.workers:
+            self.listen_errors.append(f"{self.workers - ready} 个工作进程未在 {timeout} 秒内启动")
+        self._control_thread = threading.Thread(target=self._control_loop, daemon=True)
+        self._control_thread.start()
+
+    def stop_all(self, timeout: float = 10):
+        if not self._running:
+            return
+        self._running = False
+        self._stop_event.set()
+        self._control_thread.join()
+        self._broadcast('stop')
+
+        # 收集各进程退出前的最终统计
+        exited = 0
+        deadline = time.monotonic() + timeout
+        while exited < len(self._processes) and time.monotonic() < deadline:
+            try:
+                event = self._events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if event[0] == 'exited':
+                exited += 1
+            self._handle_event(event)
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+        self._commands.clear()
+        self.log("所有代理服务已停止。")
+
+    # --- 控制循环 ---
+    def _control_loop(self):
+        next_sync = time.monotonic() + self.sync_interval
+        while not self._stop_event.is_set():
+            try:
+                self._handle_event(self._events.get(timeout=max(0.0, next_sync - time.monotonic())))
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_sync:
+                self._sync()
+                next_sync = time.monotonic() + self.sync_interval
+
+    def _sync(self):
+        """代理池有变化时把快照发给所有工作进程；发现进程意外退出时记录日志。"""
+        snapshot = self._rotator.snapshot()
+        if snapshot != self._last_snapshot:
+            self._last_snapshot = snapshot
+            self._broadcast('snapshot', snapshot)
+        for index, process in enumerate(self._processes):
+            if not process.is_alive() and index in self._reports:
+                self.log(f"[!] 工作进程 #{index} 意外退出 (退出码 {process.exitcode})。")
+                del self._reports[index]
+
+    def _handle_event(self, event):
+        kind, index, payload = event
+        if kind == 'log':
+            self._log_queue.put(f"{payload} (#{index})")
+        elif kind == 'report':
+            self._reports[index] = payload
+            for address in payload['failed']:
+                p_info = self._rotator.get_proxy_by_address(address)
+                if p_info and p_info.get('status') == 'Working':
+                    self._rotator.update_proxy(address, {'status': 'Unavailable'})
+                    self.log(f"[!] 上游代理 {address} 在工作进程 #{index} 中连续失败，已标记为不可用。")
+            for address, live_score in payload['live_scores'].items():
+                self._rotator.apply_live_score(address, live_score)
+
+
+def create_proxy_server(settings: dict, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+    """按 server.workers 设置创建单进程的 ProxyServer 或多进程的 ProxyWorkerGroup。"""
+    workers = settings.get('server', {}).get('workers', 0)
+    if workers and workers > 1 and REUSEPORT_AVAILABLE:
+        return ProxyWorkerGroup.from_settings(settings, http_host, http_port, socks5_host, socks5_port,
+                                              rotator, log_queue)
+    return ProxyServer.from_settings(settings, http_host, http_port, socks5_host, socks5_port, rotator, log_queue)
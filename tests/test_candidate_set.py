@@ -0,0 +1,63 @@
+# tests/test_candidate_set.py
+
+import sqlite3
+
+from modules.candidate_set import CandidateSet
+from modules.proxy_history import ProxyHistory
+
+MIXED = ['1.2.3.4:80', 'Proxy.Example.com:8080', '[::1]:3128', 'not a proxy', '1.2.3.4:80']
+
+
+def test_keeps_hostnames_and_ipv6():
+    candidates = CandidateSet.from_addresses('http', MIXED)
+    assert candidates.addresses() == ['1.2.3.4:80', '[::1]:3128', 'proxy.example.com:8080']
+    assert candidates.to_dict() == {'http': ['1.2.3.4:80', '[::1]:3128', 'proxy.example.com:8080'],
+                                    'socks4': [], 'socks5': []}
+
+
+def test_set_operations():
+    seen = CandidateSet.from_addresses('http', ['1.2.3.4:80', 'a.example.com:80'])
+    batch = CandidateSet.from_addresses('http', ['1.2.3.4:80', 'b.example.com:80', '[::1]:80'])
+    fresh = batch.difference(seen)
+    assert fresh.addresses() == ['[::1]:80', 'b.example.com:80']
+    seen.update(fresh)
+    assert len(seen) == 4
+    assert batch.intersection(seen).counts() == {'http': 3, 'socks4': 0, 'socks5': 0}
+    # 协议不同的同一地址是不同的候选
+    assert len(seen.difference(CandidateSet.from_addresses('socks5', ['1.2.3.4:80']))) == 4
+
+
+def test_shard_and_infos():
+    candidates = CandidateSet.merge([CandidateSet.from_addresses('http', ['1.1.1.1:80', '2.2.2.2:80', 'x.example.com:80']),
+                                     CandidateSet.from_addresses('socks5', ['3.3.3.3:1080'])])
+    shards = candidates.shard(3)
+    assert sorted(len(shard) for shard in shards) == [1, 1, 2]
+    assert CandidateSet.merge(shards).keys() == candidates.keys()
+    assert list(candidates.iter_infos())[-1] == {'proxy': '3.3.3.3:1080', 'protocol': 'socks5'}
+    assert CandidateSet.from_keys(candidates.keys()).to_dict() == candidates.to_dict()
+
+
+def test_history_keeps_hostnames(tmp_path):
+    history = ProxyHistory(str(tmp_path / "history.db"))
+    candidates = CandidateSet.from_addresses('http', ['1.2.3.4:80', 'proxy.example.com:8080'])
+    history.record_seen(candidates, 'test', now=1000)
+    history.record_checks([('proxy.example.com:8080', 'HTTP')], [('1.2.3.4:80', 'http')], now=1000)
+    good, rest, skipped = history.triage(candidates, now=1001)
+    assert (good.addresses(), rest.addresses(), skipped) == (['proxy.example.com:8080'], [], 1)
+    history.close()
+
+
+def test_history_converts_legacy_integer_keys(tmp_path):
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE proxies (key INTEGER PRIMARY KEY, last_seen REAL NOT NULL DEFAULT 0, "
+                 "last_checked REAL NOT NULL DEFAULT 0, last_ok INTEGER, failure_streak INTEGER NOT NULL DEFAULT 0, "
+                 "source TEXT)")
+    # socks5 (序号 2)，1.2.3.4:1080
+    conn.execute("INSERT INTO proxies VALUES (?, ?, ?, 1, 0, 'src')", (2 << 48 | 0x01020304 << 16 | 1080, 1e12, 1e12))
+    conn.commit()
+    conn.close()
+    history = ProxyHistory(path)
+    good, _, _ = history.triage(CandidateSet.from_addresses('socks5', ['1.2.3.4:1080']))
+    assert good.addresses() == ['1.2.3.4:1080']
+    history.close()
@@ -0,0 +1,33 @@
+# tests/test_rotator.py
+
+from modules.rotator import ProxyRotator
+
+ADDRESSES = ["10.0.0.1:80", "10.0.0.2:80", "10.0.0.3:80", "10.0.0.4:80"]
+
+
+def make_rotator():
+    rotator = ProxyRotator()
+    for i, address in enumerate(ADDRESSES):
+        rotator.add_proxy({'proxy': address, 'protocol': 'HTTP', 'status': 'Working', 'location': '本地',
+                           'latency': 0.1, 'score': 40 - i * 10})
+    return rotator
+
+
+def addresses(infos):
+    return [info['proxy'] for info in infos]
+
+
+def test_failover_walk_does_not_move_cursor():
+    rotator = make_rotator()
+    assert rotator.get_next_proxy()['proxy'] == ADDRESSES[0]
+    assert addresses(rotator.failover_candidates(ADDRESSES[0], {ADDRESSES[0]})) == ADDRESSES[1:]
+    assert addresses(rotator.failover_candidates(ADDRESSES[2], {ADDRESSES[0], ADDRESSES[2]}, limit=1)) == [ADDRESSES[3]]
+    assert rotator.get_next_proxy()['proxy'] == ADDRESSES[1]
+    assert rotator.get_current_proxy()['proxy'] == ADDRESSES[1]
+
+
+def test_failover_walk_starts_after_removed_upstream():
+    rotator = make_rotator()
+    rotator.update_proxy(ADDRESSES[1], {'status': 'Unavailable'})
+    assert addresses(rotator.failover_candidates(ADDRESSES[1], {ADDRESSES[1]})) == [ADDRESSES[2], ADDRESSES[3], ADDRESSES[0]]
+    assert addresses(rotator.failover_candidates(None)) == [ADDRESSES[0], ADDRESSES[2], ADDRESSES[3]]
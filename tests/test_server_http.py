@@ -0,0 +1,46 @@
+# tests/test_server_http.py
+
+"""ProxyServer 的 HTTP 入口：格式错误的请求得到 400 应答。"""
+
+import queue
+import socket
+
+import pytest
+
+from modules.rotator import ProxyRotator
+from modules.server import HTTP_400, ProxyServer
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def http_port():
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    server = ProxyServer('127.0.0.1', port, '127.0.0.1', 0, ProxyRotator(), queue.Queue(),
+                         handshake_timeout=TIMEOUT, prewarm_per_upstream=0)
+    server.start_all()
+    yield port
+    server.stop_all()
+
+
+def exchange(port, request):
+    with socket.create_connection(('127.0.0.1', port), timeout=TIMEOUT) as client:
+        client.sendall(request)
+        response = b""
+        while True:
+            data = client.recv(4096)
+            if not data:
+                return response
+            response += data
+
+
+@pytest.mark.parametrize('target', [b'example.com', b'example.com:http', b':443', b'example.com:0',
+                                    b'example.com:70000', b'[::1]'])
+def test_malformed_connect_target(http_port, target):
+    assert exchange(http_port, b"CONNECT " + target + b" HTTP/1.1\r\nHost: example.com\r\n\r\n") == HTTP_400
+
+
+def test_request_without_host(http_port):
+    assert exchange(http_port, b"GET / HTTP/1.1\r\n\r\n") == HTTP_400
@@ -0,0 +1,107 @@
+# tests/test_server_relay.py
+
+"""隧道转发的空闲超时：按整条隧道计算，单向的持续下载不会被中断。"""
+
+import queue
+import socket
+import threading
+import time
+
+import pytest
+
+from modules.rotator import ProxyRotator
+from modules.server import ProxyServer
+from modules.socks5_parser import SOCKS5_SUCCEEDED
+
+from tests.test_server_socks5 import GREETING, connect_request, read_reply, recv_exactly
+
+CHUNKS, CHUNK, INTERVAL = 20, b"x" * 100, 0.1
+
+
+class StreamingUpstream:
+    """SOCKS5 上游：握手后每隔 INTERVAL 秒发送一块数据 (delay 为第一块之前的等待)，发完后关闭。"""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.address = "127.0.0.1:%d" % self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            recv_exactly(conn, recv_exactly(conn, 2)[1])
+            conn.sendall(b"\x05\x00")
+            head = recv_exactly(conn, 4)
+            recv_exactly(conn, recv_exactly(conn, 1)[0] if head[3] == 3 else 4)
+            recv_exactly(conn, 2)
+            conn.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            time.sleep(self.delay)
+            for _ in range(CHUNKS):
+                conn.sendall(CHUNK)
+                time.sleep(INTERVAL)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+
+def start_server(upstream, idle_timeout):
+    rotator = ProxyRotator()
+    rotator.add_proxy({'proxy': upstream.address, 'protocol': 'SOCKS5', 'status': 'Working',
+                       'location': '本地', 'latency': 0.001, 'score': 100})
+    rotator.set_current_proxy_by_address(upstream.address)
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    server = ProxyServer('127.0.0.1', 0, '127.0.0.1', port, rotator, queue.Queue(), idle_timeout=idle_timeout)
+    server.start_all()
+    return server, port
+
+
+def download(port):
+    """经 SOCKS5 入口连接后只接收、不发送，返回 (收到的字节数, 耗时)。"""
+    started = time.monotonic()
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as client:
+        client.sendall(GREETING + connect_request('example.com', 80))
+        assert recv_exactly(client, 2) == b"\x05\x00"
+        assert read_reply(client)[0] == SOCKS5_SUCCEEDED
+        received = 0
+        while True:
+            data = client.recv(65536)
+            if not data:
+                return received, time.monotonic() - started
+            received += len(data)
+
+
+@pytest.mark.parametrize('relay_mode', ['recv_into', 'splice'])
+def test_one_way_download_outlives_idle_timeout(relay_mode):
+    upstream = StreamingUpstream()
+    server, port = start_server(upstream, idle_timeout=0.5)
+    if relay_mode == 'splice' and server.relay_mode != 'splice':
+        server.stop_all()
+        pytest.skip("当前平台不支持 splice")
+    server.relay_mode = relay_mode
+    try:
+        received, elapsed = download(port)
+    finally:
+        server.stop_all()
+    assert received == CHUNKS * len(CHUNK)
+    assert elapsed >= CHUNKS * INTERVAL * 0.8
+
+
+def test_idle_tunnel_is_closed():
+    upstream = StreamingUpstream(delay=5)
+    server, port = start_server(upstream, idle_timeout=0.5)
+    try:
+        received, elapsed = download(port)
+    finally:
+        server.stop_all()
+    assert received == 0
+    assert elapsed < 3
@@ -0,0 +1,219 @@
+# tests/test_server_socks5.py
+
+"""
+ProxyServer 的 SOCKS5 入口：经本机的假 SOCKS5 上游测试 CONNECT 与 UDP ASSOCIATE。
+假上游对 CONNECT 原样回显隧道数据；对 UDP ASSOCIATE 打开一个 UDP 端口，把收到的报文 (含报文头) 原样回显。
+"""
+
+import queue
+import socket
+import struct
+import threading
+
+import pytest
+
+from modules.rotator import ProxyRotator
+from modules.server import ProxyServer
+from modules.socks5_parser import (METHOD_NO_ACCEPTABLE, SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED,
+                                   SOCKS5_COMMAND_NOT_SUPPORTED, SOCKS5_SUCCEEDED)
+
+from tests.test_socks5_parser import GREETING, connect_request
+
+TIMEOUT = 5
+
+
+def recv_exactly(sock, n):
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("连接提前关闭")
+        buf += chunk
+    return buf
+
+
+def read_reply(sock):
+    """读取 SOCKS5 应答，返回 (应答码, BND.ADDR, BND.PORT)。"""
+    head = recv_exactly(sock, 4)
+    family, size = (socket.AF_INET6, 16) if head[3] == 4 else (socket.AF_INET, 4)
+    host = socket.inet_ntop(family, recv_exactly(sock, size))
+    return head[1], host, struct.unpack('!H', recv_exactly(sock, 2))[0]
+
+
+class FakeUpstream:
+    """只接受无认证方式的 SOCKS5 上游，每个连接一个线程。"""
+    def __init__(self):
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.address = "127.0.0.1:%d" % self.listener.getsockname()[1]
+        self.requests = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        udp = None
+        try:
+            conn.settimeout(TIMEOUT)
+            recv_exactly(conn, recv_exactly(conn, 2)[1])
+            conn.sendall(b"\x05\x00")
+            head = recv_exactly(conn, 4)
+            if head[3] == 3:
+                recv_exactly(conn, recv_exactly(conn, 1)[0])
+            else:
+                recv_exactly(conn, 4 if head[3] == 1 else 16)
+            recv_exactly(conn, 2)
+            self.requests.append(head[1])
+            if head[1] == 3:
+                udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udp.bind(('127.0.0.1', 0))
+                threading.Thread(target=self._echo_udp, args=(udp,), daemon=True).start()
+                conn.sendall(b"\x05\x00\x00\x01" + socket.inet_aton('127.0.0.1') + struct.pack('!H', udp.getsockname()[1]))
+                while conn.recv(4096):  # 控制连接关闭时关联结束
+                    pass
+                return
+            conn.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                conn.sendall(data)
+        except OSError:
+            pass
+        finally:
+            if udp is not None:
+                udp.close()
+            conn.close()
+
+    @staticmethod
+    def _echo_udp(udp):
+        while True:
+            try:
+                data, address = udp.recvfrom(65535)
+                udp.sendto(data, address)
+            except OSError:
+                return
+
+
+@pytest.fixture
+def upstream():
+    fake = FakeUpstream()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def socks5_port(upstream):
+    rotator = ProxyRotator()
+    rotator.add_proxy({'proxy': upstream.address, 'protocol': 'SOCKS5', 'status': 'Working',
+                       'location': '本地', 'latency': 0.001, 'score': 100})
+    rotator.set_current_proxy_by_address(upstream.address)
+    http = socket.create_server(('127.0.0.1', 0))
+    socks5 = socket.create_server(('127.0.0.1', 0))
+    ports = http.getsockname()[1], socks5.getsockname()[1]
+    http.close()
+    socks5.close()
+    server = ProxyServer('127.0.0.1', ports[0], '127.0.0.1', ports[1], rotator, queue.Queue(),
+                         upstream_timeout=TIMEOUT, handshake_timeout=TIMEOUT)
+    server.start_all()
+    yield ports[1]
+    server.stop_all()
+
+
+def open_client(port):
+    return socket.create_connection(('127.0.0.1', port), timeout=TIMEOUT)
+
+
+def test_connect_split_at_every_byte(socks5_port):
+    data = GREETING + connect_request('example.com', 80)
+    for cut in (1, 3, 5, len(GREETING) + 1, len(data) - 1):
+        with open_client(socks5_port) as client:
+            client.sendall(data[:cut])
+            client.sendall(data[cut:])
+            assert recv_exactly(client, 2) == b"\x05\x00"
+            assert read_reply(client)[0] == SOCKS5_SUCCEEDED
+            client.sendall(b"ping")
+            assert recv_exactly(client, 4) == b"ping"
+
+
+@pytest.mark.parametrize('host', ['93.184.216.34', 'example.com', '2001:db8::1'])
+def test_connect_address_types(socks5_port, host):
+    with open_client(socks5_port) as client:
+        client.sendall(GREETING)
+        assert recv_exactly(client, 2) == b"\x05\x00"
+        client.sendall(connect_request(host, 443))
+        assert read_reply(client)[0] == SOCKS5_SUCCEEDED
+
+
+def test_no_acceptable_method(socks5_port):
+    with open_client(socks5_port) as client:
+        client.sendall(b"\x05\x01\x02")
+        assert recv_exactly(client, 2) == bytes((5, METHOD_NO_ACCEPTABLE))
+        assert client.recv(1) == b""
+
+
+def test_bind_is_not_supported(socks5_port):
+    with open_client(socks5_port) as client:
+        client.sendall(GREETING + connect_request('10.0.0.1', 21, command=2))
+        assert recv_exactly(client, 2) == b"\x05\x00"
+        assert read_reply(client)[0] == SOCKS5_COMMAND_NOT_SUPPORTED
+
+
+def test_unknown_address_type(socks5_port):
+    with open_client(socks5_port) as client:
+        client.sendall(GREETING + b"\x05\x01\x00\x09" + b"\x00" * 6)
+        assert recv_exactly(client, 2) == b"\x05\x00"
+        assert read_reply(client)[0] == SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED
+
+
+def test_pipelined_data_is_forwarded(socks5_port):
+    payload = b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+    with open_client(socks5_port) as client:
+        # 协商、请求与隧道数据在同一次发送中到达
+        client.sendall(GREETING + connect_request('example.com', 80) + payload)
+        assert recv_exactly(client, 2) == b"\x05\x00"
+        assert read_reply(client)[0] == SOCKS5_SUCCEEDED
+        assert recv_exactly(client, len(payload)) == payload
+
+
+def test_udp_associate_round_trip(socks5_port, upstream):
+    with open_client(socks5_port) as control:
+        control.sendall(GREETING + connect_request('0.0.0.0', 0, command=3))
+        assert recv_exactly(control, 2) == b"\x05\x00"
+        code, relay_host, relay_port = read_reply(control)
+        assert code == SOCKS5_SUCCEEDED
+        assert upstream.requests == [3]
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            udp.settimeout(TIMEOUT)
+            datagram = b"\x00\x00\x00" + connect_request('8.8.8.8', 53)[3:] + b"query"
+            udp.sendto(datagram, (relay_host, relay_port))
+            data, address = udp.recvfrom(65535)
+            assert data == datagram
+            assert address == (relay_host, relay_port)
+
+            # 分片报文 (FRAG 非 0) 被丢弃
+            udp.sendto(b"\x00\x00\x01" + datagram[3:], (relay_host, relay_port))
+            udp.settimeout(0.3)
+            with pytest.raises(socket.timeout):
+                udp.recvfrom(65535)
+
+
+def test_bind_failure_is_reported():
+    busy = socket.create_server(('127.0.0.1', 0))
+    port = busy.getsockname()[1]
+    server = ProxyServer('127.0.0.1', port, '127.0.0.1', port, ProxyRotator(), queue.Queue())
+    try:
+        server.start_all()
+        assert [error.split(':')[0] for error in server.listen_errors] == ["HTTP 127.0.0.1", "SOCKS5 127.0.0.1"]
+    finally:
+        server.stop_all()
+        busy.close()
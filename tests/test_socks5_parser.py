@@ -0,0 +1,158 @@
+# tests/test_socks5_parser.py
+
+"""Socks5Parser 的协议一致性测试：任意切分、三种地址类型、错误应答码与 UDP 报文头。"""
+
+import socket
+import struct
+
+import pytest
+
+from modules.socks5_parser import (NEED_DATA, Greeting, Request, Socks5ParseError, Socks5Parser, parse_udp_header,
+                                   socks5_reply, ATYP_DOMAIN, ATYP_IPV4, ATYP_IPV6, CMD_BIND, CMD_CONNECT,
+                                   CMD_UDP_ASSOCIATE, METHOD_NO_AUTH, SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED,
+                                   SOCKS5_COMMAND_NOT_SUPPORTED)
+
+GREETING = b"\x05\x02\x00\x02"
+
+
+def connect_request(host, port, command=CMD_CONNECT):
+    """编码客户端请求，host 为 IPv4 / IPv6 字面量或域名。"""
+    for family, atyp in ((socket.AF_INET, ATYP_IPV4), (socket.AF_INET6, ATYP_IPV6)):
+        try:
+            address = bytes((atyp,)) + socket.inet_pton(family, host)
+            break
+        except OSError:
+            continue
+    else:
+        name = host.encode('idna')
+        address = bytes((ATYP_DOMAIN, len(name))) + name
+    return bytes((5, command, 0)) + address + struct.pack('!H', port)
+
+
+def drain(parser):
+    """取出当前能解析出的全部事件，直到 NEED_DATA。"""
+    events = []
+    while True:
+        event = parser.next_event()
+        if event is NEED_DATA:
+            return events
+        events.append(event)
+        if isinstance(event, Request):
+            return events
+
+
+def feed_in_pieces(data, cut_points):
+    """按给定位置切分后逐段 feed，每段之后都取一次事件。"""
+    parser = Socks5Parser()
+    events = []
+    start = 0
+    for cut in list(cut_points) + [len(data)]:
+        parser.feed(data[start:cut])
+        events += drain(parser)
+        start = cut
+    return parser, events
+
+
+TARGETS = [
+    ('93.184.216.34', 443, ATYP_IPV4),
+    ('example.com', 80, ATYP_DOMAIN),
+    ('2001:db8::1', 8080, ATYP_IPV6),
+]
+
+
+@pytest.mark.parametrize('host, port, atyp', TARGETS)
+def test_split_at_every_byte(host, port, atyp):
+    data = GREETING + connect_request(host, port)
+    for cut in range(1, len(data)):
+        parser, events = feed_in_pieces(data, [cut])
+        assert [type(e) for e in events] == [Greeting, Request], cut
+        assert events[0].methods == b"\x00\x02"
+        assert (events[1].command, events[1].host, events[1].port, events[1].atyp) == (CMD_CONNECT, host, port, atyp)
+        assert parser.take_buffer() == b""
+
+
+@pytest.mark.parametrize('host, port, atyp', TARGETS)
+def test_one_byte_at_a_time(host, port, atyp):
+    data = GREETING + connect_request(host, port)
+    parser, events = feed_in_pieces(data, range(1, len(data)))
+    assert [type(e) for e in events] == [Greeting, Request]
+    assert (events[1].host, events[1].port, events[1].atyp) == (host, port, atyp)
+
+
+def test_greeting_waits_for_all_methods():
+    parser = Socks5Parser()
+    parser.feed(b"\x05\x03\x00\x01")
+    assert parser.next_event() is NEED_DATA
+    parser.feed(b"\x02")
+    assert parser.next_event().methods == b"\x00\x01\x02"
+
+
+def test_no_acceptable_method_is_visible_to_caller():
+    # 解析器只报告客户端提供的方式，是否接受由服务端决定 (只有 0xFF 时应答 METHOD_NO_ACCEPTABLE)
+    parser = Socks5Parser()
+    parser.feed(b"\x05\x01\xff")
+    event = parser.next_event()
+    assert isinstance(event, Greeting)
+    assert METHOD_NO_AUTH not in event.methods
+
+
+def test_bind_is_parsed_for_command_not_supported():
+    parser = Socks5Parser()
+    parser.feed(GREETING + connect_request('10.0.0.1', 21, command=CMD_BIND))
+    request = drain(parser)[-1]
+    assert request.command == CMD_BIND
+
+
+def test_unknown_atyp_replies_address_type_not_supported():
+    parser = Socks5Parser()
+    parser.feed(GREETING + b"\x05\x01\x00\x09" + b"\x00" * 6)
+    assert isinstance(parser.next_event(), Greeting)
+    with pytest.raises(Socks5ParseError) as info:
+        parser.next_event()
+    assert info.value.reply == SOCKS5_ADDRESS_TYPE_NOT_SUPPORTED
+
+
+def test_bad_version_is_rejected_without_reply():
+    parser = Socks5Parser()
+    parser.feed(b"\x04\x01\x00\x50")
+    with pytest.raises(Socks5ParseError) as info:
+        parser.next_event()
+    assert info.value.reply is None
+
+
+def test_pipelined_bytes_stay_in_buffer():
+    payload = b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+    parser = Socks5Parser()
+    parser.feed(GREETING + connect_request('example.com', 80) + payload)
+    assert [type(e) for e in drain(parser)] == [Greeting, Request]
+    assert parser.take_buffer() == payload
+    assert parser.take_buffer() == b""
+
+
+def test_no_events_after_request():
+    parser = Socks5Parser()
+    parser.feed(GREETING + connect_request('1.2.3.4', 80))
+    drain(parser)
+    with pytest.raises(Socks5ParseError):
+        parser.next_event()
+
+
+@pytest.mark.parametrize('host, atyp, length', [('0.0.0.0', ATYP_IPV4, 10), ('::1', ATYP_IPV6, 22)])
+def test_reply_encoding(host, atyp, length):
+    reply = socks5_reply(SOCKS5_COMMAND_NOT_SUPPORTED, host, 1080)
+    assert reply[:4] == bytes((5, SOCKS5_COMMAND_NOT_SUPPORTED, 0, atyp))
+    assert len(reply) == length
+    assert struct.unpack('!H', reply[-2:])[0] == 1080
+
+
+@pytest.mark.parametrize('host, port, atyp', TARGETS)
+def test_udp_header(host, port, atyp):
+    header = b"\x00\x00\x00" + connect_request(host, port, command=CMD_UDP_ASSOCIATE)[3:]
+    assert parse_udp_header(header + b"payload") == (0, host, port, len(header))
+
+
+def test_udp_header_rejects_garbage():
+    assert parse_udp_header(b"\x00\x00") is None
+    assert parse_udp_header(b"\x01\x00\x00\x01\x7f\x00\x00\x01\x00\x35") is None  # RSV 非 0
+    assert parse_udp_header(b"\x00\x00\x00\x09\x00\x00") is None                  # 未知地址类型
+    assert parse_udp_header(b"\x00\x00\x00\x01\x7f\x00") is None                  # 地址不完整
@@ -0,0 +1,35 @@
+# tests/test_source_health.py
+
+from modules.source_health import SourceHealth
+
+
+def make_health():
+    return SourceHealth(path=None, min_interval=300, failure_threshold=3, cooldown=600)
+
+
+def test_successful_source_is_due_again_immediately():
+    health = make_health()
+    health.record_success('a', ['1.2.3.4:80'], 1, 0.5, now=1000)
+    health.record_success('a', ['1.2.3.4:80'], 0, 0.5, now=1010)  # 内容未变，间隔翻倍
+    assert health.due('a', now=1011) == (True, 'due')
+
+
+def test_failed_source_waits_for_interval():
+    health = make_health()
+    health.record_failure('a', 1.0, now=1000)
+    assert health.due('a', now=1100) == (False, 'fresh')
+    assert health.due('a', now=1300) == (True, 'due')
+
+
+def test_breaker_reports_transitions_only():
+    health = make_health()
+    assert [health.record_failure('a', 1.0, now=1000 + i) for i in range(3)] == [False, False, True]
+    assert health.due('a', now=1100) == (False, 'open')
+    # 冷却结束后试探失败：继续熔断，但不再报告
+    assert health.due('a', now=1700) == (True, 'half_open')
+    assert health.record_failure('a', 1.0, now=1700) is False
+    assert health.due('a', now=1800) == (False, 'open')
+    # 试探成功：报告恢复，之后的成功不再报告
+    assert health.record_success('a', ['1.2.3.4:80'], 1, 0.5, now=3000) is True
+    assert health.record_success('a', ['1.2.3.4:80'], 0, 0.5, now=3001) is False
+    assert health.due('a', now=3002) == (True, 'due')
@@ -0,0 +1,79 @@
+# tests/test_strategies.py
+
+"""选择策略的缓存按环的变化日志增量维护，结果与全量重建一致。"""
+
+import random
+from collections import Counter
+
+from modules import strategies
+from modules.rotator import ProxyRotator
+from modules.strategies import ConsistentHashStrategy, WeightedRandomStrategy
+
+HOSTS = [f"site{i}.example.com" for i in range(200)]
+
+
+def make_rotator(count=20):
+    rotator = ProxyRotator()
+    for i in range(count):
+        rotator.add_proxy({'proxy': f"10.0.0.{i}:1080", 'protocol': 'SOCKS5', 'status': 'Working',
+                           'location': '本地', 'latency': 0.1, 'score': i * 3.5})
+    return rotator
+
+
+def churn(rotator, rng, rounds=300):
+    """随机改分数、实时分数、标记失败、加入新代理，模拟服务运行中的更新。"""
+    for _ in range(rounds):
+        address = f"10.0.0.{rng.randrange(30)}:1080"
+        action = rng.randrange(4)
+        if action == 0:
+            rotator.update_proxy(address, {'score': rng.uniform(0, 100)})
+        elif action == 1:
+            rotator.apply_live_score(address, rng.uniform(0, 100))
+        elif action == 2:
+            rotator.update_proxy(address, {'status': rng.choice(['Working', 'Unavailable'])})
+        else:
+            rotator.add_proxy({'proxy': address, 'protocol': 'SOCKS5', 'status': 'Working',
+                               'location': '本地', 'latency': 0.1, 'score': rng.uniform(0, 100)})
+
+
+def test_consistent_hash_ignores_score_changes(monkeypatch):
+    rotator = make_rotator()
+    strategy = ConsistentHashStrategy()
+    rotator.select_proxy(strategy, HOSTS[0])
+    rebuilds = []
+    monkeypatch.setattr(strategy, '_rebuild', rebuilds.append)
+    before = [rotator.select_proxy(strategy, host)['proxy'] for host in HOSTS]
+    for i in range(20):
+        rotator.apply_live_score(f"10.0.0.{i}:1080", 50)
+        rotator.update_proxy(f"10.0.0.{i}:1080", {'score': 100 - i})
+    assert [rotator.select_proxy(strategy, host)['proxy'] for host in HOSTS] == before
+    assert rebuilds == []
+
+
+def test_consistent_hash_incremental_matches_rebuild():
+    rotator = make_rotator()
+    strategy = ConsistentHashStrategy()
+    rng = random.Random(1)
+    for rounds in (60, 60, 1500, 60):
+        churn(rotator, rng, rounds)
+        fresh = ConsistentHashStrategy()
+        assert ([rotator.select_proxy(strategy, host)['proxy'] for host in HOSTS]
+                == [rotator.select_proxy(fresh, host)['proxy'] for host in HOSTS])
+        assert strategy._points == fresh._points and strategy._owners == fresh._owners
+
+
+def test_weighted_random_weights_follow_scores(monkeypatch):
+    rotator = make_rotator(5)  # 空槽很少，新代理加入时会用尽空槽
+    strategy = WeightedRandomStrategy()
+    rng = random.Random(2)
+    for rounds in (60, 60, 1500, 60):  # 1500 次更新超过日志上限，触发日志重置
+        churn(rotator, rng, rounds)
+        rotator.select_proxy(strategy)
+        ring = rotator._get_ring("All", None)
+        expected = {address: round((max(score, 0) + 1) * 10) for address, score in zip(ring.addresses(), ring.scores())}
+        # 遍历所有抽样点，每个代理被选中的点数应等于其权重
+        points = iter(range(strategy._total))
+        monkeypatch.setattr(strategies.random, 'randrange', lambda total: next(points))
+        picks = Counter(rotator.select_proxy(strategy)['proxy'] for _ in range(sum(expected.values())))
+        monkeypatch.undo()
+        assert picks == expected
@@ -0,0 +1,10 @@
+# tests/test_workers.py
+
+from modules.workers import _split_limits
+
+
+def test_split_limits():
+    options = {'max_connections': 10000, 'max_per_upstream': 3, 'accept_queue_size': 0,
+               'client_rate_limit': 1, 'client_rate_burst': 20, 'idle_timeout': 300}
+    assert _split_limits(options, 8) == {'max_connections': 1250, 'max_per_upstream': 1, 'accept_queue_size': 0,
+                                         'client_rate_limit': 0.125, 'client_rate_burst': 2.5, 'idle_timeout': 300}